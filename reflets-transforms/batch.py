@@ -0,0 +1,264 @@
+# Batch enrichment of companies
+#
+# Runs the FicheEntreprise transform on a list of companies without Maltego : French SIREN / SIRET,
+# or UK, BE and CH company numbers. The companies are fetched concurrently, within the rate limit
+# of the 'http' section of api_keys.yml, and answers already in the local cache cost no token.
+#
+#   python batch.py companies.csv -o result.jsonl
+#   python batch.py sirens.txt -o result.csv --workers 8
+#
+# Input : a CSV file with a header (siren, siret, company_number or id_tax_number column, and an
+# optional country_code / countrycode column), or a text file with one identifier per line,
+# optionally prefixed by its country code ("GB 01234567"). Duplicates are only fetched once.
+#
+# Every company done is added to "<output>.progress" : an interrupted run started again with the
+# same output only fetches the companies left, and those which failed.
+# The output merges the entities of every company : an entity found for several companies (same
+# person, same address) is written once, with the companies it was found for.
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
+
+DEFAULT_WORKERS = 4
+
+# Countries of the FicheEntreprise transform
+COUNTRIES = ( 'FR', 'GB', 'UK', 'BE', 'CH' )
+
+ID_COLUMNS = ( 'siren', 'siret', 'company_number', 'id_tax_number', 'siren_vat' )
+COUNTRY_COLUMNS = ( 'country_code', 'countrycode', 'country' )
+
+
+## INPUT
+
+# SIRET are reduced to their SIREN, spaces and dots are removed
+# UK is GB (as papperindex and pappermirror) : "UK 01234567" and "GB 01234567" are the same company
+def normalize_identifier( country , identifier ) :
+    country = country.strip().upper()
+    if country == 'UK' :
+        country = 'GB'
+    identifier = identifier.strip().replace(" ", "").replace(".", "")
+    if country == 'FR' and len(identifier) == 14 and identifier.isdigit() :
+        identifier = identifier[:9]
+    return country, identifier
+
+def read_identifiers( path , default_country ) :
+    with open(path, newline='', encoding='utf-8-sig') as f :
+        content = f.read()
+
+    lines = [ line for line in content.splitlines() if line.strip() != "" ]
+    if len(lines) == 0 :
+        return []
+
+    # CSV file with a header
+    dialect = csv.excel
+    if any(delimiter in lines[0] for delimiter in ",;\t") :
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=",;\t")
+    columns = [ column.strip().lower() for column in next(csv.reader([ lines[0] ], dialect)) ]
+    id_column = next((column for column in ID_COLUMNS if column in columns), None)
+    if id_column is not None :
+        country_column = next((column for column in COUNTRY_COLUMNS if column in columns), None)
+        result = []
+        for row in csv.reader(lines[1:], dialect) :
+            row = dict(zip(columns, row))
+            identifier = row.get(id_column) or ""
+            country = (row.get(country_column) if country_column is not None else None) or default_country
+            if identifier.strip() != "" :
+                result.append(( country, identifier ))
+        return result
+
+    # One identifier by line, optionally prefixed by its country code
+    result = []
+    for line in lines :
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2 and parts[0].upper() in COUNTRIES :
+            result.append(( parts[0], parts[1] ))
+        else :
+            result.append(( default_country, line ))
+    return result
+
+# Normalized identifiers without duplicates, in the input order
+def get_companies( identifiers ) :
+    companies = []
+    seen = set()
+    for country, identifier in identifiers :
+        country, identifier = normalize_identifier(country, identifier)
+        key = f"{country}:{identifier}"
+        if key not in seen :
+            seen.add(key)
+            companies.append(( key, country, identifier ))
+    return companies
+
+
+## ENRICHMENT
+
+# Request of a local transform on an entity with the given properties
+def make_request_msg( value , properties ) :
+    request = MaltegoMsg(LocalArgs=[ value ])
+    request.Properties = dict(properties)
+    return request
+
+def entity_to_dict( entity ) :
+    result = { 'type': entity.entityType, 'value': entity.value, 'properties': {}, 'strict': [] }
+    for name, display, matching, value in entity.additionalFields :
+        if name == 'link#maltego.link.label' :
+            result['link_label'] = value
+        elif name == 'link#maltego.link.direction' :
+            result['reversed'] = value == 'output-to-input'
+        elif name == 'notes#' :
+            result['note'] = value
+        elif not name.startswith('link#') :
+            result['properties'][name] = value
+            if matching == 'strict' :
+                result['strict'].append(name)
+    return result
+
+# Run FicheEntreprise on one company
+def enrich( country , identifier ) :
+    from transforms.FicheEntreprise import FicheEntreprise
+
+    request = make_request_msg(identifier, { 'id_tax_number': identifier, 'countrycode': country })
+    response = MaltegoTransform()
+    FicheEntreprise.create_entities(request, response)
+
+    errors = [ message[1].strip() for message in response.UIMessages if message[1].startswith("Error") ]
+    if len(errors) > 0 :
+        return { 'error': " / ".join(errors) }
+    return { 'entities': [ entity_to_dict(entity) for entity in response.entities ] }
+
+
+## PROGRESS
+
+def load_progress( path ) :
+    done = {}
+    if not os.path.exists(path) :
+        return done
+    with open(path, encoding='utf-8') as f :
+        for line in f :
+            try :
+                record = json.loads(line)
+            except ValueError :
+                # Line cut by an interruption
+                continue
+            done[record['id']] = record
+    return done
+
+def run( companies , progress_path , workers ) :
+    done = load_progress(progress_path)
+    todo = [ company for company in companies if 'entities' not in done.get(company[0], {}) ]
+    sys.stderr.write(f"{len(companies)} companies, {len(companies) - len(todo)} already done\n")
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    with open(progress_path, 'a', encoding='utf-8') as progress :
+        futures = { executor.submit(enrich, country, identifier): key for key, country, identifier in todo }
+        try :
+            for count, future in enumerate(as_completed(futures), 1) :
+                key = futures[future]
+                try :
+                    record = future.result()
+                except Exception as e :
+                    record = { 'error': str(e) }
+                record['id'] = key
+                done[key] = record
+                progress.write(json.dumps(record, ensure_ascii=False) + "\n")
+                progress.flush()
+                status = record['error'] if 'error' in record else f"{len(record['entities'])} entities"
+                sys.stderr.write(f"[{count}/{len(todo)}] {key} : {status}\n")
+        except KeyboardInterrupt :
+            executor.shutdown(wait=True, cancel_futures=True)
+            sys.stderr.write("Interrupted : run the same command again to resume\n")
+            raise
+    executor.shutdown()
+    return done
+
+
+## OUTPUT
+
+# Entities found for several companies are merged : same type, value and strict properties
+def merge_entities( companies , done ) :
+    merged = {}
+    for key, country, identifier in companies :
+        record = done.get(key, {})
+        for entity in record.get('entities', []) :
+            strict = tuple(sorted( (name, entity['properties'][name]) for name in entity['strict'] ))
+            entity_key = ( entity['type'], entity['value'], strict )
+            item = merged.get(entity_key)
+            if item is None :
+                item = { 'type': entity['type'], 'value': entity['value'], 'properties': {}, 'sources': [] }
+                merged[entity_key] = item
+            for name, value in entity['properties'].items() :
+                item['properties'].setdefault(name, value)
+            if 'note' in entity :
+                item.setdefault('note', entity['note'])
+            source = { 'id': key }
+            if 'link_label' in entity :
+                source['link_label'] = entity['link_label']
+            if source not in item['sources'] :
+                item['sources'].append(source)
+    return list(merged.values())
+
+def write_output( path , entities , errors , output_format ) :
+    with open(path + ".tmp", 'w', newline='', encoding='utf-8') as f :
+        if output_format == 'csv' :
+            writer = csv.writer(f)
+            writer.writerow([ 'type', 'value', 'sources', 'properties', 'note' ])
+            for entity in entities :
+                writer.writerow([ entity['type'], entity['value'],
+                                  " | ".join(source['id'] for source in entity['sources']),
+                                  json.dumps(entity['properties'], ensure_ascii=False),
+                                  entity.get('note', "") ])
+        else :
+            for entity in entities :
+                f.write(json.dumps(entity, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+    if len(errors) > 0 :
+        with open(path + ".errors", 'w', encoding='utf-8') as f :
+            for key, error in errors :
+                f.write(f"{key}\t{error}\n")
+    elif os.path.exists(path + ".errors") :
+        os.remove(path + ".errors")
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Run FicheEntreprise on a list of companies")
+    parser.add_argument('input', help="CSV file, or text file with one identifier by line")
+    parser.add_argument('-o', '--output', required=True, help="merged result (.jsonl or .csv)")
+    parser.add_argument('--country', default='FR', help="country code of the identifiers without one (default FR)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="companies fetched at the same time")
+    parser.add_argument('--format', choices=[ 'jsonl', 'csv' ], help="output format (default : from the output extension)")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    companies = get_companies(read_identifiers(args.input, args.country))
+    unknown = [ key for key, country, identifier in companies if country not in COUNTRIES ]
+    if len(unknown) > 0 :
+        sys.stderr.write(f"Unsupported country code, ignored : {', '.join(unknown)}\n")
+        companies = [ company for company in companies if company[1] in COUNTRIES ]
+
+    try :
+        done = run(companies, args.output + ".progress", args.workers)
+    except KeyboardInterrupt :
+        return 130
+
+    # Usage of the API by this run (see transforms/pappermetrics.py)
+    from transforms import pappermetrics
+    pappermetrics.flush()
+
+    entities = merge_entities(companies, done)
+    errors = [ (key, done[key]['error']) for key, country, identifier in companies if 'error' in done.get(key, {}) ]
+    write_output(args.output, entities, errors, output_format)
+    sys.stderr.write(f"{len(entities)} entities written to {args.output}")
+    if len(errors) > 0 :
+        sys.stderr.write(f", {len(errors)} companies failed (see {args.output}.errors, run again to retry them)")
+    sys.stderr.write("\n")
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# Cold start time of a local transform, as Maltego runs it (one new interpreter by run)
+#
+#   python benchmarks/coldstart.py [runs]
+#
+# Compares the complete maltego-trx startup (MALTEGO_FAST_START=0), the fast start of launcher.py
+# (MALTEGO_WORKER=0) and the client of the persistent worker (worker.py, already started).
+# The transform is called without properties : it fails before querying the API, so only the
+# startup and the dispatch are measured. Both outputs must be identical.
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMAND = [ sys.executable, 'project.py', 'local', 'rechercheSiege', 'bench' ]
+
+
+def measure( variables , runs ) :
+    env = dict(os.environ)
+    env.update(variables)
+    timings = []
+    output = None
+    for i in range(runs) :
+        start = time.perf_counter()
+        output = subprocess.run(COMMAND, cwd=PROJECT_DIR, env=env, capture_output=True).stdout
+        timings.append(time.perf_counter() - start)
+    return timings, output
+
+
+if __name__ == '__main__' :
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    before, output_before = measure({ 'MALTEGO_FAST_START': '0' }, runs)
+    fast, output_fast = measure({ 'MALTEGO_WORKER': '0' }, runs)
+    # First call to start the worker
+    measure({}, 1)
+    worker, output_worker = measure({}, runs)
+
+    print(f"Complete startup : median {statistics.median(before) * 1000:.0f} ms, min {min(before) * 1000:.0f} ms")
+    print(f"Fast start       : median {statistics.median(fast) * 1000:.0f} ms, min {min(fast) * 1000:.0f} ms")
+    print(f"Worker client    : median {statistics.median(worker) * 1000:.0f} ms, min {min(worker) * 1000:.0f} ms")
+    print(f"Identical output : {output_before == output_fast == output_worker}")
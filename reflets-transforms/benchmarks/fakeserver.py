@@ -0,0 +1,331 @@
+# Stand-in of the Pappers FR V2 and IN V1 APIs : the transforms, the retries and the concurrency
+# can be load-tested offline, without spending tokens
+#
+#   python benchmarks/fakeserver.py [--port 8080] [--latency uniform:50:300] [--fault 429=0.05] ...
+#
+# Then point the transforms to it in the "pappers" section of api_keys.yml (fr_url, in_url), or :
+#
+#   PAPPERS_FR_URL=http://127.0.0.1:8080/v2 PAPPERS_IN_URL=http://127.0.0.1:8080/v1 python project.py local ...
+#
+# Answers, in the shape of the real ones (see fixtures.py). The same request always gets the same answer.
+#   /v2/entreprise, /v1/company : the company of a fixture of fixtures.py with this siren / company
+#       number (recorded, or generated), otherwise a company of random size generated for it
+#   /v2/recherche, /v2/recherche-dirigeants, /v2/recherche-beneficiaires, /v1/search, /v1/search-officers :
+#       --results results by search, 'par_page' by page (20 when absent), the next pages are empty.
+#       The people found have the searched names, so that the filters of the transforms keep them.
+#   /v2/document/telechargement, /v1/download-file : a document of random size (20 to 400 KB) for
+#       the 'token', served in parts for the Range requests of the resumed downloads
+# Latency (milliseconds) : constant:MS, uniform:MIN:MAX, normal:MEAN:STDDEV or lognormal:MEDIAN:SIGMA,
+#   for every endpoint, or for one with --latency /v2/entreprise=lognormal:400:0.5
+# Faults : --fault STATUS=PROBABILITY, for 401, 404, 429 and 503 (sent with a Retry-After of
+#   --retry-after seconds). Requests without api_token, or with another key than --api-key, get 401.
+# The number of answers by endpoint and status is printed on exit (Ctrl-C).
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+DEFAULT_PORT = 8080
+DEFAULT_RESULTS = 100
+DEFAULT_PAR_PAGE = 20
+DEFAULT_RETRY_AFTER = 1
+
+FAULTS = ( 401, 404, 429, 503 )
+ERRORS = { 401: "Bad API key", 404: "Not found", 429: "Too many requests", 503: "Service unavailable" }
+
+COMPANY_ENDPOINTS = { '/v2/entreprise': 'siren', '/v1/company': 'company_number' }
+SEARCH_ENDPOINTS = ( '/v2/recherche', '/v2/recherche-dirigeants', '/v2/recherche-beneficiaires', '/v1/search', '/v1/search-officers' )
+DOCUMENT_ENDPOINTS = ( '/v2/document/telechargement', '/v1/download-file' )
+
+# Parameters which do not change the answer
+PAGE_PARAMETERS = ( 'api_token', 'page', 'par_page' )
+
+
+## LATENCY
+
+# Latency in milliseconds : "constant:50", "uniform:20:200", "normal:100:30", "lognormal:100:0.5"
+def parse_latency( text ) :
+    name, *values = text.split(':')
+    try :
+        values = [ float(value) for value in values ]
+    except ValueError :
+        raise Exception(f"Bad latency : {text}")
+    if name == 'constant' and len(values) == 1 :
+        return lambda rng : values[0]
+    if name == 'uniform' and len(values) == 2 :
+        return lambda rng : rng.uniform(values[0], values[1])
+    if name == 'normal' and len(values) == 2 :
+        return lambda rng : max(0, rng.gauss(values[0], values[1]))
+    if name == 'lognormal' and len(values) == 2 :
+        return lambda rng : values[0] * rng.lognormvariate(0, values[1])
+    raise Exception(f"Bad latency : {text}")
+
+# "/v2/entreprise=constant:500" -> ( "/v2/entreprise", latency ), "constant:500" -> ( None, latency )
+def parse_endpoint_latency( text ) :
+    if '=' in text :
+        endpoint, text = text.split('=', 1)
+        return endpoint, parse_latency(text)
+    return None, parse_latency(text)
+
+def parse_fault( text ) :
+    try :
+        status, probability = text.split('=')
+        status, probability = int(status), float(probability)
+    except ValueError :
+        raise Exception(f"Bad fault : {text}")
+    if status not in FAULTS :
+        raise Exception(f"Bad fault : {status} is not one of {', '.join(str(fault) for fault in FAULTS)}")
+    return status, probability
+
+
+## ANSWERS
+
+class FakePappers :
+    def __init__( self , results=DEFAULT_RESULTS , latencies=None , faults=None , retry_after=DEFAULT_RETRY_AFTER , api_key=None , seed=fixtures.SEED ) :
+        self.results = results
+        self.latencies = latencies or {}
+        self.faults = faults or {}
+        self.retry_after = retry_after
+        self.api_key = api_key
+        self.seed = seed
+        self.companies = None
+        self.counters = {}
+        self.lock = threading.Lock()
+        # Draws of the latencies and of the faults, in the order of the requests
+        self.rng = random.Random(f"{seed}:server")
+
+    # ( status , headers , answer ) of a request
+    def handle( self , path , params ) :
+        with self.lock :
+            latency = self.latencies.get(path, self.latencies.get(None))
+            delay = latency(self.rng) / 1000 if latency is not None else 0
+            draw = self.rng.random()
+        if delay > 0 :
+            time.sleep(delay)
+
+        status, headers, answer = self.answer(path, params, draw)
+        with self.lock :
+            key = ( path, status )
+            self.counters[key] = self.counters.get(key, 0) + 1
+        return status, headers, answer
+
+    def answer( self , path , params , draw ) :
+        if path not in COMPANY_ENDPOINTS and path not in SEARCH_ENDPOINTS and path not in DOCUMENT_ENDPOINTS :
+            return self.error(404)
+        if not params.get('api_token') or ( self.api_key is not None and params['api_token'] != self.api_key ) :
+            return self.error(401)
+
+        # One draw by request : the probabilities of the faults add up
+        for status in FAULTS :
+            probability = self.faults.get(status, 0)
+            if draw < probability :
+                return self.error(status)
+            draw -= probability
+
+        if path in COMPANY_ENDPOINTS :
+            identifier = params.get(COMPANY_ENDPOINTS[path])
+            if not identifier :
+                return self.error(404)
+            return 200, {}, self.make_company(path, identifier)
+        if path in DOCUMENT_ENDPOINTS :
+            if not params.get('token') :
+                return self.error(404)
+            return 200, { 'Content-Type': 'application/pdf' }, self.make_document(params['token'])
+        return 200, {}, self.make_search_page(path, params)
+
+    def error( self , status ) :
+        headers = {}
+        if status in ( 429, 503 ) :
+            headers['Retry-After'] = str(self.retry_after)
+        return status, headers, { 'statusCode': status, 'error': ERRORS[status] }
+
+    def get_rng( self , *key ) :
+        return random.Random(":".join(str(item) for item in ( self.seed, ) + key))
+
+    # Companies of the fixtures, by endpoint and identifier, loaded on first use
+    def get_fixture_companies( self ) :
+        if self.companies is None :
+            companies = {}
+            for name, ( transform, url, properties, generate ) in fixtures.FIXTURES.items() :
+                path = urlparse(url).path
+                if path in COMPANY_ENDPOINTS :
+                    company = fixtures.load(name)['pages'][0]
+                    companies[( path, str(company[COMPANY_ENDPOINTS[path]]) )] = company
+            self.companies = companies
+        return self.companies
+
+    def make_company( self , path , identifier ) :
+        company = self.get_fixture_companies().get(( path, identifier ))
+        if company is not None :
+            return company
+
+        rng = self.get_rng(path, identifier)
+        if path == '/v2/entreprise' :
+            company = fixtures.make_entreprise(rng, rng.randint(1, 40), rng.randint(0, 5), rng.randint(1, 20),
+                                               rng.randint(0, 30), rng.randint(0, 10), rng.randint(0, 20))
+        else :
+            company = fixtures.make_company(rng, rng.randint(1, 30), rng.randint(0, 5), rng.randint(0, 20),
+                                            rng.randint(0, 5), rng.randint(0, 10))
+        company[COMPANY_ENDPOINTS[path]] = identifier
+        return company
+
+    # Page of a search : the results of the page, out of self.results for the search
+    def make_search_page( self , path , params ) :
+        try :
+            page = max(1, int(params.get('page', 1)))
+            par_page = max(1, int(params.get('par_page', DEFAULT_PAR_PAGE)))
+        except ValueError :
+            page, par_page = 1, DEFAULT_PAR_PAGE
+        count = max(0, min(par_page, self.results - (page - 1) * par_page))
+
+        search = sorted( (k, v) for k, v in params.items() if k not in PAGE_PARAMETERS )
+        rng = self.get_rng(path, json.dumps(search, ensure_ascii=False), page, par_page)
+        firstname, lastname = get_names(params.get('q'))
+
+        if path == '/v2/recherche' :
+            return fixtures.make_siege_page(rng, count, self.results)
+        if path == '/v1/search' :
+            return fixtures.make_companies_page(rng, count, self.results)
+        if path == '/v1/search-officers' :
+            return fixtures.make_officers_page(rng, firstname, lastname, count, self.results)
+
+        month = get_month(params.get('date_de_naissance_dirigeant_min'))
+        if month is None :
+            month = f"{rng.randint(1940, 1995)}-{rng.randint(1, 12):02d}"
+        if path == '/v2/recherche-beneficiaires' :
+            return fixtures.make_beneficiaires_page(rng, firstname, lastname, month, count, self.results)
+        return fixtures.make_dirigeants_page(rng, firstname, lastname, month, count, self.results)
+
+    # Content of a document : the same token always gets the same bytes
+    def make_document( self , token ) :
+        rng = self.get_rng('document', token)
+        return b"%PDF-1.4\n" + rng.randbytes(rng.randint(20, 400) * 1024)
+
+    def get_counters( self ) :
+        with self.lock :
+            return dict(self.counters)
+
+
+# "Jean Martin" -> ( "Jean", "Martin" ), as the transforms build the 'q' of the people searches
+def get_names( q ) :
+    words = (q or "").split(' ', 1)
+    if len(words) < 2 :
+        return 'Jean', words[0] or 'Martin'
+    return words[0], words[1]
+
+# Month of a "1962-03-15" date filter
+def get_month( date ) :
+    if not date or len(date) < 7 :
+        return None
+    return date[:7]
+
+
+## HTTP SERVER
+
+def make_handler( fake , verbose=False ) :
+    class Handler( BaseHTTPRequestHandler ) :
+        # Kept-alive connections, as the pools of the transforms expect
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET( self ) :
+            url = urlparse(self.path)
+            status, headers, answer = fake.handle(url.path, dict(parse_qsl(url.query)))
+            if isinstance(answer, bytes) :
+                status, headers, content = get_range(status, headers, answer, self.headers.get('Range'))
+            else :
+                content = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+                headers = dict(headers, **{ 'Content-Type': 'application/json; charset=utf-8' })
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in headers.items() :
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message( self , format , *args ) :
+            if verbose :
+                super().log_message(format, *args)
+
+    return Handler
+
+# Part of a document asked by a "Range: bytes=START-" header : 206, or 416 after its end
+def get_range( status , headers , content , range_header ) :
+    headers = dict(headers, **{ 'Accept-Ranges': 'bytes' })
+    if status != 200 or not range_header or not range_header.startswith('bytes=') :
+        return status, headers, content
+    try :
+        start = int(range_header[len('bytes='):].split('-')[0])
+    except ValueError :
+        return status, headers, content
+    if start >= len(content) :
+        headers['Content-Range'] = f"bytes */{len(content)}"
+        return 416, headers, b""
+    headers['Content-Range'] = f"bytes {start}-{len(content) - 1}/{len(content)}"
+    return 206, headers, content[start:]
+
+def make_server( fake , host='127.0.0.1' , port=DEFAULT_PORT , verbose=False ) :
+    server = ThreadingHTTPServer(( host, port ), make_handler(fake, verbose))
+    server.daemon_threads = True
+    return server
+
+# Server running in a background thread (port 0 : any free port), ex : for a load test script
+def start( fake , host='127.0.0.1' , port=0 ) :
+    server = make_server(fake, host, port)
+    threading.Thread(target=server.serve_forever, name="fake-pappers", daemon=True).start()
+    return server
+
+def get_base_urls( server ) :
+    host, port = server.server_address[:2]
+    return { 'fr': f"http://{host}:{port}/v2", 'in': f"http://{host}:{port}/v1" }
+
+def print_counters( fake ) :
+    counters = fake.get_counters()
+    for ( path, status ), count in sorted(counters.items()) :
+        print(f"{path:<30} {status}  {count:8d}")
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Stand-in of the Pappers FR V2 and IN V1 APIs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--results', type=int, default=DEFAULT_RESULTS, help="number of results of every search")
+    parser.add_argument('--latency', action='append', default=[], help="latency, ex : uniform:50:300 or /v2/entreprise=constant:500")
+    parser.add_argument('--fault', action='append', default=[], help="injected error, ex : 429=0.05")
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_RETRY_AFTER, help="Retry-After of the 429 and 503 answers, in seconds")
+    parser.add_argument('--api-key', help="only key accepted (default : any)")
+    parser.add_argument('--seed', default=fixtures.SEED)
+    parser.add_argument('--verbose', action='store_true', help="print every request")
+    args = parser.parse_args(argv)
+
+    try :
+        latencies = dict(parse_endpoint_latency(text) for text in args.latency)
+        faults = dict(parse_fault(text) for text in args.fault)
+    except Exception as e :
+        parser.error(str(e))
+
+    fake = FakePappers(args.results, latencies, faults, args.retry_after, args.api_key, args.seed)
+    server = make_server(fake, args.host, args.port, args.verbose)
+    urls = get_base_urls(server)
+    print(f"Pappers stand-in on {urls['fr']} and {urls['in']} (Ctrl-C to stop)")
+    try :
+        server.serve_forever()
+    except KeyboardInterrupt :
+        pass
+    finally :
+        server.server_close()
+        print_counters(fake)
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
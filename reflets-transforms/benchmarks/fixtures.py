@@ -0,0 +1,344 @@
+# Fixtures of the benchmark suite (see suite.py) : answers of the Pappers FR V2 and IN V1 APIs
+#
+#   python benchmarks/fixtures.py record NAME [property=value ...]
+#
+# Every fixture is the answer (or the 5 pages of answers) a transform receives for one entity.
+# They are generated with a fixed seed in the shape of real answers : a small SARL, a holding with
+# hundreds of representants, a retail chain with thousands of etablissements, 5 pages of searches.
+# "record" runs the transform of the fixture on the real API (with the configured key, spending
+# credits) and saves the answers in benchmarks/fixtures/NAME.json : the suite then uses them
+# instead of the generated ones. Ex : record fr_holding id_tax_number=552032534
+# The generators of the pages are also used by fakeserver.py to answer any search.
+
+import json
+import os
+import random
+import sys
+from urllib.parse import urlparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARKS_DIR)
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+SEED = 20240101
+RESULTS_BY_PAGE = 20
+SEARCH_PAGES = 5
+
+FIRSTNAMES = [ 'Jean', 'Marie', 'Pierre', 'Nathalie', 'François', 'Isabelle', 'Jean-Luc', 'Sophie', 'Éric', 'Hélène', 'Olivier', 'Camille' ]
+LASTNAMES = [ 'MARTIN', 'BERNARD', 'DUBOIS', 'THOMAS', 'ROBERT', 'RICHARD', 'PETIT', 'DURAND', 'LEROY', 'MOREAU', 'LEFÈVRE', 'GARNIER' ]
+QUALITES = [ 'Président', 'Directeur général', 'Directeur général délégué', 'Gérant', 'Administrateur', 'Membre du conseil de surveillance', 'Autre' ]
+QUALITES_MORALES = [ 'Commissaire aux comptes titulaire', 'Commissaire aux comptes suppléant', 'Administrateur', 'Président' ]
+FORMES = [ 'SAS, société par actions simplifiée', 'SARL, société à responsabilité limitée', 'SA à conseil d\'administration' ]
+NAF = [ 'Activités des sociétés holding', 'Commerce de détail en magasin non spécialisé', 'Conseil en systèmes et logiciels informatiques', 'Location de terrains et d\'autres biens immobiliers' ]
+STREETS = [ 'rue de Rivoli', 'avenue des Champs-Élysées', 'boulevard Haussmann', 'rue du Faubourg Saint-Honoré', 'place Bellecour', 'cours Mirabeau', 'rue Sainte-Catherine' ]
+CITIES = [ ( '75001', 'PARIS 1' ), ( '75008', 'PARIS 8' ), ( '69002', 'LYON 2' ), ( '13100', 'AIX-EN-PROVENCE' ), ( '33000', 'BORDEAUX' ), ( '59000', 'LILLE' ) ]
+DECISIONS = [ ( 'Procès-verbal d\'assemblée générale', 'Changement de commissaire aux comptes' ),
+              ( 'Statuts mis à jour', 'Augmentation du capital social' ),
+              ( 'Décision(s) du président', 'Transfert du siège social' ),
+              ( 'Procès-verbal du conseil d\'administration', 'Nomination de directeur général délégué' ) ]
+UK_CITIES = [ ( 'EC2V 7HH', 'LONDON' ), ( 'M1 1AE', 'MANCHESTER' ), ( 'B1 1BB', 'BIRMINGHAM' ) ]
+UK_ROLES = [ 'director', 'secretary', 'llp-member' ]
+
+
+## FR V2
+
+def make_date( rng , start=1990 , end=2023 ) :
+    return f"{rng.randint(start, end)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+def make_siren( rng ) :
+    return f"{rng.randint(300000000, 999999999)}"
+
+def make_address( rng ) :
+    code_postal, ville = rng.choice(CITIES)
+    return { 'adresse_ligne_1': f"{rng.randint(1, 250)} {rng.choice(STREETS)}",
+             'adresse_ligne_2': rng.choice([ None, None, "Bâtiment B", "CS 70001" ]),
+             'code_postal': code_postal, 'ville': ville, 'pays': 'France', 'code_pays': 'FR' }
+
+def make_etablissement( rng , siren , siege=False ) :
+    etablissement = { 'siret': siren + f"{rng.randint(10, 99999):05d}", 'siege': siege,
+                      'libelle_code_naf': rng.choice(NAF), 'date_de_creation': make_date(rng),
+                      'date_cessation': rng.choice([ None, None, None, make_date(rng, 2015) ]),
+                      'enseigne': None, 'nom_commercial': None }
+    etablissement.update(make_address(rng))
+    return etablissement
+
+def make_identity( rng ) :
+    year, month = rng.randint(1940, 1995), rng.randint(1, 12)
+    firstname = rng.choice(FIRSTNAMES)
+    return { 'nom': rng.choice(LASTNAMES), 'prenom': f"{firstname} {rng.choice(FIRSTNAMES)}", 'prenom_usuel': firstname,
+             'date_de_naissance_formatee': f"{month:02d}/{year}", 'date_de_naissance_rgpd': f"{year}-{month:02d}",
+             'nationalite': 'Française' }
+
+def make_representant( rng ) :
+    if rng.random() < 0.3 :
+        representant = { 'personne_morale': True, 'qualite': rng.choice(QUALITES_MORALES), 'siren': make_siren(rng),
+                         'nom_complet': f"{rng.choice(LASTNAMES)} {rng.choice([ 'AUDIT', 'CONSEIL', 'HOLDING', 'PARTICIPATIONS' ])}",
+                         'forme_juridique': rng.choice(FORMES) }
+        representant.update(make_address(rng))
+    else :
+        representant = { 'personne_morale': False, 'qualite': rng.choice(QUALITES) }
+        representant.update(make_identity(rng))
+    representant['date_prise_de_poste'] = make_date(rng)
+    representant['actuel'] = rng.random() < 0.7
+    return representant
+
+def make_beneficiaire( rng ) :
+    beneficiaire = make_identity(rng)
+    parts = round(rng.uniform(25, 100), 2)
+    beneficiaire.update({ 'pourcentage_parts': parts, 'pourcentage_votes': parts })
+    return beneficiaire
+
+def make_depot_acte( rng ) :
+    token = "%032x" % rng.getrandbits(128)
+    return { 'nom_fichier_pdf': f"Acte_{token[:8]}.pdf", 'token': token, 'date_depot_formate': make_date(rng),
+             'actes': [ { 'type': decision[0], 'decision': decision[1] } for decision in rng.sample(DECISIONS, rng.randint(1, 3)) ] }
+
+def make_compte( rng ) :
+    token = "%032x" % rng.getrandbits(128)
+    return { 'nom_fichier_pdf': f"Comptes_{token[:8]}.pdf", 'token': token,
+             'nom_fichier_xlsx': f"Comptes_{token[:8]}.xlsx", 'token_xlsx': token[::-1], 'date_depot_formate': make_date(rng) }
+
+def make_bodacc( rng , name ) :
+    address = make_address(rng)
+    return { 'numero_parution': f"{rng.randint(2000, 2023)}{rng.randint(1, 250):04d}", 'date': make_date(rng),
+             'type': rng.choice([ 'Modification', 'Dépôt des comptes', 'Création' ]), 'denomination': name,
+             'descriptif': rng.choice(DECISIONS)[1] + " à compter du " + make_date(rng),
+             'adresse': f"{address['adresse_ligne_1']} {address['code_postal']} {address['ville']}" }
+
+# Answer of /v2/entreprise
+def make_entreprise( rng , representants , beneficiaires , etablissements , actes , comptes , bodacc ) :
+    siren = make_siren(rng)
+    name = f"{rng.choice(LASTNAMES)} {rng.choice([ 'DISTRIBUTION', 'HOLDING', 'INVEST', 'SERVICES' ])}"
+    siege = make_etablissement(rng, siren, True)
+    entreprise = { 'siren': siren, 'nom_entreprise': name, 'forme_juridique': rng.choice(FORMES),
+                   'libelle_code_naf': rng.choice(NAF), 'date_creation': make_date(rng), 'date_cessation': None,
+                   'greffe': siege['ville'], 'numero_rcs': f"{siren} R.C.S. {siege['ville']}",
+                   'numero_tva_intracommunautaire': f"FR{rng.randint(10, 99)}{siren}", 'siege': siege }
+    entreprise['representants'] = [ make_representant(rng) for i in range(representants) ]
+    entreprise['beneficiaires_effectifs'] = [ make_beneficiaire(rng) for i in range(beneficiaires) ]
+    entreprise['etablissements'] = [ siege ] + [ make_etablissement(rng, siren) for i in range(etablissements - 1) ]
+    entreprise['depots_actes'] = [ make_depot_acte(rng) for i in range(actes) ]
+    entreprise['comptes'] = [ make_compte(rng) for i in range(comptes) ]
+    entreprise['publications_bodacc'] = [ make_bodacc(rng, name) for i in range(bodacc) ]
+    return entreprise
+
+# Short company of the search results
+def make_search_entreprise( rng ) :
+    siren = make_siren(rng)
+    return { 'siren': siren, 'nom_entreprise': f"{rng.choice(LASTNAMES)} {rng.choice([ 'SAS', 'SARL', 'SCI' ])}",
+             'forme_juridique': rng.choice(FORMES), 'libelle_code_naf': rng.choice(NAF), 'date_creation': make_date(rng),
+             'siege': make_etablissement(rng, siren, True) }
+
+# Page of /v2/recherche-dirigeants : the same person in several companies
+def make_dirigeants_page( rng , firstname , lastname , month , count , total ) :
+    resultats = []
+    for i in range(count) :
+        dirigeant = { 'prenom_usuel': firstname, 'prenom': firstname, 'nom': lastname.upper(), 'date_de_naissance_rgpd': month, 'entreprises': [] }
+        for j in range(rng.randint(1, 4)) :
+            entreprise = make_search_entreprise(rng)
+            entreprise['dirigeant'] = { 'qualites': [ rng.choice(QUALITES) ], 'actuel': rng.random() < 0.7, 'date_prise_de_poste': make_date(rng) }
+            dirigeant['entreprises'].append(entreprise)
+        resultats.append(dirigeant)
+    return { 'resultats': resultats, 'total': total }
+
+def make_search_dirigeants( rng , firstname , lastname , month ) :
+    return [ make_dirigeants_page(rng, firstname, lastname, month, RESULTS_BY_PAGE, RESULTS_BY_PAGE * SEARCH_PAGES) for page in range(SEARCH_PAGES) ]
+
+# Page of /v2/recherche-beneficiaires : the same person owning shares of several companies
+def make_beneficiaires_page( rng , firstname , lastname , month , count , total ) :
+    resultats = []
+    for i in range(count) :
+        beneficiaire = { 'prenom_usuel': firstname, 'prenom': firstname, 'nom': lastname.upper(), 'date_de_naissance_rgpd': month, 'entreprises': [] }
+        for j in range(rng.randint(1, 3)) :
+            entreprise = make_search_entreprise(rng)
+            parts = round(rng.uniform(25, 100), 2)
+            entreprise['beneficiaire'] = { 'pourcentage_parts': parts, 'pourcentage_votes': parts }
+            beneficiaire['entreprises'].append(entreprise)
+        resultats.append(beneficiaire)
+    return { 'resultats': resultats, 'total': total }
+
+# Page of /v2/recherche on an address : companies with the documents mentioning it
+def make_siege_page( rng , count , total ) :
+    resultats = []
+    for i in range(count) :
+        entreprise = make_search_entreprise(rng)
+        entreprise['documents'] = [ { 'type': rng.choice(DECISIONS)[0], 'date_depot': make_date(rng),
+                                      'mentions': [ f"... le siège est transféré au <em>{make_address(rng)['adresse_ligne_1']}</em> ..." for k in range(rng.randint(1, 3)) ] }
+                                    for j in range(rng.randint(1, 5)) ]
+        resultats.append(entreprise)
+    return { 'resultats': resultats, 'total': total }
+
+def make_search_siege( rng ) :
+    return [ make_siege_page(rng, RESULTS_BY_PAGE, RESULTS_BY_PAGE * SEARCH_PAGES) for page in range(SEARCH_PAGES) ]
+
+
+## IN V1
+
+def make_uk_address( rng ) :
+    postal_code, city = rng.choice(UK_CITIES)
+    return { 'address_line_1': f"{rng.randint(1, 200)} {rng.choice([ 'High Street', 'King Street', 'Queen Victoria Street' ])}",
+             'address_line_2': rng.choice([ None, "Floor 3" ]), 'postal_code': postal_code, 'city': city,
+             'country': 'United Kingdom', 'country_code': 'UK' }
+
+def make_officer( rng ) :
+    if rng.random() < 0.2 :
+        officer = { 'company_name': f"{rng.choice(LASTNAMES)} NOMINEES LIMITED", 'company_number': f"{rng.randint(1000000, 9999999):08d}",
+                    'role': 'corporate-director' }
+        officer.update(make_uk_address(rng))
+    else :
+        officer = { 'first_name': f"{rng.choice(FIRSTNAMES)} {rng.choice(FIRSTNAMES)}", 'last_name': rng.choice(LASTNAMES),
+                    'date_of_birth': f"{rng.randint(1940, 1995)}-{rng.randint(1, 12):02d}", 'nationality': 'British',
+                    'role': rng.choice(UK_ROLES) }
+    officer['date_of_appointment'] = make_date(rng)
+    return officer
+
+def make_ubo( rng ) :
+    if rng.random() < 0.3 :
+        ubo = { 'first_name': None, 'last_name': f"{rng.choice(LASTNAMES)} GROUP PLC", 'date_of_birth': None }
+        ubo.update(make_uk_address(rng))
+    else :
+        ubo = { 'first_name': rng.choice(FIRSTNAMES), 'last_name': rng.choice(LASTNAMES),
+                'date_of_birth': f"{rng.randint(1940, 1995)}-{rng.randint(1, 12):02d}" }
+    ubo['percentage_of_shares'] = rng.choice([ "25-50%", "50-75%", "75-100%" ])
+    return ubo
+
+def make_document( rng ) :
+    return { 'type': rng.choice([ 'Accounts', 'Confirmation statement', 'Change of registered office address' ]),
+             'description': rng.choice(DECISIONS)[1], 'date': make_date(rng),
+             'file_available': rng.random() < 0.8, 'file_token': "%032x" % rng.getrandbits(128) }
+
+# Answer of /v1/company
+def make_company( rng , officers , ubos , documents , financials , publications ) :
+    return { 'company_number': f"{rng.randint(1000000, 9999999):08d}", 'name': f"{rng.choice(LASTNAMES)} TRADING LIMITED",
+             'country_code': 'UK', 'local_legal_form_name': 'Private limited Company', 'date_of_creation': make_date(rng),
+             'date_of_cessation': None, 'purpose': 'Retail sale in non-specialised stores', 'local_activities': [],
+             'head_office': make_uk_address(rng),
+             'officers': [ make_officer(rng) for i in range(officers) ],
+             'ubos': [ make_ubo(rng) for i in range(ubos) ],
+             'documents': [ make_document(rng) for i in range(documents) ],
+             'financials': [ { 'date': make_date(rng), 'related_documents': [ make_document(rng) for j in range(2) ] } for i in range(financials) ],
+             'publications': [ { 'type': 'Gazette', 'description': rng.choice(DECISIONS)[1], 'date': make_date(rng),
+                                 'link': f"https://www.thegazette.co.uk/notice/{rng.randint(1000000, 9999999)}" } for i in range(publications) ] }
+
+# Page of /v1/search-officers
+def make_officers_page( rng , firstname , lastname , count , total ) :
+    results = []
+    for i in range(count) :
+        officer = { 'first_name': firstname, 'last_name': lastname, 'date_of_birth': None, 'role': rng.choice(UK_ROLES),
+                    'type': 'natural person', 'date_of_appointment': make_date(rng),
+                    'companies': [ { 'company_number': f"{rng.randint(1000000, 9999999):08d}", 'name': f"{rng.choice(LASTNAMES)} LIMITED" }
+                                   for j in range(rng.randint(1, 3)) ] }
+        results.append(officer)
+    return { 'results': results, 'total': total }
+
+def make_search_officers( rng , firstname , lastname ) :
+    return [ make_officers_page(rng, firstname, lastname, RESULTS_BY_PAGE, RESULTS_BY_PAGE * SEARCH_PAGES) for page in range(SEARCH_PAGES) ]
+
+# Page of /v1/search : companies, with the publications mentioning the searched address
+def make_companies_page( rng , count , total ) :
+    results = []
+    for i in range(count) :
+        company = make_company(rng, 0, 0, 0, 0, 0)
+        company['publications'] = [ { 'type': 'Gazette', 'date': make_date(rng),
+                                      'mentions': [ f"... registered office at <em>{make_uk_address(rng)['address_line_1']}</em> ..." ] }
+                                    for j in range(rng.randint(0, 2)) ]
+        results.append(company)
+    return { 'results': results, 'total': total }
+
+
+## FIXTURES
+
+# Name -> transform, endpoint, properties of the input entity, generator
+FIXTURES = {
+    'fr_sarl': ( 'FicheEntreprise', "https://api.pappers.fr/v2/entreprise", { 'countrycode': 'FR' },
+                 lambda rng : [ make_entreprise(rng, 2, 1, 1, 6, 4, 5) ] ),
+    'fr_holding': ( 'FicheEntreprise', "https://api.pappers.fr/v2/entreprise", { 'countrycode': 'FR' },
+                    lambda rng : [ make_entreprise(rng, 400, 12, 4, 150, 25, 80) ] ),
+    'fr_retail': ( 'FicheEntreprise', "https://api.pappers.fr/v2/entreprise", { 'countrycode': 'FR' },
+                   lambda rng : [ make_entreprise(rng, 9, 3, 3000, 40, 15, 30) ] ),
+    'fr_search_dirigeants': ( 'RechercheDirigeant', "https://api.pappers.fr/v2/recherche-dirigeants",
+                              { 'firstname': 'Jean', 'lastname': 'Martin', 'date_naissance_rgpd': '1962-3' },
+                              lambda rng : make_search_dirigeants(rng, 'Jean', 'Martin', '1962-03') ),
+    'fr_search_siege': ( 'RechercheSiege', "https://api.pappers.fr/v2/recherche",
+                         { 'streetaddress': '12 rue de Rivoli', 'postalcode': '75001', 'city': 'PARIS 1', 'countrysc': 'FR' },
+                         make_search_siege ),
+    'in_company': ( 'FicheEntreprise', "https://api.pappers.in/v1/company", { 'countrycode': 'GB' },
+                    lambda rng : [ make_company(rng, 150, 10, 80, 20, 50) ] ),
+    'in_search_officers': ( 'SearchOfficerUk', "https://api.pappers.in/v1/search-officers",
+                            { 'firstname': 'John', 'lastname': 'Smith' },
+                            lambda rng : make_search_officers(rng, 'John', 'Smith') ),
+}
+
+def get_path( name ) :
+    return os.path.join(FIXTURES_DIR, name + '.json')
+
+# Fixture : { 'transform', 'url', 'properties', 'pages' : answers of the pages 1, 2... }
+# A recorded fixture is used when there is one, otherwise it is generated
+def load( name ) :
+    path = get_path(name)
+    if os.path.exists(path) :
+        with open(path, encoding='utf-8') as f :
+            fixture = json.load(f)
+        fixture['recorded'] = True
+        return fixture
+
+    transform, url, properties, generate = FIXTURES[name]
+    properties = dict(properties)
+    pages = generate(random.Random(f"{SEED}:{name}"))
+    if 'siren' in pages[0] :
+        properties['id_tax_number'] = pages[0]['siren']
+    elif 'company_number' in pages[0] :
+        properties['id_tax_number'] = pages[0]['company_number']
+    return { 'transform': transform, 'url': url, 'properties': properties, 'pages': pages, 'recorded': False }
+
+def save( name , fixture ) :
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    fixture = { key: fixture[key] for key in ( 'transform', 'url', 'properties', 'pages' ) }
+    with open(get_path(name), 'w', encoding='utf-8') as f :
+        json.dump(fixture, f, ensure_ascii=False, indent=1)
+
+
+# Run the transform of the fixture on the real API and keep its answers, page by page
+def record( name , properties ) :
+    sys.path.insert(0, PROJECT_DIR)
+    import importlib
+    from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
+    from transforms import papperparse
+
+    transform, url, default_properties, generate = FIXTURES[name]
+    properties = dict(default_properties, **properties)
+    pages = {}
+    make_request = papperparse.make_request
+
+    def recording_request( request_url , payload , *args , **kwargs ) :
+        json_res = make_request(request_url, payload, *args, **kwargs)
+        if urlparse(request_url).path == urlparse(url).path :
+            pages[int(payload.get('page', 1))] = json_res
+        return json_res
+
+    # One request at a time : the pages are recorded in order
+    get_page_workers = papperparse.get_page_workers
+    papperparse.make_request = recording_request
+    papperparse.get_page_workers = lambda : 1
+    try :
+        module = importlib.import_module('transforms.' + transform)
+        request = MaltegoMsg(LocalArgs=[ properties.get('id_tax_number', name) ])
+        request.Properties = properties
+        getattr(module, transform).create_entities(request, MaltegoTransform())
+    finally :
+        papperparse.make_request = make_request
+        papperparse.get_page_workers = get_page_workers
+
+    if len(pages) == 0 :
+        raise Exception(f"No answer from {url}")
+    save(name, { 'transform': transform, 'url': url, 'properties': properties, 'pages': [ pages[page] for page in sorted(pages) ] })
+    return len(pages)
+
+
+if __name__ == '__main__' :
+    if sys.argv[1:2] == [ 'record' ] and len(sys.argv) > 2 and sys.argv[2] in FIXTURES :
+        properties = dict(argument.split('=', 1) for argument in sys.argv[3:])
+        print(f"{record(sys.argv[2], properties)} pages recorded in {get_path(sys.argv[2])}")
+    else :
+        print(f"Usage : {sys.argv[0]} record [{'|'.join(FIXTURES)}] [property=value ...]")
+        sys.exit(1)
@@ -0,0 +1,84 @@
+# Serialization of a large transform response
+#
+#   python benchmarks/serialize.py [entities]
+#
+# Compares the output of maltego-trx (MaltegoTransform.returnOutput : the whole XML document is
+# built, indented and canonicalized in memory) and the streamed output of the Pappers transforms
+# (PappersTransform.run_transform_stream : one chunk by entity). The response holds companies with
+# long notes, as RechercheSiege returns them. Both outputs must be identical.
+# The measures start before the entities are created : in both cases every entity is built (and
+# merged) before the first chunk, only the XML serialization is streamed.
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maltego_trx.maltego import MaltegoTransform
+
+from transforms import papperresponse
+
+NOTE = "Mentionned in :\n\n" + "Type: Dépôt des actes &amp; statuts <2021-03-04>\n  b'Transfert du siège social'\n" * 20
+
+
+def make_response( count ) :
+    response = MaltegoTransform()
+    add_entities(response, count)
+    return response
+
+def add_entities( response , count ) :
+    for i in range(count) :
+        entity = response.addEntity('reflets.DetailedCompany', f"Company {i}")
+        entity.addProperty('id_tax_number', 'Registration number', 'strict', f"{i:09d}")
+        entity.addProperty('countrycode', 'Country code', 'loose', 'FR')
+        entity.addProperty('name', 'Name', 'loose', f"Company {i} \"SAS\"")
+        entity.setLinkLabel("Mention in : 2021-03-04 ")
+        entity.setNote(NOTE)
+        entity.reverseLink()
+    response.addUIMessage("Pappers FR : 5 pages")
+
+class LargeTransform( papperresponse.PappersTransform ) :
+    count = 0
+
+    @classmethod
+    def create_entities( cls , request , response ) :
+        add_entities(response, cls.count)
+
+# Total time, time to the first chunk, peak memory, from the creation of the entities to the last
+# chunk : the chunks are dropped as they come, as when they are written to stdout or to the HTTP response
+def measure( serialize , count ) :
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in serialize(count) :
+        if first is None :
+            first = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return total, first, peak, size
+
+def serialize_maltego( count ) :
+    yield make_response(count).returnOutput()
+
+def serialize_stream( count ) :
+    LargeTransform.count = count
+    return LargeTransform.run_transform_stream(None)
+
+
+if __name__ == '__main__' :
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    before = measure(serialize_maltego, count)
+    stream = measure(serialize_stream, count)
+
+    print(f"{count} entities, {before[3] / 1024 / 1024:.1f} MB of XML")
+    for name, ( total, first, peak, size ) in ( ( "maltego-trx", before ), ( "Streamed   ", stream ) ) :
+        print(f"{name} : total {total * 1000:.0f} ms, first chunk {first * 1000:.0f} ms, peak memory {peak / 1024 / 1024:.1f} MB")
+
+    output = "".join(serialize_stream(count))
+    print(f"Identical output : {output == make_response(count).returnOutput()}")
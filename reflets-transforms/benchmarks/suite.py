@@ -0,0 +1,288 @@
+# Benchmark suite of the parsers and of the transforms, on the fixtures of fixtures.py
+#
+#   python benchmarks/suite.py [--filter parse_] [--runs 10] [--baseline FILE] [--threshold 20]
+#
+#   parse_*      throughput of a parser on the items of a fixture (items by second)
+#   transform_*  latency of create_entities on a fixture, number of entities and size of the
+#                output sent to Maltego (duplicates merged). The answers are served by a fake
+#                transport : no network, no cache, no mirror, no index, no rate limit.
+#
+# The results are written to benchmarks/results/last.json (the previous run is kept in
+# previous.json) and compared with the previous run, or with --baseline. A benchmark slower by more
+# than --threshold percent on both its fastest and its median run, or a different output, is a
+# regression : the exit code is then 1. Each benchmark runs at least --runs times and at least
+# MIN_SECONDS. Compare runs made on the same quiet machine : on a shared one (CI, VM) the timings
+# vary by 30 % or more from one run to the next, raise --threshold there.
+
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fixtures
+
+DEFAULT_RUNS = 10
+DEFAULT_THRESHOLD = 20
+MIN_SECONDS = 0.5
+
+API_KEY = 'benchmark'
+
+
+## ENVIRONMENT
+
+# Answer of the fake transport, with the attributes of a requests.Response
+class Page :
+    def __init__( self , status_code , text ) :
+        self.status_code = status_code
+        self.headers = {}
+        self.text = text
+        self.content = text.encode('utf-8')
+
+    def json( self ) :
+        return json.loads(self.text)
+
+def setup() :
+    os.environ['PAPPERS_API_KEY'] = API_KEY
+    from transforms import pappercache, papperhttp, papperindex, pappermirror, papperparse
+    papperparse.apply_config()
+    pappercache.configure({ 'enabled': False })
+    papperindex.configure({ 'enabled': False })
+    pappermirror.configure({ 'enabled': False })
+    papperhttp.configure({ 'rate_limit': 0 })
+    # Warnings of the parsers on incomplete answers would be timed with them
+    logging.getLogger('transforms').setLevel(logging.ERROR)
+
+# The pages of the fixture are served for its endpoint, the pages after them are empty
+# (whatever the base URL of the API in the configuration)
+def serve( fixture ) :
+    from transforms import papperhttp
+
+    endpoint = urlparse(fixture['url']).path
+    texts = [ json.dumps(page, ensure_ascii=False) for page in fixture['pages'] ]
+    empty = json.dumps({ 'resultats': [], 'results': [] })
+
+    def get( url , params ) :
+        if urlparse(url).path != endpoint :
+            return Page(404, "{}")
+        page = int(params.get('page', 1))
+        return Page(200, texts[page - 1] if page <= len(texts) else empty)
+
+    papperhttp.get = get
+
+
+def make_request( fixture ) :
+    from maltego_trx.maltego import MaltegoMsg
+
+    request = MaltegoMsg(LocalArgs=[ fixture['properties'].get('id_tax_number', 'benchmark') ])
+    request.Properties = dict(fixture['properties'])
+    return request
+
+def get_transform( name ) :
+    import importlib
+    module = importlib.import_module('transforms.' + name)
+    return getattr(module, name)
+
+
+## BENCHMARKS
+
+# As timeit : the garbage collector does not run during the timed calls
+def measure( function , runs ) :
+    function()
+    timings = []
+    deadline = time.perf_counter() + MIN_SECONDS
+    while len(timings) < runs or time.perf_counter() < deadline :
+        gc.collect()
+        gc.disable()
+        try :
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        finally :
+            gc.enable()
+    return { 'median_ms': statistics.median(timings) * 1000, 'min_ms': min(timings) * 1000, 'runs': len(timings) }
+
+def get_representants( fixture ) :
+    json_res = fixture['pages'][0]
+    return [ item for item in json_res['representants'] + json_res['beneficiaires_effectifs'] if not item.get('personne_morale') ]
+
+def get_search_entreprises( fixture ) :
+    return [ entreprise for page in fixture['pages'] for dirigeant in page['resultats'] for entreprise in dirigeant['entreprises'] ]
+
+# Parser benchmarks : name -> fixture, items of the fixture, parser called on a response and an item
+def get_parse_benchmarks() :
+    from transforms import papperparse
+
+    def parse_note( response , json_res ) :
+        papperparse.parse_note(response.addEntity("reflets.DetailedCompany", "benchmark"), json_res, API_KEY)
+
+    def parse_note_in( response , json_res ) :
+        papperparse.parse_note_in(response.addEntity("reflets.DetailedCompany", "benchmark"), json_res, API_KEY)
+
+    return {
+        'parse_identity': ( 'fr_holding', get_representants, lambda response, item : papperparse.parse_identity(item) ),
+        'parse_location': ( 'fr_retail', lambda fixture : fixture['pages'][0]['etablissements'], lambda response, item : papperparse.parse_location(None, item) ),
+        'parse_etablissement': ( 'fr_retail', lambda fixture : fixture['pages'][0]['etablissements'], papperparse.parse_etablissement ),
+        'parse_entreprise': ( 'fr_search_dirigeants', get_search_entreprises, papperparse.parse_entreprise ),
+        'parse_dirigeant': ( 'fr_holding', get_representants, papperparse.parse_dirigeant ),
+        'parse_officers': ( 'in_company', lambda fixture : fixture['pages'][0]['officers'], papperparse.parse_officers ),
+        'parse_note': ( 'fr_holding', lambda fixture : fixture['pages'], parse_note ),
+        'parse_note_in': ( 'in_company', lambda fixture : fixture['pages'], parse_note_in ),
+    }
+
+def run_parse( fixture , get_items , parse , runs ) :
+    from maltego_trx.maltego import MaltegoTransform
+
+    items = get_items(fixture)
+
+    def function() :
+        response = MaltegoTransform()
+        for item in items :
+            parse(response, item)
+
+    result = measure(function, runs)
+    result['items'] = len(items)
+    result['items_per_s'] = len(items) / result['median_ms'] * 1000
+    return result
+
+def run_transform( fixture , runs ) :
+    from maltego_trx.maltego import MaltegoTransform
+
+    serve(fixture)
+    transform = get_transform(fixture['transform'])
+    request = make_request(fixture)
+    result = measure(lambda : transform.create_entities(request, MaltegoTransform()), runs)
+
+    response = MaltegoTransform()
+    transform.create_entities(request, response)
+    output = transform.run_transform(request)
+    result['created'] = len(response.entities)
+    result['entities'] = output.count("<Entity ")
+    result['output_bytes'] = len(output.encode('utf-8'))
+    result['output_digest'] = hashlib.sha256(output.encode('utf-8')).hexdigest()[:16]
+    return result
+
+def run( name_filter , runs ) :
+    setup()
+    loaded = {}
+    results = {}
+
+    def load( name ) :
+        if name not in loaded :
+            loaded[name] = fixtures.load(name)
+        return loaded[name]
+
+    benchmarks = [ ( name, benchmark ) for name, benchmark in get_parse_benchmarks().items() ]
+    benchmarks += [ ( 'transform_' + name, None ) for name in fixtures.FIXTURES ]
+    for name, benchmark in benchmarks :
+        if name_filter and name_filter not in name :
+            continue
+        if benchmark is None :
+            fixture_name = name[len('transform_'):]
+            result = run_transform(load(fixture_name), runs)
+        else :
+            fixture_name, get_items, parse = benchmark
+            result = run_parse(load(fixture_name), get_items, parse, runs)
+        result['fixture'] = fixture_name
+        result['recorded'] = loaded[fixture_name]['recorded']
+        results[name] = result
+        print(format_result(name, result))
+    return results
+
+
+## RESULTS
+
+def format_result( name , result ) :
+    line = f"{name:<34} median {result['median_ms']:9.2f} ms   min {result['min_ms']:9.2f} ms"
+    if 'items_per_s' in result :
+        line += f"   {result['items_per_s']:10.0f} items/s"
+    if 'output_bytes' in result :
+        line += f"   {result['entities']:5d} entities   {result['output_bytes'] / 1024:8.1f} KB"
+    return line
+
+def get_commit() :
+    try :
+        return subprocess.run([ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=PROJECT_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError :
+        return None
+
+def save( path , results ) :
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = { 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': get_commit(), 'python': platform.python_version(),
+             'machine': platform.machine(), 'results': results }
+    with open(path, 'w', encoding='utf-8') as f :
+        json.dump(data, f, indent=1)
+
+# Print the changes from the baseline, return the regressions
+def compare( results , baseline , threshold ) :
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'unknown commit'} ({baseline.get('date')}) :")
+    for name, result in results.items() :
+        before = baseline['results'].get(name)
+        if before is None :
+            continue
+        if before.get('recorded') != result.get('recorded') :
+            print(f"{name:<34} fixture changed, not compared")
+            continue
+
+        # The fastest run is the least disturbed by the rest of the machine, the median confirms
+        # that the whole benchmark moved and not one lucky run
+        change = result['min_ms'] / (before['min_ms']) - 1
+        median_change = result['median_ms'] / (before['median_ms']) - 1
+        status = []
+        if min(change, median_change) > threshold / 100 :
+            status.append("REGRESSION")
+        elif max(change, median_change) < -threshold / 100 :
+            status.append("faster")
+        if before.get('output_digest') != result.get('output_digest') :
+            status.append(f"OUTPUT CHANGED ({before.get('entities')} -> {result.get('entities')} entities, {before.get('output_bytes')} -> {result.get('output_bytes')} bytes)")
+        if any(item.startswith(( "REGRESSION", "OUTPUT" )) for item in status) :
+            regressions.append(name)
+        print(f"{name:<34} {before['min_ms']:9.2f} ms -> {result['min_ms']:9.2f} ms  {change * 100:+7.1f} %  {' '.join(status)}")
+    return regressions
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Benchmarks of the Pappers parsers and transforms")
+    parser.add_argument('--filter', help="only the benchmarks containing this text")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="minimum number of timed runs of each benchmark")
+    parser.add_argument('--baseline', help="results to compare with (default : the previous run)")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="slowdown reported as a regression, in percent")
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, 'last.json'), help="results file")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.runs)
+
+    baseline_path = args.baseline
+    if baseline_path is None and os.path.exists(args.output) :
+        baseline_path = os.path.join(os.path.dirname(args.output), 'previous.json')
+        os.replace(args.output, baseline_path)
+    save(args.output, results)
+
+    if baseline_path is None or not os.path.exists(baseline_path) :
+        return 0
+    with open(baseline_path, encoding='utf-8') as f :
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if len(regressions) > 0 :
+        print(f"\n{len(regressions)} regressions : {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
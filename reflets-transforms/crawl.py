@@ -0,0 +1,314 @@
+# Multi-hop exploration without Maltego
+#
+# Starts from companies and / or persons, and expands the graph breadth first with the logic of the
+# transforms : FicheEntreprise on the companies (representants, beneficiaries, addresses),
+# RechercheDirigeant on the persons (their other companies) and RechercheSiege on the addresses
+# (the other companies registered there). Every entity is expanded once.
+#
+#   python crawl.py --company 123456789 --hops 2 -o graph.graphml
+#   python crawl.py --person "Jean;Dupont;1970-5" --company GB:01234567 --max-credits 50 -o graph.csv
+#
+# Budgets :
+#   --hops         number of expansions from the seeds (default 2)
+#   --max-entities the graph stops growing at this number of entities (default 500)
+#   --max-credits  no expansion is started once this number of API credits has been spent
+#                  (estimate of transforms/pappermetrics.py, answers of the cache are free).
+#                  The expansions running at that moment are finished.
+#
+# Output : GraphML (Gephi, yEd, Maltego import) or CSV with one line by link, from the extension.
+
+import argparse
+import csv
+import json
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from batch import make_request_msg, entity_to_dict, normalize_identifier
+
+DEFAULT_HOPS = 2
+DEFAULT_MAX_ENTITIES = 500
+DEFAULT_WORKERS = 4
+
+COMPANY = 'reflets.DetailedCompany'
+PERSON = 'reflets.Dirigeant'
+ADDRESS = 'reflets.HeadquartersLocation'
+
+# Name of the entity types for --expand
+EXPAND_TYPES = { 'company': COMPANY, 'person': PERSON, 'address': ADDRESS }
+
+
+## ENTITIES
+
+# Same entity : same type, value and strict properties (as Maltego merges them)
+def get_node_id( entity ) :
+    strict = sorted( (name, entity['properties'].get(name)) for name in entity.get('strict', []) )
+    if len(strict) == 0 :
+        return f"{entity['type']}:{entity['value']}"
+    return f"{entity['type']}:{entity['value']}:" + ":".join(f"{name}={value}" for name, value in strict)
+
+def get_node_label( entity ) :
+    properties = entity['properties']
+    if entity['type'] == COMPANY and properties.get('nom_usuel') :
+        return f"{properties['nom_usuel']} ({entity['value']})"
+    if entity['type'] == ADDRESS :
+        return " ".join(properties[name] for name in ( 'streetaddress', 'postalcode', 'city' ) if properties.get(name))
+    return entity['value']
+
+def make_company_seed( text , default_country ) :
+    country = default_country
+    if ":" in text :
+        country, text = text.split(":", 1)
+    country, identifier = normalize_identifier(country, text)
+    # Same strict properties as the companies returned by the transforms, in every country
+    return { 'type': COMPANY, 'value': identifier, 'properties': { 'id_tax_number': identifier, 'countrycode': country }, 'strict': [ 'id_tax_number' ] }
+
+# "Firstname;Lastname" or "Firstname;Lastname;YYYY-M" (birth month, as shown by Pappers)
+def make_person_seed( text ) :
+    parts = [ part.strip() for part in text.split(";") ]
+    if len(parts) < 2 :
+        raise ValueError(f"Person '{text}' : expected Firstname;Lastname[;YYYY-M]")
+    properties = { 'person.firstnames': parts[0], 'person.lastname': parts[1] }
+    value = f"{parts[0]} {parts[1]}"
+    strict = []
+    if len(parts) > 2 and parts[2] != "" :
+        properties['date_naissance_rgpd'] = parts[2]
+        value += f" {parts[2]}"
+        strict.append('date_naissance_rgpd')
+    return { 'type': PERSON, 'value': value, 'properties': properties, 'strict': strict }
+
+
+## EXPANSION
+
+# Transform and request properties used to expand an entity (None : not expandable)
+def get_expansion( entity ) :
+    properties = entity['properties']
+    if entity['type'] == COMPANY :
+        from transforms.FicheEntreprise import FicheEntreprise
+        return FicheEntreprise, { 'id_tax_number': properties.get('id_tax_number', entity['value']),
+                                  'countrycode': properties.get('countrycode', 'FR') }
+    if entity['type'] == PERSON :
+        from transforms.RechercheDirigeant import RechercheDirigeant
+        # Maltego sends the Person properties with their legacy names too
+        request_properties = dict(properties)
+        request_properties['firstname'] = properties.get('person.firstnames')
+        request_properties['lastname'] = properties.get('person.lastname')
+        if request_properties['firstname'] is None or request_properties['lastname'] is None :
+            return None
+        return RechercheDirigeant, request_properties
+    if entity['type'] == ADDRESS :
+        from transforms.RechercheSiege import RechercheSiege
+        if not properties.get('streetaddress') or not properties.get('city') :
+            return None
+        return RechercheSiege, { 'streetaddress': properties['streetaddress'],
+                                 'postalcode': properties.get('postalcode', ""),
+                                 'city': properties['city'],
+                                 'countrysc': properties.get('countrycode') }
+    return None
+
+# Run the transform of an entity, return the entities found and the errors
+def expand( entity ) :
+    from maltego_trx.maltego import MaltegoTransform
+
+    transform, properties = get_expansion(entity)
+    response = MaltegoTransform()
+    transform.create_entities(make_request_msg(entity['value'], properties), response)
+    errors = [ message[1].strip() for message in response.UIMessages if message[1].startswith("Error") ]
+    return [ entity_to_dict(result) for result in response.entities ], errors
+
+
+## CRAWLER
+
+# The same entity found again may bring more properties
+def update_node( node , entity ) :
+    for name, value in entity['properties'].items() :
+        node['properties'].setdefault(name, value)
+    if 'note' in entity :
+        node.setdefault('note', entity['note'])
+
+
+class Graph :
+    def __init__( self ) :
+        self.nodes = {}
+        self.edges = {}
+
+    def add_node( self , entity , hop ) :
+        node_id = get_node_id(entity)
+        node = self.nodes.get(node_id)
+        if node is None :
+            node = { 'id': node_id, 'type': entity['type'], 'value': entity['value'],
+                     'properties': {}, 'strict': list(entity.get('strict', [])), 'hop': hop }
+            self.nodes[node_id] = node
+        update_node(node, entity)
+        return node
+
+    def add_edge( self , source , target , label ) :
+        if source['id'] == target['id'] :
+            return
+        key = ( source['id'], target['id'] )
+        labels = self.edges.setdefault(key, [])
+        if label and label not in labels :
+            labels.append(label)
+
+
+def crawl( seeds , hops , max_entities , max_credits , workers , expand_types ) :
+    from transforms import papperparse
+    from transforms import pappermetrics
+
+    papperparse.apply_config()
+    if max_credits is not None and not pappermetrics.is_enabled() :
+        sys.stderr.write("The metrics are disabled in api_keys.yml : the credit budget cannot be enforced\n")
+
+    graph = Graph()
+    frontier = [ graph.add_node(seed, 0) for seed in seeds ]
+    expanded = set()
+    credits_start = pappermetrics.get_total('credits')
+    stop = None
+
+    def credits_spent() :
+        return pappermetrics.get_total('credits') - credits_start
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try :
+        for hop in range(1, hops + 1) :
+            todo = [ node for node in frontier if node['id'] not in expanded and node['type'] in expand_types and get_expansion(node) is not None ]
+            sys.stderr.write(f"Hop {hop} : {len(todo)} entities to expand\n")
+            next_frontier = []
+            pending = {}
+
+            while len(todo) > 0 or len(pending) > 0 :
+                # Start expansions while the budgets allow it
+                while len(todo) > 0 and len(pending) < workers and stop is None :
+                    if len(graph.nodes) >= max_entities :
+                        stop = f"entity budget reached ({max_entities})"
+                    elif max_credits is not None and credits_spent() >= max_credits :
+                        stop = f"credit budget reached ({credits_spent()} credits)"
+                    else :
+                        node = todo.pop(0)
+                        expanded.add(node['id'])
+                        pending[executor.submit(expand, node)] = node
+                if stop is not None :
+                    todo = []
+                if len(pending) == 0 :
+                    break
+
+                finished, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished :
+                    node = pending.pop(future)
+                    try :
+                        results, errors = future.result()
+                    except Exception as e :
+                        results, errors = [], [ str(e) ]
+                    for error in errors :
+                        sys.stderr.write(f"{node['id']} : {error}\n")
+
+                    for entity in results :
+                        # Auto-qualification of the expanded entity by its transform
+                        if entity['type'] == node['type'] and entity['value'] == node['value'] :
+                            update_node(node, entity)
+                            continue
+                        node_id = get_node_id(entity)
+                        if node_id not in graph.nodes and len(graph.nodes) >= max_entities :
+                            continue
+                        is_new = node_id not in graph.nodes
+                        target = graph.add_node(entity, hop)
+                        if entity.get('reversed') :
+                            graph.add_edge(target, node, entity.get('link_label'))
+                        else :
+                            graph.add_edge(node, target, entity.get('link_label'))
+                        if is_new :
+                            next_frontier.append(target)
+
+            frontier = next_frontier
+            if stop is not None :
+                sys.stderr.write(f"Stopped at hop {hop} : {stop}\n")
+                break
+    finally :
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    sys.stderr.write(f"{len(graph.nodes)} entities, {len(graph.edges)} links, {credits_spent()} credits spent\n")
+    return graph
+
+
+## OUTPUT
+
+def write_graphml( path , graph ) :
+    root = ET.Element('graphml', xmlns="http://graphml.graphdrawing.org/xmlns")
+    keys = [ ( 'node', 'type' ), ( 'node', 'value' ), ( 'node', 'label' ), ( 'node', 'hop' ),
+             ( 'node', 'properties' ), ( 'node', 'note' ), ( 'edge', 'label' ) ]
+    for target, name in keys :
+        ET.SubElement(root, 'key', { 'id': f"{target[0]}_{name}", 'for': target, 'attr.name': name,
+                                     'attr.type': 'int' if name == 'hop' else 'string' })
+    element = ET.SubElement(root, 'graph', id="pappers", edgedefault="directed")
+
+    def add_data( parent , key , value ) :
+        data = ET.SubElement(parent, 'data', key=key)
+        data.text = str(value)
+
+    for node in graph.nodes.values() :
+        node_element = ET.SubElement(element, 'node', id=node['id'])
+        add_data(node_element, 'n_type', node['type'])
+        add_data(node_element, 'n_value', node['value'])
+        add_data(node_element, 'n_label', get_node_label(node))
+        add_data(node_element, 'n_hop', node['hop'])
+        add_data(node_element, 'n_properties', json.dumps(node['properties'], ensure_ascii=False))
+        if 'note' in node :
+            add_data(node_element, 'n_note', node['note'])
+    for ( source, target ), labels in graph.edges.items() :
+        edge_element = ET.SubElement(element, 'edge', source=source, target=target)
+        add_data(edge_element, 'e_label', " / ".join(labels))
+
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+# One line by link, and one line for the entities without link
+def write_csv( path , graph ) :
+    linked = set()
+    with open(path, 'w', newline='', encoding='utf-8') as f :
+        writer = csv.writer(f)
+        writer.writerow([ 'source_type', 'source_value', 'source_label', 'link_label', 'target_type', 'target_value', 'target_label' ])
+        for ( source_id, target_id ), labels in graph.edges.items() :
+            source, target = graph.nodes[source_id], graph.nodes[target_id]
+            linked.update(( source_id, target_id ))
+            writer.writerow([ source['type'], source['value'], get_node_label(source), " / ".join(labels),
+                              target['type'], target['value'], get_node_label(target) ])
+        for node in graph.nodes.values() :
+            if node['id'] not in linked :
+                writer.writerow([ node['type'], node['value'], get_node_label(node), "", "", "", "" ])
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Breadth first exploration of companies, persons and addresses")
+    parser.add_argument('--company', action='append', default=[], help="seed company : SIREN, or COUNTRY:number (GB:01234567)")
+    parser.add_argument('--person', action='append', default=[], help="seed person : Firstname;Lastname[;YYYY-M]")
+    parser.add_argument('--country', default='FR', help="country of the seed companies without one (default FR)")
+    parser.add_argument('--hops', type=int, default=DEFAULT_HOPS, help=f"number of expansions (default {DEFAULT_HOPS})")
+    parser.add_argument('--max-entities', type=int, default=DEFAULT_MAX_ENTITIES, help=f"entity budget (default {DEFAULT_MAX_ENTITIES})")
+    parser.add_argument('--max-credits', type=float, help="API credit budget (default : no limit)")
+    parser.add_argument('--expand', default="company,person,address", help="entity types to expand (default company,person,address)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="expansions run at the same time")
+    parser.add_argument('-o', '--output', required=True, help="graph file (.graphml or .csv)")
+    args = parser.parse_args(argv)
+
+    try :
+        seeds = [ make_company_seed(text, args.country) for text in args.company ]
+        seeds += [ make_person_seed(text) for text in args.person ]
+        expand_types = set( EXPAND_TYPES[name.strip()] for name in args.expand.split(",") if name.strip() != "" )
+    except (ValueError, KeyError) as e :
+        parser.error(str(e))
+    if len(seeds) == 0 :
+        parser.error("at least one --company or --person is needed")
+
+    graph = crawl(seeds, args.hops, args.max_entities, args.max_credits, args.workers, expand_types)
+
+    from transforms import pappermetrics
+    pappermetrics.flush()
+
+    if args.output.lower().endswith('.csv') :
+        write_csv(args.output, graph)
+    else :
+        write_graphml(args.output, graph)
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
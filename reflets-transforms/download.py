@@ -0,0 +1,298 @@
+# Download of the documents of companies
+#
+# Fetches the documents listed by FicheEntreprise : the deeds (depots_actes) and the accounts
+# (comptes, PDF and Excel) of French companies, the documents and the documents of the financials
+# of UK, BE and CH companies. The documents are downloaded concurrently, within the rate limit of
+# the 'http' section of api_keys.yml.
+#
+#   python download.py companies.csv -o documents
+#   python download.py --company 123456789 --company GB:01234567 -o documents --workers 8
+#
+# Input : the files of batch.py (CSV file, or text file with one identifier by line), and / or
+# --company identifiers ("GB:01234567" for a foreign company).
+#
+# The store is content-addressed : a document is written once in "objects/", named by the SHA-256
+# of its content, whatever the number of companies or filings it appears in. The folder of each
+# company holds hard links to its documents, with readable names ("FR_123456789/2020-06-30_Comptes.pdf").
+# "manifest.jsonl" records every document downloaded and every company done : a run started
+# again only downloads the documents left (an interrupted download is resumed where it stopped),
+# and does not call the API for the companies already done (--refresh to look for new filings).
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch import read_identifiers, get_companies, make_request_msg, load_progress, COUNTRIES
+
+DEFAULT_WORKERS = 4
+
+SECTIONS = ( 'depots_actes', 'comptes', 'documents', 'financials' )
+
+
+## DOCUMENTS
+
+def make_document( company , section , token , name , date , url ) :
+    return { 'id': f"{section}:{token}", 'company': company, 'section': section, 'name': name,
+             'date': date, 'url': url, 'token': token }
+
+# Documents of the answer of the FR V2 API
+def get_documents_fr( company , json_res ) :
+    from transforms import papperparse
+
+    url = papperparse.get_api_url('fr', 'document/telechargement')
+    documents = []
+    for acte in json_res.get('depots_actes') or [] :
+        if acte.get('token') :
+            documents.append(make_document(company, 'depots_actes', acte['token'], acte.get('nom_fichier_pdf'), acte.get('date_depot_formate'), url))
+    for compte in json_res.get('comptes') or [] :
+        if compte.get('token') :
+            documents.append(make_document(company, 'comptes', compte['token'], compte.get('nom_fichier_pdf'), compte.get('date_depot_formate'), url))
+        if compte.get('token_xlsx') :
+            documents.append(make_document(company, 'comptes', compte['token_xlsx'], compte.get('nom_fichier_xlsx'), compte.get('date_depot_formate'), url))
+    return documents
+
+# Documents of the answer of the IN V1 API : only the files available for download
+def get_documents_in( company , json_res ) :
+    from transforms import papperparse
+
+    url = papperparse.get_api_url('in', 'download-file')
+    items = [ ( 'documents', document ) for document in json_res.get('documents') or [] ]
+    items += [ ( 'financials', document ) for financial in json_res.get('financials') or [] for document in financial.get('related_documents') or [] ]
+
+    documents = []
+    for section, document in items :
+        if document.get('file_available') is True and document.get('file_token') :
+            name = f"{document['type']}.pdf" if document.get('type') else None
+            documents.append(make_document(company, section, document['file_token'], name, document.get('date'), url))
+    return documents
+
+# Run the request of FicheEntreprise on one company, return its API token and its documents
+def list_documents( key , country , identifier , sections ) :
+    from transforms.FicheEntreprise import fetch_company
+
+    request = make_request_msg(identifier, { 'id_tax_number': identifier, 'countrycode': country })
+    api, json_res, api_token = fetch_company(request)
+    if api == 'in' :
+        documents = get_documents_in(key, json_res)
+    else :
+        documents = get_documents_fr(key, json_res)
+    return api_token, [ document for document in documents if document['section'] in sections ]
+
+
+## STORE
+
+class Store :
+    def __init__( self , path ) :
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.jsonl')
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'partial'), exist_ok=True)
+
+    def get_object_path( self , sha256 , extension ) :
+        return os.path.join(self.path, 'objects', sha256[:2], sha256 + extension)
+
+    # Partial download of a document, kept between runs
+    def get_partial_path( self , document ) :
+        return os.path.join(self.path, 'partial', hashlib.sha1(document['id'].encode('utf-8')).hexdigest() + ".part")
+
+    # Readable path of a document in the folder of its company
+    def get_link_path( self , document , extension ) :
+        name = document['name'] or document['token']
+        if not name.lower().endswith(extension) :
+            name += extension
+        if document['date'] :
+            name = f"{document['date']}_{name}"
+        return os.path.join(self.path, safe_name(document['company']), safe_name(name))
+
+    def is_done( self , record ) :
+        return record is not None and 'sha256' in record and os.path.exists(os.path.join(self.path, record['path']))
+
+    # Move a complete download to its content address (dropped when the same content is already
+    # there), and link it in the folder of its company
+    def add( self , document , partial_path ) :
+        sha256 = get_sha256(partial_path)
+        extension = get_extension(document)
+        object_path = self.get_object_path(sha256, extension)
+        size = os.path.getsize(partial_path)
+        duplicate = os.path.exists(object_path)
+        if duplicate :
+            os.remove(partial_path)
+        else :
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(partial_path, object_path)
+
+        link_path = self.get_link_path(document, extension)
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        if os.path.exists(link_path) and not os.path.samefile(link_path, object_path) :
+            # Another document with the same date and name
+            link_path = os.path.splitext(link_path)[0] + f"_{sha256[:8]}" + extension
+        if not os.path.exists(link_path) :
+            try :
+                os.link(object_path, link_path)
+            except FileExistsError :
+                pass
+            except OSError :
+                # File system without hard links
+                shutil.copyfile(object_path, link_path)
+
+        return { 'sha256': sha256, 'size': size, 'duplicate': duplicate,
+                 'path': os.path.relpath(object_path, self.path), 'link': os.path.relpath(link_path, self.path) }
+
+
+def safe_name( name ) :
+    return re.sub(r'[^\w.\- ]', '_', name).strip(' .') or "_"
+
+def get_extension( document ) :
+    extension = os.path.splitext(document['name'] or "")[1].lower()
+    return extension if extension in ( '.pdf', '.xlsx', '.xls', '.zip' ) else '.pdf'
+
+def get_sha256( path ) :
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f :
+        for chunk in iter(lambda : f.read(1024 * 1024), b"") :
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+## DOWNLOADS
+
+ERRORS = { 401: "Bad API key", 404: "No results !", 429: "Too many requests : try again later", 503: "Service unavailable : try again later" }
+
+# Download one document to the store, counted in the metrics of the API calls
+def fetch_document( store , document , api_token ) :
+    from transforms import papperhttp, pappermetrics, papperparse
+
+    papperparse.apply_config()
+    partial_path = store.get_partial_path(document)
+    start = time.perf_counter()
+    try :
+        status, received = papperhttp.download(document['url'], { 'api_token': api_token, 'token': document['token'] }, partial_path)
+    except Exception :
+        pappermetrics.record_request(document['url'], "error", time.perf_counter() - start)
+        raise
+    pappermetrics.record_request(document['url'], status, time.perf_counter() - start, received)
+
+    if status not in ( 200, 206 ) :
+        raise Exception(ERRORS.get(status, "Unknown error code !"))
+    record = store.add(document, partial_path)
+    record['received'] = received
+    return record
+
+def run( companies , store , workers , sections , refresh ) :
+    from transforms import pappermetrics
+
+    done = load_progress(store.manifest_path)
+    todo = [ company for company in companies if refresh or 'documents' not in done.get(company[0], {})
+             or not all(store.is_done(done.get(document_id)) for document_id in done[company[0]]['documents']) ]
+    sys.stderr.write(f"{len(companies)} companies, {len(companies) - len(todo)} already done\n")
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    with open(store.manifest_path, 'a', encoding='utf-8') as manifest :
+        def write( record ) :
+            done[record['id']] = record
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+
+        failed = set()
+        try :
+            # Documents of the companies : one API call by company (free when in the cache)
+            listed = {}
+            futures = { executor.submit(pappermetrics.run_as, "download", list_documents, key, country, identifier, sections): key
+                        for key, country, identifier in todo }
+            for future in as_completed(futures) :
+                key = futures[future]
+                try :
+                    listed[key] = future.result()
+                except Exception as e :
+                    sys.stderr.write(f"{key} : {e}\n")
+
+            documents = [ ( document, api_token ) for key, ( api_token, items ) in listed.items() for document in items
+                          if not store.is_done(done.get(document['id'])) ]
+            count = sum(len(items) for api_token, items in listed.values())
+            sys.stderr.write(f"{count} documents, {count - len(documents)} already downloaded\n")
+
+            # A document listed twice is downloaded once
+            unique = {}
+            for document, api_token in documents :
+                unique.setdefault(document['id'], ( document, api_token ))
+            futures = { executor.submit(pappermetrics.run_as, "download", fetch_document, store, document, api_token): document
+                        for document, api_token in unique.values() }
+            for count, future in enumerate(as_completed(futures), 1) :
+                document = futures[future]
+                try :
+                    record = future.result()
+                except Exception as e :
+                    failed.add(document['id'])
+                    sys.stderr.write(f"[{count}/{len(futures)}] {document['company']} {document['name'] or document['id']} : {e}\n")
+                    continue
+                record.update({ 'id': document['id'], 'company': document['company'], 'section': document['section'],
+                                'name': document['name'], 'date': document['date'] })
+                write(record)
+                status = "duplicate" if record['duplicate'] else f"{record['size']} bytes"
+                sys.stderr.write(f"[{count}/{len(futures)}] {document['company']} {document['name'] or document['id']} : {status}\n")
+
+            # Companies done : every document of the company is in the store
+            for key, ( api_token, items ) in listed.items() :
+                if all(store.is_done(done.get(document['id'])) for document in items) :
+                    write({ 'id': key, 'documents': [ document['id'] for document in items ] })
+        except KeyboardInterrupt :
+            executor.shutdown(wait=True, cancel_futures=True)
+            sys.stderr.write("Interrupted : run the same command again to resume\n")
+            raise
+    executor.shutdown()
+    return done, failed
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Download the documents of a list of companies")
+    parser.add_argument('input', nargs='?', help="CSV file, or text file with one identifier by line")
+    parser.add_argument('--company', action='append', default=[], help="company identifier, ex : 123456789 or GB:01234567")
+    parser.add_argument('-o', '--output', required=True, help="folder of the documents")
+    parser.add_argument('--country', default='FR', help="country code of the identifiers without one (default FR)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="documents downloaded at the same time")
+    parser.add_argument('--sections', default=",".join(SECTIONS), help=f"documents to download (default {','.join(SECTIONS)})")
+    parser.add_argument('--refresh', action='store_true', help="look for new documents of the companies already done")
+    args = parser.parse_args(argv)
+
+    identifiers = read_identifiers(args.input, args.country) if args.input else []
+    for text in args.company :
+        country, identifier = text.split(":", 1) if ":" in text else ( args.country, text )
+        identifiers.append(( country, identifier ))
+    if len(identifiers) == 0 :
+        parser.error("no company : give an input file or --company")
+    sections = set(section.strip() for section in args.sections.split(","))
+    unknown = sections - set(SECTIONS)
+    if len(unknown) > 0 :
+        parser.error(f"unknown sections : {', '.join(sorted(unknown))}")
+
+    companies = get_companies(identifiers)
+    unknown = [ key for key, country, identifier in companies if country not in COUNTRIES ]
+    if len(unknown) > 0 :
+        sys.stderr.write(f"Unsupported country code, ignored : {', '.join(unknown)}\n")
+        companies = [ company for company in companies if company[1] in COUNTRIES ]
+
+    store = Store(args.output)
+    try :
+        done, failed = run(companies, store, args.workers, sections, args.refresh)
+    except KeyboardInterrupt :
+        return 130
+
+    # Usage of the API by this run (see transforms/pappermetrics.py)
+    from transforms import pappermetrics
+    pappermetrics.flush()
+
+    sys.stderr.write(f"Documents in {args.output}")
+    if len(failed) > 0 :
+        sys.stderr.write(f", {len(failed)} documents failed (run again to retry them)")
+    sys.stderr.write("\n")
+    return 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
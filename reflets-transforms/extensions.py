@@ -13,8 +13,9 @@ registry = TransformRegistry(
 registry.version = "0.1"
 
 # global settings
-# from maltego_trx.template_dir.settings import api_key_setting
-# registry.global_settings = [api_key_setting]
+# The API key set in Maltego overrides the one of transforms/api_keys.yml (server mode only)
+from settings import api_key_setting
+registry.global_settings = [api_key_setting]
 
 # transform suffix to indicate datasource
 # registry.display_name_suffix = " [ACME]"
@@ -0,0 +1,103 @@
+# Full-text search in the texts of an investigation, without calling the API
+#
+# The BODACC announcements, the publications and the mentions of the addresses found by the
+# transforms are indexed as the answers arrive (see transforms/papperindex.py). This script adds
+# the answers already in the cache and the documents downloaded by download.py, and searches them.
+#
+#   python index.py update --cache --documents documents
+#   python index.py search "transfert du siège"
+#   python index.py search "liquidation judiciaire" --kind bodacc --company FR:123456789
+#   python index.py search "NEAR(cession fonds, 5)" --json
+#   python index.py stats
+#
+# Queries use the FTS5 syntax : words (all of them must match), "phrases", OR, NOT, prefix*,
+# NEAR(a b, distance). Accents and case are ignored.
+
+import argparse
+import json
+import sys
+import time
+
+from transforms import papperindex
+
+
+def update( args ) :
+    from transforms import pappercache
+
+    if not args.cache and not args.documents :
+        sys.stderr.write("Nothing to add : --cache and / or --documents FOLDER\n")
+        return 2
+
+    if args.cache :
+        added = 0
+        responses = 0
+        for url, params, body in pappercache.iter_responses() :
+            try :
+                json_res = json.loads(body)
+            except ValueError :
+                continue
+            responses += 1
+            added += papperindex.add_response(url, json_res, params)
+        sys.stderr.write(f"{responses} cached answers : {added} texts added\n")
+
+    for folder in args.documents or [] :
+        added = papperindex.add_store(folder)
+        sys.stderr.write(f"{folder} : {added} documents added\n")
+    return 0
+
+def search( args ) :
+    start = time.perf_counter()
+    try :
+        results = papperindex.search(args.query, args.limit, args.company, args.kind)
+    except Exception as e :
+        sys.stderr.write(f"{e}\n")
+        return 2
+    seconds = time.perf_counter() - start
+
+    if args.json :
+        for result in results :
+            sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+    else :
+        for result in results :
+            name = f" {result['name']}" if result['name'] else ""
+            sys.stdout.write(f"{result['date'] or '':<10}  {result['kind']:<11}  {result['company']}{name}  {result['title']}\n")
+            sys.stdout.write(f"    {' '.join(result['snippet'].split())}\n")
+    sys.stderr.write(f"{len(results)} results in {seconds * 1000:.1f} ms\n")
+    return 0
+
+def stats( args ) :
+    counts = papperindex.stats()
+    for kind in papperindex.KINDS :
+        sys.stdout.write(f"{kind:<11} {counts.get(kind, 0):8d}\n")
+    return 0
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Full-text search in the texts of an investigation")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_update = commands.add_parser('update', help="add the cached answers and the downloaded documents")
+    parser_update.add_argument('--cache', action='store_true', help="answers of the API in the local cache")
+    parser_update.add_argument('--documents', action='append', help="folder of download.py")
+    parser_update.set_defaults(function=update)
+
+    parser_search = commands.add_parser('search', help="search the index")
+    parser_search.add_argument('query', help="words, \"phrase\", OR, NOT, prefix*, NEAR(a b)")
+    parser_search.add_argument('--company', help="only this company, ex : FR:123456789 or GB:01234567")
+    parser_search.add_argument('--kind', choices=papperindex.KINDS, help="only this kind of text")
+    parser_search.add_argument('--limit', type=int, default=papperindex.DEFAULT_LIMIT, help="number of results")
+    parser_search.add_argument('--json', action='store_true', help="one JSON object by result")
+    parser_search.set_defaults(function=search)
+
+    parser_stats = commands.add_parser('stats', help="number of texts in the index")
+    parser_stats.set_defaults(function=stats)
+
+    args = parser.parse_args(argv)
+    # Path of the index and of the cache in api_keys.yml
+    from transforms import papperparse
+    papperparse.apply_config()
+    return args.function(args)
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# Fast start of the transforms
+#
+# In local mode, Maltego starts a new Python interpreter for every transform run. The complete
+# project.py startup imports every transform, the Flask server of maltego-trx and rewrites the
+# TDS configuration files each time. This module only imports the requested transform.
+# It is used by the persistent worker (worker.py), or directly when the worker is not available.
+
+import glob
+import importlib
+import logging
+import os
+import sys
+
+from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
+from maltego_trx.utils import name_to_path
+
+from transforms.papperlog import StderrHandler
+
+# The errors of the transforms are written to stderr (the Maltego output window) by a handler of
+# this logger only : configuring the root logger would change the logs of every later transform
+# run by the persistent worker
+log = logging.getLogger("maltego.launcher")
+log.propagate = False
+log.setLevel(logging.ERROR)
+log.addHandler(StderrHandler())
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+TRANSFORMS_DIR = os.path.join(PROJECT_DIR, 'transforms')
+
+# Find the module of a transform from its local name (ex : "ficheentreprise") without importing
+# the other transforms. As for maltego-trx, the module must hold a class with the same name.
+def find_transform_class( transform_name ) :
+    for path in glob.glob(os.path.join(TRANSFORMS_DIR, '*.py')) :
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        if name_to_path(module_name) == transform_name :
+            module = importlib.import_module('transforms.' + module_name)
+            return getattr(module, module_name, None)
+    return None
+
+
+# Import every transform (warm up of the persistent worker, see worker.py)
+def import_transforms() :
+    for path in glob.glob(os.path.join(TRANSFORMS_DIR, '*.py')) :
+        importlib.import_module('transforms.' + os.path.splitext(os.path.basename(path))[0])
+
+
+# Same messages as maltego_trx.server, without importing Flask
+def get_exception_message( msg="An exception occurred with the transform. Check the logs for more details." ) :
+    transform_run = MaltegoTransform()
+    transform_run.addUIMessage(msg, "PartialError")
+    return transform_run.returnOutput()
+
+
+# Equivalent of "handle_run(__name__, ['project.py', 'local', name, value, properties])"
+def run_local( transform_name , local_args ) :
+    transform_name = transform_name.lower()
+    transform_cls = find_transform_class(transform_name)
+    if transform_cls is None :
+        print(get_exception_message(msg="Unable to find a transform matching '%s'." % transform_name))
+        return
+
+    client_msg = MaltegoMsg(LocalArgs=local_args)
+    try :
+        # Pappers transforms write their output entity after entity (see transforms/papperresponse.py)
+        if hasattr(transform_cls, 'run_transform_stream') :
+            output = transform_cls.run_transform_stream(client_msg)
+        else :
+            output = [ transform_cls.run_transform(client_msg) ]
+    except Exception as e :
+        log.error("An exception occurred while executing your transform code.")
+        log.error(e, exc_info=True)
+        output = [ get_exception_message() ]
+    for chunk in output :
+        sys.stdout.write(chunk)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+
+    # Add the metrics of this run to the rolling file (see transforms/pappermetrics.py)
+    try :
+        from transforms import pappermetrics
+        pappermetrics.flush()
+    except Exception as e :
+        log.warning("Metrics error: %s", e)
+
+
+## TDS CONFIGURATION FILES
+
+CONFIG_SOURCES = [ os.path.join(PROJECT_DIR, 'extensions.py'), os.path.join(PROJECT_DIR, 'settings.py') ]
+CONFIG_FILES = [ './transforms.csv', './settings.csv' ]
+
+# The configuration files only have to be written when a transform or a setting has changed
+def is_config_outdated() :
+    sources = CONFIG_SOURCES + glob.glob(os.path.join(TRANSFORMS_DIR, '*.py'))
+    newest = max(os.path.getmtime(path) for path in sources)
+    for path in CONFIG_FILES :
+        if not os.path.exists(path) or os.path.getmtime(path) < newest :
+            return True
+    return False
+
+def write_config( registry , force=False ) :
+    if force or is_config_outdated() :
+        registry.write_transforms_config()
+        registry.write_settings_config()
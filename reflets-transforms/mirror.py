@@ -0,0 +1,143 @@
+# What changed in the companies of an investigation
+#
+# Every company record fetched by the transforms is kept in a versioned local mirror
+# (see transforms/pappermirror.py). This script shows the changes found between the versions, and
+# fetches again the records which are stale.
+#
+#   python mirror.py changes --days 30
+#   python mirror.py history FR:123456789 --json
+#   python mirror.py status
+#   python mirror.py refresh --workers 4
+#
+# Changes : for each new version, the items added (+), removed (-) and changed (~) in the lists of
+# the record (representants, beneficiaires_effectifs, etablissements, depots_actes, comptes,
+# publications_bodacc ; officers, ubos, documents, financials... for UK, BE and CH companies),
+# and the other fields changed.
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch import make_request_msg
+
+from transforms import pappermirror
+
+DEFAULT_DAYS = 30
+DEFAULT_WORKERS = 4
+
+CHANGES = ( ( 'added', '+' ), ( 'removed', '-' ), ( 'changed', '~' ) )
+
+
+def format_time( seconds ) :
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(seconds))
+
+# "representants +1 -2 / fields date_cessation, capital"
+def summarize( diff ) :
+    if diff is None :
+        return "first version"
+    parts = []
+    for name, changes in diff.items() :
+        if name == 'fields' :
+            parts.append("fields " + ", ".join(changes))
+        else :
+            parts.append(f"{name} " + " ".join(f"{sign}{len(changes[kind])}" for kind, sign in CHANGES if kind in changes))
+    return " / ".join(parts) or "no change"
+
+def changes( args ) :
+    since = time.time() - args.days * 24 * 3600
+    result = pappermirror.get_changes(since)
+    for key, version, fetched, diff in result :
+        if args.json :
+            sys.stdout.write(json.dumps({ 'company': key, 'version': version, 'fetched': fetched, 'diff': diff }, ensure_ascii=False) + "\n")
+        else :
+            sys.stdout.write(f"{format_time(fetched)}  {key:<16} v{version}  {summarize(diff)}\n")
+    sys.stderr.write(f"{len(result)} changes in the last {args.days} days\n")
+    return 0
+
+def history( args ) :
+    versions = pappermirror.get_history(args.company)
+    if len(versions) == 0 :
+        sys.stderr.write(f"{args.company} is not in the mirror\n")
+        return 1
+    for version in versions :
+        if args.json :
+            sys.stdout.write(json.dumps(dict(version, company=args.company), ensure_ascii=False) + "\n")
+        else :
+            sys.stdout.write(f"{format_time(version['fetched'])}  v{version['version']}  {summarize(version['diff'])}\n")
+    return 0
+
+def status( args ) :
+    companies = pappermirror.get_companies()
+    for company in companies :
+        state = company['stale'] or "fresh"
+        sys.stdout.write(f"{company['key']:<16} v{company['version']:<3} fetched {format_time(company['fetched'])}  changed {format_time(company['changed'])}  {state}\n")
+    stale = len([ company for company in companies if company['stale'] ])
+    sys.stderr.write(f"{len(companies)} companies, {stale} stale\n")
+    return 0
+
+# Fetch a company again with the request of FicheEntreprise, return its last version
+def refresh_company( key , force ) :
+    from transforms.FicheEntreprise import fetch_company
+
+    country, identifier = key.split(":", 1)
+    request = make_request_msg(identifier, { 'id_tax_number': identifier, 'countrycode': country })
+    fetch_company(request, refresh=force)
+    history = pappermirror.get_history(key)
+    return history[-1]
+
+def refresh( args ) :
+    companies = [ company for company in pappermirror.get_companies() if args.all or company['stale'] ]
+    sys.stderr.write(f"{len(companies)} companies to fetch again\n")
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    futures = { executor.submit(refresh_company, company['key'], args.all): company for company in companies }
+    for count, future in enumerate(as_completed(futures), 1) :
+        company = futures[future]
+        try :
+            version = future.result()
+        except Exception as e :
+            sys.stderr.write(f"[{count}/{len(futures)}] {company['key']} : {e}\n")
+            continue
+        result = summarize(version['diff']) if version['version'] > company['version'] else "no change"
+        sys.stderr.write(f"[{count}/{len(futures)}] {company['key']} : {result}\n")
+    executor.shutdown()
+
+    # Usage of the API by this run (see transforms/pappermetrics.py)
+    from transforms import pappermetrics
+    pappermetrics.flush()
+    return 0
+
+
+def main( argv=None ) :
+    parser = argparse.ArgumentParser(description="Changes of the companies in the local mirror")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_changes = commands.add_parser('changes', help="companies changed recently")
+    parser_changes.add_argument('--days', type=float, default=DEFAULT_DAYS, help=f"changes of the last days (default {DEFAULT_DAYS})")
+    parser_changes.add_argument('--json', action='store_true', help="one JSON object by change, with the differences")
+    parser_changes.set_defaults(function=changes)
+
+    parser_history = commands.add_parser('history', help="versions of a company")
+    parser_history.add_argument('company', help="ex : FR:123456789 or GB:01234567")
+    parser_history.add_argument('--json', action='store_true', help="one JSON object by version, with the differences")
+    parser_history.set_defaults(function=history)
+
+    parser_status = commands.add_parser('status', help="companies of the mirror, fresh or stale")
+    parser_status.set_defaults(function=status)
+
+    parser_refresh = commands.add_parser('refresh', help="fetch the stale companies again")
+    parser_refresh.add_argument('--all', action='store_true', help="every company, even the fresh ones")
+    parser_refresh.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="companies fetched at the same time")
+    parser_refresh.set_defaults(function=refresh)
+
+    args = parser.parse_args(argv)
+    # Path and staleness rules of the mirror in api_keys.yml
+    from transforms import papperparse
+    papperparse.apply_config()
+    return args.function(args)
+
+
+if __name__ == '__main__' :
+    sys.exit(main())
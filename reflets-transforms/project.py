@@ -1,15 +1,53 @@
 import sys
 
+import worker
+
+# Local transforms are forwarded to the persistent worker (see worker.py),
+# or run with a fast start importing only the requested transform (see launcher.py)
+if __name__ == '__main__' and worker.is_local_run(sys.argv):
+    worker.run_local(sys.argv[2], sys.argv[3:])
+    sys.exit(0)
+
+import launcher
+
 import transforms
 from extensions import registry
+from flask import Response, request
 from maltego_trx.handler import handle_run
-from maltego_trx.registry import register_transform_classes
-from maltego_trx.server import app as application
+from maltego_trx.maltego import MaltegoMsg
+from maltego_trx.registry import mapping, register_transform_classes
+from maltego_trx.server import app as application, get_exception_message, log, transform_runner
+from transforms import pappermetrics
 
 register_transform_classes(transforms)
 
-registry.write_transforms_config()
-registry.write_settings_config()
+# "python project.py config" always rewrites transforms.csv and settings.csv,
+# otherwise they are only rewritten when a transform or a setting has changed
+launcher.write_config(registry, force=(__name__ == '__main__' and sys.argv[1:2] == ['config']))
+
+# The Pappers transforms send their output entity after entity (see transforms/papperresponse.py).
+# Same answers as maltego_trx.server.transform_runner, which handles every other case.
+def stream_transform_runner(transform_name):
+    transform_cls = mapping.get(transform_name.lower())
+    if request.method != 'POST' or not hasattr(transform_cls, 'run_transform_stream'):
+        return transform_runner(transform_name)
+    try:
+        output = transform_cls.run_transform_stream(MaltegoMsg(request.data))
+    except Exception as e:
+        log.error("An exception occurred while executing your transform code.")
+        log.error(e, exc_info=True)
+        return get_exception_message(), 200
+    return Response(output, 200)
+
+application.view_functions['transform_runner'] = stream_transform_runner
+
+# Metrics of the Pappers API calls, in the Prometheus text format (transform server)
+@application.route('/metrics', methods=['GET'])
+def metrics():
+    return pappermetrics.to_prometheus(), 200, { 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8' }
 
 if __name__ == '__main__':
     handle_run(__name__, sys.argv, application)
+    # Local transforms add their metrics to the rolling file
+    if sys.argv[1:2] == ['local']:
+        pappermetrics.flush()
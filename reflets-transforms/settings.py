@@ -3,6 +3,7 @@ from maltego_trx.decorator_registry import TransformSetting
 api_key_setting = TransformSetting(name='api_key',
                                    display_name='API Key',
                                    setting_type='string',
+                                   optional=True,
                                    global_setting=True)
 
 language_setting = TransformSetting(name='language',
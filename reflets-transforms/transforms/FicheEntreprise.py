@@ -1,20 +1,22 @@
 # This Maltego Transformer is designed to explore ENTREPRISES from the Pappers.fr API and build corresponding entities
 
-import json
-import sys
+import logging
+from transforms import papperlog
 from transforms import papperparse
+from transforms import pappermetrics
 import os
 
-import requests
-
 from extensions import registry
 from maltego_trx.entities import Company
 from maltego_trx.maltego import UIM_TYPES, MaltegoMsg, MaltegoTransform
-from maltego_trx.transform import DiscoverableTransform
+from transforms.papperresponse import PappersTransform
+
+log = logging.getLogger(__name__)
 
 
 # Parse a DetailedCompany from the results of the Pappers FR V2 API
-def parse_entreprise_fr ( response, json_res ) : 
+@pappermetrics.measure_parse
+def parse_entreprise_fr ( response, json_res, api_key=None ) : 
 
     # Creation of new node Dirigeant for Beneficiaries
     for beneficiaire in json_res['beneficiaires_effectifs']:
@@ -24,8 +26,8 @@ def parse_entreprise_fr ( response, json_res ) :
             papperparse.generate_beneficiaire_link_config( entity, beneficiaire )
 
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Beneficiaire: {json.dumps(beneficiaire , indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Beneficiaire: %s", papperlog.compact(beneficiaire))
 
 
     for representant in json_res['representants']:
@@ -42,8 +44,8 @@ def parse_entreprise_fr ( response, json_res ) :
                 papperparse.generate_representant_link_config( entity , representant )
 
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Representant: {json.dumps(representant , indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Representant: %s", papperlog.compact(representant))
 
 
     # Parsing of headquarters
@@ -52,8 +54,8 @@ def parse_entreprise_fr ( response, json_res ) :
             entity = papperparse.parse_etablissement( response, json_res['siege'] )
             papperparse.generate_siege_link_config( entity , json_res['siege'] )
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Siege: {json.dumps(json_res['siege'], indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Siege: %s", papperlog.compact(json_res['siege']))
 
 
     # Extract 'etablissements' to build HeadquarterLocation
@@ -63,22 +65,23 @@ def parse_entreprise_fr ( response, json_res ) :
             entity = papperparse.parse_etablissement( response, etablissement )
             papperparse.generate_etablissement_link_config( entity , etablissement )
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Etablissement: {json.dumps(etablissement, indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Etablissement: %s", papperlog.compact(etablissement))
 
 
     # Auto-qualification of the calling entity to be able to update the note on the current node.
     try : 
         entity = papperparse.parse_entreprise( response , json_res )            
         # Auto-qualification : generation of a note with documents and download links 
-        papperparse.parse_note(entity, json_res )
+        papperparse.parse_note(entity, json_res, api_key )
     except Exception as e :
-        sys.stderr.write(f"Error: {e}\n")
-        sys.stderr.write(f"Problem in the main result parsing for auto-qualification\n")
+        log.warning("Error: %s", e)
+        log.warning("Problem in the main result parsing for auto-qualification")
 
 
 # Parsing results of the Pappers IN V1 API for a DetailedCompany
-def parse_entreprise_in ( response, json_res, default_country_code ) : 
+@pappermetrics.measure_parse
+def parse_entreprise_in ( response, json_res, default_country_code, api_key=None ) : 
                 
     # Creation of new node Dirigeant for Beneficiaries
     for officers in json_res['officers']:
@@ -88,8 +91,8 @@ def parse_entreprise_in ( response, json_res, default_country_code ) :
             papperparse.create_officers_link_config( entity, officers )
 
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Beneficiaire: {json.dumps(officers , indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Beneficiaire: %s", papperlog.compact(officers))
 
     # Parsing of headquarters
     if 'head_office' in json_res :
@@ -97,8 +100,8 @@ def parse_entreprise_in ( response, json_res, default_country_code ) :
             entity = papperparse.parse_etablissement_in( response, json_res['head_office'], default_country_code )
             papperparse.generate_siege_link_config_in( entity , json_res['head_office'] )
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Siege: {json.dumps(json_res['head_office'], indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Siege: %s", papperlog.compact(json_res['head_office']))
 
 
     # Creation of new node Dirigeant for Beneficiaries
@@ -107,55 +110,65 @@ def parse_entreprise_in ( response, json_res, default_country_code ) :
             entity = papperparse.parse_ubos(response, ubos )
 
         except Exception as e :
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.write(f"Representant: {json.dumps(ubos , indent=4)}\n")
+            log.warning("Error: %s", e)
+            log.debug("Representant: %s", papperlog.compact(ubos))
 
 
     # Auto-qualification of the calling entity to be able to update the note on the current node.
     try : 
         entity = papperparse.parse_entreprise_in( response , json_res )            
         # Auto-qualification : generation of a note with documents and download links 
-        papperparse.parse_note_in(entity, json_res )
+        papperparse.parse_note_in(entity, json_res, api_key )
     except Exception as e :
-        sys.stderr.write(f"Error: {e}\n")
-        sys.stderr.write(f"Problem in the main result parsing for auto-qualification\n")
+        log.warning("Error: %s", e)
+        log.warning("Problem in the main result parsing for auto-qualification")
+
+
+
+# Countries of the Pappers IN V1 API (the other companies are searched in the FR V2 API)
+IN_COUNTRIES = ( 'CH', 'UK', 'GB', 'BE' )
+IN_FIELDS = 'officers,ubos,financials,documents,certificates,publications,establishments,contacts'
+
+# Answer of the Pappers API on the company of the request : ( 'fr' or 'in' , answer , API token )
+# Also used by download.py to list the documents of the company, and by mirror.py (refresh=True :
+# fetched from the API, not from the mirror nor the cache)
+def fetch_company( request , refresh=False ) :
+    country_code = request.getProperty('countrycode')
+    payload = papperparse.create_payload_entreprise(request)
+
+    if country_code is not None and country_code in IN_COUNTRIES :
+        # XXX For compatibility with Maltego country code and flags
+        if country_code == 'GB' :
+            payload['country_code'] = 'UK'
+        else :
+            payload['country_code'] = country_code
+
+        payload['company_number'] = payload['siren']
+        payload['fields'] = IN_FIELDS
+        json_res = papperparse.make_request(papperparse.get_api_url('in', 'company'), payload, refresh=refresh)
+        #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}")
+        return 'in', json_res, payload['api_token']
 
+    json_res = papperparse.make_request(papperparse.get_api_url('fr', 'entreprise'), payload, refresh=refresh)
+    #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}") 
+    return 'fr', json_res, payload['api_token']
 
 
 @registry.register_transform(display_name="Pappers.fr - Fiche Entrerise", input_entity="reflets.DetailedCompany",
                              description='Pappers.fr - Fiche Entrerise',
                              output_entities=["maltego.Document", "maltego.Person"])
-class FicheEntreprise(DiscoverableTransform):
+class FicheEntreprise(PappersTransform):
 
     @classmethod
+    @pappermetrics.measure_transform
     def create_entities(cls, request: MaltegoMsg, response: MaltegoTransform):
         try:
-
-            country_code = request.getProperty('countrycode')
-            if country_code is not None and ( country_code == 'CH' or country_code == 'UK' or country_code == 'GB' or country_code == 'BE') :
-                payload = papperparse.create_payload_entreprise(request)
-
-                # XXX For compatibility with Maltego country code and flags
-                if country_code == 'GB' :
-                     payload['country_code'] = 'UK'
-                else :
-                    payload['country_code'] = country_code
-
-                payload['company_number'] = payload['siren']
-                payload['fields'] = 'officers,ubos,financials,documents,certificates,publications,establishments,contacts'
-                json_res = papperparse.make_request("https://api.pappers.in/v1/company", payload)
-                #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}")
-
-                parse_entreprise_in( response, json_res, country_code )
-
+            api, json_res, api_token = fetch_company(request)
+            if api == 'in' :
+                parse_entreprise_in( response, json_res, request.getProperty('countrycode'), api_token )
                 return                 
 
-            payload = papperparse.create_payload_entreprise(request)
-            json_res = papperparse.make_request("https://api.pappers.fr/v2/entreprise", payload)
-            #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}") 
-
-            parse_entreprise_fr( response, json_res )
+            parse_entreprise_fr( response, json_res, api_token )
 
         except Exception as e:
             response.addUIMessage(f"Error: {e}\n")
-
@@ -1,24 +1,26 @@
 # This Maltego Transformer is designed perform research in Pappers company database for address mentionned in company documents.
 # Very usefull to explore HeadquartersAddress entities.
 
-import copy
-import sys
+import logging
+from transforms import papperlog
 from transforms import papperparse
+from transforms import pappermetrics
+from transforms import pappernote
 import re
 import html
 
 from extensions import registry
 from maltego_trx.entities import Company
 from maltego_trx.maltego import UIM_TYPES, MaltegoMsg, MaltegoTransform
-from maltego_trx.transform import DiscoverableTransform
+from transforms.papperresponse import PappersTransform
+
+log = logging.getLogger(__name__)
 
 
 # Configure paparmeters to search Headquarters location in Pappers FR V2 API
 def create_payload_siege(request) :
-    config = papperparse.load_api_key_config()
-
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = papperparse.get_api_key(request)
     q = "\"" + request.getProperty("streetaddress") + "\" " + request.getProperty("postalcode") + " " + re.sub(r'(?is)\d+\s*$', '', request.getProperty("city")  )
     payload_tpl['q'] = q
 
@@ -30,10 +32,8 @@ def create_payload_siege(request) :
 
 # Configure paparmeters to search Headquarters location in Pappers IN V1 API
 def create_payload_siege_in(request) :
-    config = papperparse.load_api_key_config()
-
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = papperparse.get_api_key(request)
     q = "\"" + request.getProperty("streetaddress") + "\" " + request.getProperty("city") 
     payload_tpl['q'] = q
 
@@ -44,73 +44,54 @@ def create_payload_siege_in(request) :
     return payload_tpl  
 
 
-# Parse mentions from the address to configure link text. (Pappers V2 FR API)
-# All mentions of the address will be added to the company's notes for furtehr investigation
-def generate_siege_mention_link ( entity, entreprise ) :
+# Mentions of the address in the documents of a company : link label and note
+# The note is limited as the notes of papperparse (see pappernote.py, section 'mentions')
+def set_mention_link( entity, documents, date_key ) :
+    def format_document( document ) :
+        text = ""
+        if 'type' in document :
+            text += f"Type: {document['type']}\n"
+        if date_key in document :
+            text += f"Date: {document[date_key]}\n"
+        if 'mentions' in document and len(document['mentions']) > 0 :
+            for mention in document['mentions'] :
+                text += f"  {mention}\n"
+        # Escaped here, before the limits of the note are applied to the text
+        return html.escape(re.sub(r'(?is)<(?:/)?em>', '', text))
+
+    note = pappernote.Note()
+    note.add_section('mentions', "Mentionned in :\n\n", documents or None, format_document)
+
     link_label = ""
-    note = ""
-    if 'documents' in entreprise and len(entreprise['documents']) > 0 :
-        link_label = "Mention in :"
-        note = "Mentionned in :\n\n"
-        for document in  entreprise['documents'] : 
-            if 'type' in document :
-                #link_label += f"{document['type']} "
-                note += f"Type: {document['type']}\n"
-            if 'date_depot' in document :
-                link_label += f"{document['date_depot']} "
-                note += f"Type: {document['date_depot']}\n"
-            if 'mentions' in document and len(document['mentions']) > 0 :
-                for mention in document['mentions'] : 
-                    m = mention.encode("ascii","ignore")
-                    note += f"  {m}\n"
-            
-    note2 = html.escape(re.sub(r'(?is)<(?:/)?em>', '', note))  
+    if len(documents) > 0 :
+        link_label = "Mention in :" + "".join(f"{document[date_key]} " for document in documents if date_key in document)
     entity.setLinkLabel(link_label)
-    entity.setNote(note2)
+    entity.setNote(note.build())
     entity.reverseLink()
 
+# Parse mentions from the address to configure link text. (Pappers V2 FR API)
+# All mentions of the address will be added to the company's notes for furtehr investigation
+def generate_siege_mention_link ( entity, entreprise ) :
+    set_mention_link(entity, entreprise.get('documents') or [], 'date_depot')
+
 # Parse mentions from the address to configure link text. (Pappers V1 IN API)
 # All mentions of the address will be added to the company's notes for furtehr investigation
 def generate_siege_mention_link_in ( entity, entreprise ) :
-    link_label = ""
-    note = ""
-    if 'publications' in entreprise and len(entreprise['publications']) > 0 :
-        link_label = "Mention in :"
-        note = "Mentionned in :\n\n"
-        for document in  entreprise['publications'] : 
-            if 'type' in document :
-                #link_label += f"{document['type']} "
-                note += f"Type: {document['type']}\n"
-            if 'date' in document :
-                link_label += f"{document['date']} "
-                note += f"Type: {document['date']}\n"
-            if 'mentions' in document and len(document['mentions']) > 0 :
-                for mention in document['mentions'] : 
-                    m = mention.encode("ascii","ignore")
-                    note += f"  {m}\n"
-            
-    note2 = html.escape(re.sub(r'(?is)<(?:/)?em>', '', note))   
-    entity.setLinkLabel(link_label)
-    entity.setNote(note2)
-    entity.reverseLink()
+    set_mention_link(entity, entreprise.get('publications') or [], 'date')
 
 
 @registry.register_transform(display_name="Pappers.fr - Recherche de siège", input_entity="maltego.Location",
                              description='Pappers.fr - Recherche de siège"',
                              output_entities=["reflets.DetailedCompany"])
-class RechercheSiege(DiscoverableTransform):
+class RechercheSiege(PappersTransform):
 
     @classmethod
+    @pappermetrics.measure_transform
     def create_entities(cls, request: MaltegoMsg, response: MaltegoTransform):
 
-        # Peppers API is strange when returning the number of page / result
-        # Normally there is a "total" who defines the number of returning results. But it seems wrong (5 for Nicolas Sarkozy but more results)
-        nbr_page = 100
-
         # This variable is used to limit the number of page browsed. At None, browss all the pages
         limit_page = 5
-        current_page = 1
-        
+
         try:
             # "countrysc" is the property containing COUNTRY_CODE in Location entities (origin of HeadquartersLocation)
             country_code = request.getProperty('countrysc')
@@ -127,38 +108,17 @@ class RechercheSiege(DiscoverableTransform):
                 #sys.stderr.write(f"Recherche: {payload_tpl}")
 
                 try:
-                    current_page = 1
-
-                    while current_page <= nbr_page:
-                        payload = copy.deepcopy(payload_tpl)
-                        payload['page'] = current_page
-
-                        #sys.stderr.write(f"Response: {json.dumps(payload, indent=4)}") 
-                        json_res = papperparse.make_request("https://api.pappers.in/v1/search", payload)
-                        #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}") 
-
-                        # Get the number of pages to browse
-                        if limit_page is None : 
-                            nbr_page = json_res['total']
-                        else : nbr_page = limit_page
-                        nbr_result = 0
-
-                        for entreprise in json_res['results']:
-                            nbr_result += 1
-
-                            # Parse the companies that mentions the location in their documents
-                            try : 
-                                entity = papperparse.parse_entreprise_in( response , entreprise )
-                                generate_siege_mention_link_in(entity, entreprise)          
-                            except Exception as e :
-                                sys.stderr.write(f"Error: {e}\n")
-                                sys.stderr.write(f"Problem company parsing in Headquarters Location search for Pappers IN {country_code}\n")
-
-                        # We set two conditions to stop querying the API
-                        # We browse the number of pages and we stop if one call has return empty result
-                        current_page += 1
-                        if nbr_result == 0:
-                            break
+                    # Results are browsed page after page : we stop querying the API at the first empty page
+                    # or once the entity budget of the transform is reached
+                    for entreprise in papperparse.iter_results(papperparse.get_api_url('in', 'search'), payload_tpl, limit_page, response):
+
+                        # Parse the companies that mentions the location in their documents
+                        try : 
+                            entity = papperparse.parse_entreprise_in( response , entreprise )
+                            generate_siege_mention_link_in(entity, entreprise)          
+                        except Exception as e :
+                            log.warning("Error: %s", e)
+                            log.warning("Problem company parsing in Headquarters Location search for Pappers IN %s", country_code)
 
                 except Exception as e:
                     response.addUIMessage(f"Error: {e}")                    
@@ -172,38 +132,17 @@ class RechercheSiege(DiscoverableTransform):
             #sys.stderr.write(f"Recherche: {payload_tpl}")
 
             try:
-                current_page = 1
-
-                while current_page <= nbr_page:
-                    payload = copy.deepcopy(payload_tpl)
-                    payload['page'] = current_page
-
-                    #sys.stderr.write(f"Response: {json.dumps(payload, indent=4)}") 
-                    json_res = papperparse.make_request("https://api.pappers.fr/v2/recherche", payload)
-                    #sys.stderr.write(f"Response: {json.dumps(json_res, indent=4)}") 
-
-                    # Get the number of pages to browse
-                    if limit_page is None : 
-                        nbr_page = json_res['total']
-                    else : nbr_page = limit_page
-                    nbr_result = 0
-
-                    for entreprise in json_res['resultats']:
-                        nbr_result += 1
-
-                        # Parse the companies that mentions the location in their documents
-                        try : 
-                            entity = papperparse.parse_entreprise( response , entreprise )  
-                            generate_siege_mention_link(entity, entreprise)          
-                        except Exception as e :
-                            sys.stderr.write(f"Error: {e}\n")
-                            sys.stderr.write(f"Problem company parsing in Headquarters Location search for Pappers FR\n")
-
-                    # We set two conditions to stop querying the API
-                    # We browse the number of pages and we stop if one call has return empty result
-                    current_page += 1
-                    if nbr_result == 0:
-                        break
+                # Results are browsed page after page : we stop querying the API at the first empty page
+                # or once the entity budget of the transform is reached
+                for entreprise in papperparse.iter_results(papperparse.get_api_url('fr', 'recherche'), payload_tpl, limit_page, response):
+
+                    # Parse the companies that mentions the location in their documents
+                    try : 
+                        entity = papperparse.parse_entreprise( response , entreprise )  
+                        generate_siege_mention_link(entity, entreprise)          
+                    except Exception as e :
+                        log.warning("Error: %s", e)
+                        log.warning("Problem company parsing in Headquarters Location search for Pappers FR")
 
             except Exception as e:
                 response.addUIMessage(f"Error: {e}")
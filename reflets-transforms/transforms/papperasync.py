@@ -0,0 +1,278 @@
+# Asyncio transport for the PAPPERS APIs (FR V2 and IN V1)
+# papperhttp holds one thread for each request in flight. Here the requests are coroutines of one
+# event loop, run by a background thread shared by the whole process : the pages of a search or
+# the lookups in several countries are all sent at the same time without a thread by request.
+# The synchronous transforms drive it through the bridge at the end of this module.
+#
+# aiohttp is used when it is installed. Without it, the requests are sent by papperhttp in the
+# executor of the loop : same answers, but the concurrency is bounded by the executor threads.
+# The rate limiter and the retries (papperhttp), the mirror, the cache, the single-flight and the
+# metrics are the same as for the synchronous transport.
+
+import asyncio
+import atexit
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from transforms import papperflight
+from transforms import papperhttp
+from transforms import pappermetrics
+from transforms import papperparse
+
+# Maximum number of requests in flight on the loop
+DEFAULT_ASYNC_CONNECTIONS = 100
+
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+# Owned by the loop thread : aiohttp sessions by host, limit of the requests in flight
+_sessions = {}
+_semaphore = None
+
+
+## CONFIGURATION
+
+# aiohttp is optional : None when it is not installed
+def get_aiohttp() :
+    try :
+        import aiohttp
+    except ImportError :
+        return None
+    return aiohttp
+
+def get_max_connections() :
+    return papperhttp.get_setting('async_connections', DEFAULT_ASYNC_CONNECTIONS)
+
+
+## EVENT LOOP
+
+# The shared loop, started on first use in a daemon thread
+def get_loop() :
+    global _loop, _loop_thread
+    with _loop_lock :
+        if _loop is None :
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="pappers-asyncio", daemon=True)
+            _loop_thread.start()
+            atexit.register(stop_loop)
+        return _loop
+
+# Close the aiohttp sessions and stop the loop (at exit)
+def stop_loop() :
+    global _loop
+    with _loop_lock :
+        loop = _loop
+        _loop = None
+    if loop is None :
+        return
+    try :
+        asyncio.run_coroutine_threadsafe(close_sessions(), loop).result(timeout=5)
+    except Exception :
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
+## SESSIONS
+
+def get_session( url ) :
+    aiohttp = get_aiohttp()
+    host = urlparse(url).netloc
+    session = _sessions.get(host)
+    if session is None or session.closed :
+        connect_timeout, read_timeout = papperhttp.get_timeout()
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=get_max_connections()),
+                                        timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+        _sessions[host] = session
+    return session
+
+def get_semaphore() :
+    global _semaphore
+    if _semaphore is None :
+        _semaphore = asyncio.Semaphore(get_max_connections())
+    return _semaphore
+
+async def close_sessions() :
+    for session in list(_sessions.values()) :
+        await session.close()
+    _sessions.clear()
+
+
+## REQUESTS
+
+# Answer of aiohttp, with the attributes of a requests.Response read by papperparse.read_page
+class Page :
+    def __init__( self , status_code , headers , content ) :
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text( self ) :
+        return self.content.decode('utf-8', errors='replace')
+
+    def json( self ) :
+        return json.loads(self.content)
+
+
+# aiohttp only accepts strings and numbers : None are dropped, as requests does
+def get_params( params ) :
+    return { k: str(v) for k, v in (params or {}).items() if v is not None }
+
+# Same as papperhttp.get : rate limiter, timeouts and retries
+async def get( url , params ) :
+    aiohttp = get_aiohttp()
+    if aiohttp is None :
+        return await asyncio.get_running_loop().run_in_executor(None, papperhttp.get, url, params)
+
+    max_retries = papperhttp.get_setting('max_retries', papperhttp.DEFAULT_MAX_RETRIES)
+    deadline = time.monotonic() + papperhttp.get_setting('retry_budget', papperhttp.DEFAULT_RETRY_BUDGET)
+    attempt = 0
+
+    while True :
+        wait = papperhttp.reserve(url)
+        if wait > 0 :
+            await asyncio.sleep(wait)
+        try :
+            async with get_semaphore() :
+                async with get_session(url).get(url, params=get_params(params)) as answer :
+                    page = Page(answer.status, answer.headers, await answer.read())
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e :
+            delay = papperhttp.get_error_delay(attempt, max_retries, deadline)
+            if delay is None :
+                if isinstance(e, asyncio.TimeoutError) :
+                    raise Exception(papperhttp.TIMEOUT_ERROR)
+                raise Exception(papperhttp.CONNECTION_ERROR)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+
+        delay = papperhttp.get_retry_delay(url, page, attempt, max_retries, deadline)
+        if delay is None :
+            return page
+        attempt += 1
+        await asyncio.sleep(delay)
+
+# Same as papperparse.make_request : mirror, cache, single-flight with the synchronous requests, metrics
+async def make_request( url , payload , use_cache=True , refresh=False ) :
+    papperparse.apply_config()
+    start = time.perf_counter()
+
+    json_res, use_cache, key, flight, leader = papperparse.lookup(url, payload, use_cache, refresh, start)
+    if json_res is not None :
+        return json_res
+    if not leader :
+        try :
+            # Shielded : a cancelled task must not cancel the request of the other callers
+            json_res = await asyncio.shield(asyncio.wrap_future(flight))
+        except Exception :
+            pappermetrics.record_request(url, "error", time.perf_counter() - start)
+            raise
+        papperparse.record_shared(url, payload, start)
+        return json_res
+
+    try :
+        try :
+            page = await get(url, payload)
+        except Exception :
+            pappermetrics.record_request(url, "error", time.perf_counter() - start)
+            raise
+        # JSON decoding and writes of the cache, the mirror and the index : in the executor of the
+        # loop, not to hold the other coroutines while a large page is stored
+        json_res = await asyncio.get_running_loop().run_in_executor(None, pappermetrics.run_as, pappermetrics.get_transform(),
+                                                                    papperparse.read_page, url, payload, page, use_cache, start)
+    except BaseException as e :
+        papperflight.land(key, flight, error=e)
+        raise
+    papperflight.land(key, flight, result=json_res)
+    return json_res
+
+# Several requests at the same time : list of the answers, or of the exceptions, in order
+async def make_requests( requests ) :
+    return await asyncio.gather(*( make_request(url, payload) for url, payload in requests ), return_exceptions=True)
+
+
+## PAGINATION
+
+# Same as papperparse.fetch_pages : the first page alone, then the pages it announces with at most
+# 'workers' pages in flight and the next ones one at a time, yielded in order until the first empty page
+async def fetch_pages( url , payload_tpl , limit_page , workers=None ) :
+    if workers is None :
+        workers = papperparse.get_page_workers()
+
+    json_res = await make_request(url, papperparse.copy_payload_page(payload_tpl, 1))
+    nbr_result = papperparse.count_results(json_res)
+    if nbr_result == 0 :
+        return
+    yield json_res
+
+    if limit_page is None :
+        nbr_page = json_res['total']
+    else :
+        nbr_page = limit_page
+
+    if 'par_page' in payload_tpl and nbr_result < int(payload_tpl['par_page']) :
+        return
+
+    known_pages = papperparse.count_known_pages(json_res, payload_tpl, nbr_page)
+    pending = deque()
+    next_page = 2
+
+    def fill() :
+        nonlocal next_page
+        while next_page <= nbr_page and len(pending) < max(1, workers) and ( next_page <= known_pages or len(pending) == 0 ) :
+            pending.append(asyncio.ensure_future(make_request(url, papperparse.copy_payload_page(payload_tpl, next_page))))
+            next_page += 1
+
+    try :
+        fill()
+        while len(pending) > 0 :
+            json_res = await pending.popleft()
+            if papperparse.count_results(json_res) == 0 :
+                return
+            fill()
+            yield json_res
+    finally :
+        for task in pending :
+            task.cancel()
+
+
+## SYNCHRONOUS BRIDGE
+
+# The coroutines run on the shared loop on behalf of the calling transform (see pappermetrics)
+async def run_as( transform , coroutine ) :
+    pappermetrics.set_transform(transform)
+    return await coroutine
+
+def submit( coroutine ) :
+    if threading.current_thread() is _loop_thread :
+        coroutine.close()
+        raise Exception("The asyncio bridge cannot be used from the event loop")
+    return asyncio.run_coroutine_threadsafe(run_as(pappermetrics.get_transform(), coroutine), get_loop())
+
+# Run a coroutine and wait for its result, ex : run(make_requests([ (url, payload), ... ]))
+def run( coroutine ) :
+    return submit(coroutine).result()
+
+# Iterate over an async generator, ex : iter_sync(fetch_pages(url, payload_tpl, 5))
+# The generator keeps running (next pages in flight) while the caller handles an item.
+def iter_sync( generator ) :
+    future = None
+    try :
+        while True :
+            future = submit(generator.__anext__())
+            try :
+                item = future.result()
+            except StopAsyncIteration :
+                return
+            yield item
+    finally :
+        if future is not None and not future.done() :
+            # Interrupted while waiting : the cancellation closes the generator
+            future.cancel()
+        else :
+            submit(generator.aclose()).result()
@@ -0,0 +1,275 @@
+# Persistent cache of the PAPPERS API responses
+# Re-running a transform on the same node (or re-expanding it after a graph reload) is served
+# from a local SQLite file instead of spending API tokens again.
+# In server mode, a bounded in-memory LRU sits in front of the file and keeps the decoded JSON
+# of the hot responses : they come back without disk read nor JSON decoding.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from transforms import pappermirror
+
+# The cache lives in a single file next to the transforms
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pappers_cache.sqlite')
+
+# Default time to live (in seconds) of the cached responses, by endpoint path
+# Company records move slowly, search results may change daily
+DEFAULT_TTL = {
+    '/v2/entreprise': 7 * 24 * 3600,
+    '/v2/recherche': 24 * 3600,
+    '/v2/recherche-dirigeants': 24 * 3600,
+    '/v2/recherche-beneficiaires': 24 * 3600,
+    '/v1/company': 7 * 24 * 3600,
+    '/v1/search': 24 * 3600,
+    '/v1/search-officers': 24 * 3600,
+}
+FALLBACK_TTL = 24 * 3600
+
+# Maximum size of the stored responses before eviction of the least recently used ones
+DEFAULT_MAX_SIZE_MB = 100
+
+# Bounds of the in-memory tier
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_MEMORY_SIZE_MB = 32
+
+# Payload parameters that must never be part of the cache key
+IGNORED_PARAMETERS = ( 'api_token', )
+
+
+_local = threading.local()
+_settings = {}
+
+# In-memory tier : key -> (expires, size, decoded json), oldest access first
+_memory = OrderedDict()
+_memory_size = 0
+_memory_lock = threading.Lock()
+_counters = { 'memory_hits': 0, 'disk_hits': 0, 'misses': 0 }
+
+
+## CONFIGURATION
+
+# Apply the 'cache' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+def is_enabled() :
+    return _settings.get('enabled', True)
+
+# When false, only the in-memory tier is used
+def is_persistent() :
+    return _settings.get('persistent', True)
+
+def get_ttl( url ) :
+    path = urlparse(url).path
+    ttl = _settings.get('ttl') or {}
+    if path in ttl :
+        return ttl[path]
+    return DEFAULT_TTL.get(path, FALLBACK_TTL)
+
+def get_max_size() :
+    return int(_settings.get('max_size_mb', DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+
+def get_memory_limits() :
+    entries = int(_settings.get('memory_entries', DEFAULT_MEMORY_ENTRIES))
+    size = int(_settings.get('memory_size_mb', DEFAULT_MEMORY_SIZE_MB) * 1024 * 1024)
+    return entries, size
+
+
+## IN-MEMORY TIER
+# The decoded JSON is shared between callers : parsers must not modify it
+
+def memory_get( key , now ) :
+    global _memory_size
+    with _memory_lock :
+        item = _memory.get(key)
+        if item is None :
+            return None
+        if item[0] < now :
+            del _memory[key]
+            _memory_size -= item[1]
+            return None
+        _memory.move_to_end(key)
+        return item[2]
+
+def memory_put( key , expires , size , json_res ) :
+    global _memory_size
+    max_entries, max_size = get_memory_limits()
+    if max_entries <= 0 or size > max_size :
+        return
+    with _memory_lock :
+        if key in _memory :
+            _memory_size -= _memory.pop(key)[1]
+        _memory[key] = ( expires, size, json_res )
+        _memory_size += size
+        while len(_memory) > max_entries or _memory_size > max_size :
+            _memory_size -= _memory.popitem(last=False)[1][1]
+
+def memory_remove( key ) :
+    global _memory_size
+    with _memory_lock :
+        item = _memory.pop(key, None)
+        if item is not None :
+            _memory_size -= item[1]
+
+def memory_clear() :
+    global _memory_size
+    with _memory_lock :
+        _memory.clear()
+        _memory_size = 0
+
+def count( counter ) :
+    with _memory_lock :
+        _counters[counter] += 1
+
+# Hit / miss counters of both tiers since the start of the process
+def stats() :
+    with _memory_lock :
+        result = dict(_counters)
+        result['memory_entries'] = len(_memory)
+        result['memory_bytes'] = _memory_size
+    return result
+
+
+## STORAGE
+
+# One connection per thread : sqlite3 connections cannot be shared between threads
+def get_connection() :
+    connection = getattr(_local, 'connection', None)
+    if connection is None :
+        connection = sqlite3.connect(_settings.get('path', CACHE_PATH), timeout=10)
+        # WAL allows several Maltego local transforms to read while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                url TEXT NOT NULL,
+                                body TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                expires REAL NOT NULL,
+                                accessed REAL NOT NULL,
+                                params TEXT )""")
+        # Files created before the parameters were stored : their responses have no parameters
+        if 'params' not in [ row[1] for row in connection.execute("PRAGMA table_info(responses)") ] :
+            connection.execute("ALTER TABLE responses ADD COLUMN params TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        connection.commit()
+        _local.connection = connection
+    return connection
+
+
+def get_params( payload ) :
+    return sorted( (k, str(v)) for k, v in (payload or {}).items() if k not in IGNORED_PARAMETERS )
+
+# Cache key : URL + sorted payload, without the API token
+def make_key( url , payload ) :
+    params = get_params(payload)
+    raw = url + "?" + json.dumps(params, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# Return the decoded JSON response, or None if absent or expired
+# The memory tier is looked up first, a response found on disk is promoted to memory
+def get( url , payload ) :
+    key = make_key(url, payload)
+    now = time.time()
+
+    json_res = memory_get(key, now)
+    if json_res is not None :
+        count('memory_hits')
+        return json_res
+    if not is_persistent() :
+        count('misses')
+        return None
+
+    connection = get_connection()
+    row = connection.execute("SELECT body, expires FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None :
+        count('misses')
+        return None
+    if row[1] < now :
+        connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+        connection.commit()
+        count('misses')
+        return None
+
+    connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+    connection.commit()
+    json_res = json.loads(row[0])
+    memory_put(key, row[1], len(row[0]), json_res)
+    count('disk_hits')
+    return json_res
+
+
+# Store the raw JSON text of a response (and its decoded form in memory when given)
+def put( url , payload , body , json_res=None , ttl=None ) :
+    if ttl is None :
+        ttl = get_ttl(url)
+    if ttl <= 0 :
+        return
+
+    key = make_key(url, payload)
+    now = time.time()
+    if json_res is not None :
+        memory_put(key, now + ttl, len(body), json_res)
+    if not is_persistent() :
+        return
+
+    connection = get_connection()
+    params = json.dumps(dict(get_params(payload)), ensure_ascii=False)
+    connection.execute("INSERT OR REPLACE INTO responses (key, url, body, size, created, expires, accessed, params) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key, url, body, len(body), now, now + ttl, now, params))
+    connection.commit()
+    evict()
+
+
+# Every stored response not expired : ( url , params , body ), for the index of papperindex.py
+# params : the payload without the API token, None for the responses stored without it
+def iter_responses() :
+    connection = get_connection()
+    for url, params, body in connection.execute("SELECT url, params, body FROM responses WHERE expires >= ?", (time.time(),)).fetchall() :
+        yield url, json.loads(params) if params is not None else None, body
+
+
+# Remove expired responses, then the least recently used ones until the size cap is respected
+def evict() :
+    connection = get_connection()
+    connection.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+
+    max_size = get_max_size()
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total > max_size :
+        rows = connection.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        for key, size in rows :
+            if total <= max_size :
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+    connection.commit()
+
+
+# Forget one response (url + payload), every response of an endpoint (url only), or everything
+def invalidate( url=None , payload=None ) :
+    memory_clear()
+    connection = get_connection()
+    if url is None :
+        connection.execute("DELETE FROM responses")
+    elif payload is None :
+        connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+    else :
+        connection.execute("DELETE FROM responses WHERE key = ?", (make_key(url, payload),))
+    connection.commit()
+
+    # The company records are answered by the mirror before the cache (see papperparse.make_request)
+    if pappermirror.is_enabled() :
+        pappermirror.invalidate(url, payload)
+
+def clear() :
+    invalidate()
@@ -0,0 +1,340 @@
+# Country codes of the addresses returned by the PAPPERS APIs
+# Pappers FR V2 gives a 'code_pays' most of the time, but some addresses (foreign representants,
+# beneficiaires, IN V1 officers) only have a country name, in French or in English, in capitals or
+# not ('ETATS-UNIS', 'United States', 'Royaume-Uni'...). The names are folded (case, accents,
+# punctuation) and looked up in an index of the ISO 3166 countries built once : a single dictionary
+# hit, memoized by raw value.
+
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Maximum number of raw values (codes, names, cities) kept with their resolved code
+MEMO_SIZE = 4096
+
+
+# ISO 3166-1 : alpha-2, alpha-3, English name, French name
+COUNTRIES = [
+    ( 'AD', 'AND', "Andorra", "Andorre" ),
+    ( 'AE', 'ARE', "United Arab Emirates", "Émirats arabes unis" ),
+    ( 'AF', 'AFG', "Afghanistan", "Afghanistan" ),
+    ( 'AG', 'ATG', "Antigua and Barbuda", "Antigua-et-Barbuda" ),
+    ( 'AI', 'AIA', "Anguilla", "Anguilla" ),
+    ( 'AL', 'ALB', "Albania", "Albanie" ),
+    ( 'AM', 'ARM', "Armenia", "Arménie" ),
+    ( 'AO', 'AGO', "Angola", "Angola" ),
+    ( 'AQ', 'ATA', "Antarctica", "Antarctique" ),
+    ( 'AR', 'ARG', "Argentina", "Argentine" ),
+    ( 'AS', 'ASM', "American Samoa", "Samoa américaines" ),
+    ( 'AT', 'AUT', "Austria", "Autriche" ),
+    ( 'AU', 'AUS', "Australia", "Australie" ),
+    ( 'AW', 'ABW', "Aruba", "Aruba" ),
+    ( 'AX', 'ALA', "Åland Islands", "Îles Åland" ),
+    ( 'AZ', 'AZE', "Azerbaijan", "Azerbaïdjan" ),
+    ( 'BA', 'BIH', "Bosnia and Herzegovina", "Bosnie-Herzégovine" ),
+    ( 'BB', 'BRB', "Barbados", "Barbade" ),
+    ( 'BD', 'BGD', "Bangladesh", "Bangladesh" ),
+    ( 'BE', 'BEL', "Belgium", "Belgique" ),
+    ( 'BF', 'BFA', "Burkina Faso", "Burkina Faso" ),
+    ( 'BG', 'BGR', "Bulgaria", "Bulgarie" ),
+    ( 'BH', 'BHR', "Bahrain", "Bahreïn" ),
+    ( 'BI', 'BDI', "Burundi", "Burundi" ),
+    ( 'BJ', 'BEN', "Benin", "Bénin" ),
+    ( 'BL', 'BLM', "Saint Barthélemy", "Saint-Barthélemy" ),
+    ( 'BM', 'BMU', "Bermuda", "Bermudes" ),
+    ( 'BN', 'BRN', "Brunei Darussalam", "Brunei Darussalam" ),
+    ( 'BO', 'BOL', "Bolivia", "Bolivie" ),
+    ( 'BQ', 'BES', "Bonaire, Sint Eustatius and Saba", "Bonaire, Saint-Eustache et Saba" ),
+    ( 'BR', 'BRA', "Brazil", "Brésil" ),
+    ( 'BS', 'BHS', "Bahamas", "Bahamas" ),
+    ( 'BT', 'BTN', "Bhutan", "Bhoutan" ),
+    ( 'BV', 'BVT', "Bouvet Island", "Île Bouvet" ),
+    ( 'BW', 'BWA', "Botswana", "Botswana" ),
+    ( 'BY', 'BLR', "Belarus", "Biélorussie" ),
+    ( 'BZ', 'BLZ', "Belize", "Belize" ),
+    ( 'CA', 'CAN', "Canada", "Canada" ),
+    ( 'CC', 'CCK', "Cocos (Keeling) Islands", "Îles Cocos" ),
+    ( 'CD', 'COD', "Democratic Republic of the Congo", "République démocratique du Congo" ),
+    ( 'CF', 'CAF', "Central African Republic", "République centrafricaine" ),
+    ( 'CG', 'COG', "Congo", "Congo" ),
+    ( 'CH', 'CHE', "Switzerland", "Suisse" ),
+    ( 'CI', 'CIV', "Côte d'Ivoire", "Côte d'Ivoire" ),
+    ( 'CK', 'COK', "Cook Islands", "Îles Cook" ),
+    ( 'CL', 'CHL', "Chile", "Chili" ),
+    ( 'CM', 'CMR', "Cameroon", "Cameroun" ),
+    ( 'CN', 'CHN', "China", "Chine" ),
+    ( 'CO', 'COL', "Colombia", "Colombie" ),
+    ( 'CR', 'CRI', "Costa Rica", "Costa Rica" ),
+    ( 'CU', 'CUB', "Cuba", "Cuba" ),
+    ( 'CV', 'CPV', "Cabo Verde", "Cap-Vert" ),
+    ( 'CW', 'CUW', "Curaçao", "Curaçao" ),
+    ( 'CX', 'CXR', "Christmas Island", "Île Christmas" ),
+    ( 'CY', 'CYP', "Cyprus", "Chypre" ),
+    ( 'CZ', 'CZE', "Czechia", "Tchéquie" ),
+    ( 'DE', 'DEU', "Germany", "Allemagne" ),
+    ( 'DJ', 'DJI', "Djibouti", "Djibouti" ),
+    ( 'DK', 'DNK', "Denmark", "Danemark" ),
+    ( 'DM', 'DMA', "Dominica", "Dominique" ),
+    ( 'DO', 'DOM', "Dominican Republic", "République dominicaine" ),
+    ( 'DZ', 'DZA', "Algeria", "Algérie" ),
+    ( 'EC', 'ECU', "Ecuador", "Équateur" ),
+    ( 'EE', 'EST', "Estonia", "Estonie" ),
+    ( 'EG', 'EGY', "Egypt", "Égypte" ),
+    ( 'EH', 'ESH', "Western Sahara", "Sahara occidental" ),
+    ( 'ER', 'ERI', "Eritrea", "Érythrée" ),
+    ( 'ES', 'ESP', "Spain", "Espagne" ),
+    ( 'ET', 'ETH', "Ethiopia", "Éthiopie" ),
+    ( 'FI', 'FIN', "Finland", "Finlande" ),
+    ( 'FJ', 'FJI', "Fiji", "Fidji" ),
+    ( 'FK', 'FLK', "Falkland Islands", "Îles Malouines" ),
+    ( 'FM', 'FSM', "Micronesia", "Micronésie" ),
+    ( 'FO', 'FRO', "Faroe Islands", "Îles Féroé" ),
+    ( 'FR', 'FRA', "France", "France" ),
+    ( 'GA', 'GAB', "Gabon", "Gabon" ),
+    ( 'GB', 'GBR', "United Kingdom", "Royaume-Uni" ),
+    ( 'GD', 'GRD', "Grenada", "Grenade" ),
+    ( 'GE', 'GEO', "Georgia", "Géorgie" ),
+    ( 'GF', 'GUF', "French Guiana", "Guyane" ),
+    ( 'GG', 'GGY', "Guernsey", "Guernesey" ),
+    ( 'GH', 'GHA', "Ghana", "Ghana" ),
+    ( 'GI', 'GIB', "Gibraltar", "Gibraltar" ),
+    ( 'GL', 'GRL', "Greenland", "Groenland" ),
+    ( 'GM', 'GMB', "Gambia", "Gambie" ),
+    ( 'GN', 'GIN', "Guinea", "Guinée" ),
+    ( 'GP', 'GLP', "Guadeloupe", "Guadeloupe" ),
+    ( 'GQ', 'GNQ', "Equatorial Guinea", "Guinée équatoriale" ),
+    ( 'GR', 'GRC', "Greece", "Grèce" ),
+    ( 'GS', 'SGS', "South Georgia and the South Sandwich Islands", "Géorgie du Sud-et-les îles Sandwich du Sud" ),
+    ( 'GT', 'GTM', "Guatemala", "Guatemala" ),
+    ( 'GU', 'GUM', "Guam", "Guam" ),
+    ( 'GW', 'GNB', "Guinea-Bissau", "Guinée-Bissau" ),
+    ( 'GY', 'GUY', "Guyana", "Guyana" ),
+    ( 'HK', 'HKG', "Hong Kong", "Hong Kong" ),
+    ( 'HM', 'HMD', "Heard Island and McDonald Islands", "Îles Heard-et-MacDonald" ),
+    ( 'HN', 'HND', "Honduras", "Honduras" ),
+    ( 'HR', 'HRV', "Croatia", "Croatie" ),
+    ( 'HT', 'HTI', "Haiti", "Haïti" ),
+    ( 'HU', 'HUN', "Hungary", "Hongrie" ),
+    ( 'ID', 'IDN', "Indonesia", "Indonésie" ),
+    ( 'IE', 'IRL', "Ireland", "Irlande" ),
+    ( 'IL', 'ISR', "Israel", "Israël" ),
+    ( 'IM', 'IMN', "Isle of Man", "Île de Man" ),
+    ( 'IN', 'IND', "India", "Inde" ),
+    ( 'IO', 'IOT', "British Indian Ocean Territory", "Territoire britannique de l'océan Indien" ),
+    ( 'IQ', 'IRQ', "Iraq", "Irak" ),
+    ( 'IR', 'IRN', "Iran", "Iran" ),
+    ( 'IS', 'ISL', "Iceland", "Islande" ),
+    ( 'IT', 'ITA', "Italy", "Italie" ),
+    ( 'JE', 'JEY', "Jersey", "Jersey" ),
+    ( 'JM', 'JAM', "Jamaica", "Jamaïque" ),
+    ( 'JO', 'JOR', "Jordan", "Jordanie" ),
+    ( 'JP', 'JPN', "Japan", "Japon" ),
+    ( 'KE', 'KEN', "Kenya", "Kenya" ),
+    ( 'KG', 'KGZ', "Kyrgyzstan", "Kirghizistan" ),
+    ( 'KH', 'KHM', "Cambodia", "Cambodge" ),
+    ( 'KI', 'KIR', "Kiribati", "Kiribati" ),
+    ( 'KM', 'COM', "Comoros", "Comores" ),
+    ( 'KN', 'KNA', "Saint Kitts and Nevis", "Saint-Christophe-et-Niévès" ),
+    ( 'KP', 'PRK', "North Korea", "Corée du Nord" ),
+    ( 'KR', 'KOR', "South Korea", "Corée du Sud" ),
+    ( 'KW', 'KWT', "Kuwait", "Koweït" ),
+    ( 'KY', 'CYM', "Cayman Islands", "Îles Caïmans" ),
+    ( 'KZ', 'KAZ', "Kazakhstan", "Kazakhstan" ),
+    ( 'LA', 'LAO', "Laos", "Laos" ),
+    ( 'LB', 'LBN', "Lebanon", "Liban" ),
+    ( 'LC', 'LCA', "Saint Lucia", "Sainte-Lucie" ),
+    ( 'LI', 'LIE', "Liechtenstein", "Liechtenstein" ),
+    ( 'LK', 'LKA', "Sri Lanka", "Sri Lanka" ),
+    ( 'LR', 'LBR', "Liberia", "Liberia" ),
+    ( 'LS', 'LSO', "Lesotho", "Lesotho" ),
+    ( 'LT', 'LTU', "Lithuania", "Lituanie" ),
+    ( 'LU', 'LUX', "Luxembourg", "Luxembourg" ),
+    ( 'LV', 'LVA', "Latvia", "Lettonie" ),
+    ( 'LY', 'LBY', "Libya", "Libye" ),
+    ( 'MA', 'MAR', "Morocco", "Maroc" ),
+    ( 'MC', 'MCO', "Monaco", "Monaco" ),
+    ( 'MD', 'MDA', "Moldova", "Moldavie" ),
+    ( 'ME', 'MNE', "Montenegro", "Monténégro" ),
+    ( 'MF', 'MAF', "Saint Martin", "Saint-Martin" ),
+    ( 'MG', 'MDG', "Madagascar", "Madagascar" ),
+    ( 'MH', 'MHL', "Marshall Islands", "Îles Marshall" ),
+    ( 'MK', 'MKD', "North Macedonia", "Macédoine du Nord" ),
+    ( 'ML', 'MLI', "Mali", "Mali" ),
+    ( 'MM', 'MMR', "Myanmar", "Birmanie" ),
+    ( 'MN', 'MNG', "Mongolia", "Mongolie" ),
+    ( 'MO', 'MAC', "Macao", "Macao" ),
+    ( 'MP', 'MNP', "Northern Mariana Islands", "Îles Mariannes du Nord" ),
+    ( 'MQ', 'MTQ', "Martinique", "Martinique" ),
+    ( 'MR', 'MRT', "Mauritania", "Mauritanie" ),
+    ( 'MS', 'MSR', "Montserrat", "Montserrat" ),
+    ( 'MT', 'MLT', "Malta", "Malte" ),
+    ( 'MU', 'MUS', "Mauritius", "Maurice" ),
+    ( 'MV', 'MDV', "Maldives", "Maldives" ),
+    ( 'MW', 'MWI', "Malawi", "Malawi" ),
+    ( 'MX', 'MEX', "Mexico", "Mexique" ),
+    ( 'MY', 'MYS', "Malaysia", "Malaisie" ),
+    ( 'MZ', 'MOZ', "Mozambique", "Mozambique" ),
+    ( 'NA', 'NAM', "Namibia", "Namibie" ),
+    ( 'NC', 'NCL', "New Caledonia", "Nouvelle-Calédonie" ),
+    ( 'NE', 'NER', "Niger", "Niger" ),
+    ( 'NF', 'NFK', "Norfolk Island", "Île Norfolk" ),
+    ( 'NG', 'NGA', "Nigeria", "Nigeria" ),
+    ( 'NI', 'NIC', "Nicaragua", "Nicaragua" ),
+    ( 'NL', 'NLD', "Netherlands", "Pays-Bas" ),
+    ( 'NO', 'NOR', "Norway", "Norvège" ),
+    ( 'NP', 'NPL', "Nepal", "Népal" ),
+    ( 'NR', 'NRU', "Nauru", "Nauru" ),
+    ( 'NU', 'NIU', "Niue", "Niue" ),
+    ( 'NZ', 'NZL', "New Zealand", "Nouvelle-Zélande" ),
+    ( 'OM', 'OMN', "Oman", "Oman" ),
+    ( 'PA', 'PAN', "Panama", "Panama" ),
+    ( 'PE', 'PER', "Peru", "Pérou" ),
+    ( 'PF', 'PYF', "French Polynesia", "Polynésie française" ),
+    ( 'PG', 'PNG', "Papua New Guinea", "Papouasie-Nouvelle-Guinée" ),
+    ( 'PH', 'PHL', "Philippines", "Philippines" ),
+    ( 'PK', 'PAK', "Pakistan", "Pakistan" ),
+    ( 'PL', 'POL', "Poland", "Pologne" ),
+    ( 'PM', 'SPM', "Saint Pierre and Miquelon", "Saint-Pierre-et-Miquelon" ),
+    ( 'PN', 'PCN', "Pitcairn", "Îles Pitcairn" ),
+    ( 'PR', 'PRI', "Puerto Rico", "Porto Rico" ),
+    ( 'PS', 'PSE', "Palestine", "Palestine" ),
+    ( 'PT', 'PRT', "Portugal", "Portugal" ),
+    ( 'PW', 'PLW', "Palau", "Palaos" ),
+    ( 'PY', 'PRY', "Paraguay", "Paraguay" ),
+    ( 'QA', 'QAT', "Qatar", "Qatar" ),
+    ( 'RE', 'REU', "Réunion", "La Réunion" ),
+    ( 'RO', 'ROU', "Romania", "Roumanie" ),
+    ( 'RS', 'SRB', "Serbia", "Serbie" ),
+    ( 'RU', 'RUS', "Russia", "Russie" ),
+    ( 'RW', 'RWA', "Rwanda", "Rwanda" ),
+    ( 'SA', 'SAU', "Saudi Arabia", "Arabie saoudite" ),
+    ( 'SB', 'SLB', "Solomon Islands", "Îles Salomon" ),
+    ( 'SC', 'SYC', "Seychelles", "Seychelles" ),
+    ( 'SD', 'SDN', "Sudan", "Soudan" ),
+    ( 'SE', 'SWE', "Sweden", "Suède" ),
+    ( 'SG', 'SGP', "Singapore", "Singapour" ),
+    ( 'SH', 'SHN', "Saint Helena", "Sainte-Hélène" ),
+    ( 'SI', 'SVN', "Slovenia", "Slovénie" ),
+    ( 'SJ', 'SJM', "Svalbard and Jan Mayen", "Svalbard et Jan Mayen" ),
+    ( 'SK', 'SVK', "Slovakia", "Slovaquie" ),
+    ( 'SL', 'SLE', "Sierra Leone", "Sierra Leone" ),
+    ( 'SM', 'SMR', "San Marino", "Saint-Marin" ),
+    ( 'SN', 'SEN', "Senegal", "Sénégal" ),
+    ( 'SO', 'SOM', "Somalia", "Somalie" ),
+    ( 'SR', 'SUR', "Suriname", "Suriname" ),
+    ( 'SS', 'SSD', "South Sudan", "Soudan du Sud" ),
+    ( 'ST', 'STP', "Sao Tome and Principe", "Sao Tomé-et-Principe" ),
+    ( 'SV', 'SLV', "El Salvador", "Salvador" ),
+    ( 'SX', 'SXM', "Sint Maarten", "Saint-Martin (partie néerlandaise)" ),
+    ( 'SY', 'SYR', "Syria", "Syrie" ),
+    ( 'SZ', 'SWZ', "Eswatini", "Eswatini" ),
+    ( 'TC', 'TCA', "Turks and Caicos Islands", "Îles Turques-et-Caïques" ),
+    ( 'TD', 'TCD', "Chad", "Tchad" ),
+    ( 'TF', 'ATF', "French Southern Territories", "Terres australes et antarctiques françaises" ),
+    ( 'TG', 'TGO', "Togo", "Togo" ),
+    ( 'TH', 'THA', "Thailand", "Thaïlande" ),
+    ( 'TJ', 'TJK', "Tajikistan", "Tadjikistan" ),
+    ( 'TK', 'TKL', "Tokelau", "Tokelau" ),
+    ( 'TL', 'TLS', "Timor-Leste", "Timor oriental" ),
+    ( 'TM', 'TKM', "Turkmenistan", "Turkménistan" ),
+    ( 'TN', 'TUN', "Tunisia", "Tunisie" ),
+    ( 'TO', 'TON', "Tonga", "Tonga" ),
+    ( 'TR', 'TUR', "Türkiye", "Turquie" ),
+    ( 'TT', 'TTO', "Trinidad and Tobago", "Trinité-et-Tobago" ),
+    ( 'TV', 'TUV', "Tuvalu", "Tuvalu" ),
+    ( 'TW', 'TWN', "Taiwan", "Taïwan" ),
+    ( 'TZ', 'TZA', "Tanzania", "Tanzanie" ),
+    ( 'UA', 'UKR', "Ukraine", "Ukraine" ),
+    ( 'UG', 'UGA', "Uganda", "Ouganda" ),
+    ( 'UM', 'UMI', "United States Minor Outlying Islands", "Îles mineures éloignées des États-Unis" ),
+    ( 'US', 'USA', "United States", "États-Unis" ),
+    ( 'UY', 'URY', "Uruguay", "Uruguay" ),
+    ( 'UZ', 'UZB', "Uzbekistan", "Ouzbékistan" ),
+    ( 'VA', 'VAT', "Holy See", "Saint-Siège" ),
+    ( 'VC', 'VCT', "Saint Vincent and the Grenadines", "Saint-Vincent-et-les-Grenadines" ),
+    ( 'VE', 'VEN', "Venezuela", "Venezuela" ),
+    ( 'VG', 'VGB', "British Virgin Islands", "Îles Vierges britanniques" ),
+    ( 'VI', 'VIR', "United States Virgin Islands", "Îles Vierges des États-Unis" ),
+    ( 'VN', 'VNM', "Viet Nam", "Viêt Nam" ),
+    ( 'VU', 'VUT', "Vanuatu", "Vanuatu" ),
+    ( 'WF', 'WLF', "Wallis and Futuna", "Wallis-et-Futuna" ),
+    ( 'WS', 'WSM', "Samoa", "Samoa" ),
+    ( 'YE', 'YEM', "Yemen", "Yémen" ),
+    ( 'YT', 'MYT', "Mayotte", "Mayotte" ),
+    ( 'ZA', 'ZAF', "South Africa", "Afrique du Sud" ),
+    ( 'ZM', 'ZMB', "Zambia", "Zambie" ),
+    ( 'ZW', 'ZWE', "Zimbabwe", "Zimbabwe" ),
+]
+
+# Other names met in the answers of the APIs -> alpha-2
+ALIASES = {
+    # XXX compatibility with maltego flags : Pappers IN V1 uses UK for the United Kingdom
+    'UK': 'GB',
+    "England": 'GB', "Scotland": 'GB', "Wales": 'GB', "Northern Ireland": 'GB', "Great Britain": 'GB',
+    "Angleterre": 'GB', "Écosse": 'GB', "Pays de Galles": 'GB', "Irlande du Nord": 'GB', "Grande-Bretagne": 'GB',
+    "United States of America": 'US', "USA": 'US', "Etats-Unis d'Amérique": 'US',
+    "Holland": 'NL', "Hollande": 'NL', "The Netherlands": 'NL',
+    "Deutschland": 'DE', "République fédérale d'Allemagne": 'DE',
+    "Schweiz": 'CH', "Suisse (Confédération)": 'CH', "Confédération suisse": 'CH',
+    "België": 'BE', "Belgie": 'BE',
+    "Czech Republic": 'CZ', "République tchèque": 'CZ',
+    "Russian Federation": 'RU', "Fédération de Russie": 'RU',
+    "Republic of Korea": 'KR', "Corée, République de": 'KR',
+    "Ivory Coast": 'CI', "Cape Verde": 'CV', "Swaziland": 'SZ', "Burma": 'MM', "Vietnam": 'VN',
+    "Turkey": 'TR', "Macedonia": 'MK', "Macédoine": 'MK', "Biélorussie": 'BY', "Bélarus": 'BY',
+    "Iran, République islamique d'": 'IR', "Syrie, République arabe": 'SY',
+    "Congo-Brazzaville": 'CG', "Congo-Kinshasa": 'CD', "Zaïre": 'CD',
+    "Île Maurice": 'MU', "Ile de la Réunion": 'RE', "Guyane française": 'GF',
+    "Saint-Barthelemy": 'BL', "Vatican": 'VA', "Cité du Vatican": 'VA',
+    # User-assigned code, not in ISO 3166 but used by the registries
+    'XK': 'XK', "Kosovo": 'XK',
+}
+
+# Cities given without any country
+CITIES = {
+    "Zürich": 'CH',
+}
+
+
+## INDEX
+
+# "ÉTATS-UNIS", "Etats Unis", "états-unis" -> "etats unis"
+def fold( text ) :
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[-'’.,()]", " ", text.casefold()).split())
+
+def build_index() :
+    index = {}
+    for alpha2, alpha3, english, french in COUNTRIES :
+        for name in ( alpha2, alpha3, english, french ) :
+            index[fold(name)] = alpha2
+    for name, alpha2 in ALIASES.items() :
+        index[fold(name)] = alpha2
+    return index
+
+_index = build_index()
+_cities = { fold(city): alpha2 for city, alpha2 in CITIES.items() }
+
+
+## RESOLUTION
+
+# Alpha-2 code of a country code or of a country name, None when unknown
+# An unknown value is only reported once (the memo keeps its result)
+@lru_cache(maxsize=MEMO_SIZE)
+def get_country_code( country ) :
+    alpha2 = _index.get(fold(country))
+    if alpha2 is None :
+        log.warning("Cannot find country code. Maybe add %s to the mapping", country)
+    return alpha2
+
+# Alpha-2 code of the country of a city, None when unknown
+@lru_cache(maxsize=MEMO_SIZE)
+def get_city_country_code( city ) :
+    alpha2 = _cities.get(fold(city))
+    if alpha2 is None :
+        log.debug("Cannot find country code of the city %s", city)
+    return alpha2
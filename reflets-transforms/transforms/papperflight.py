@@ -0,0 +1,42 @@
+# Single-flight of the PAPPERS API requests
+# In server mode, a transform run on several selected entities, or several transforms run on the
+# same node, often send the same request at the same time (ex : FicheEntreprise on duplicated
+# company nodes). Only the first one is sent : the identical requests which come while it runs
+# wait for it, and get its decoded answer or its error.
+
+import threading
+from concurrent.futures import Future
+
+# Key -> Future of the request running for this key
+_flights = {}
+_lock = threading.Lock()
+_counters = { 'sent': 0, 'shared': 0 }
+
+
+# Flight of a key : ( future , True ) for the first caller, which must send the request and
+# call land() with its result, ( future , False ) for the next ones, which wait for future.result()
+def join( key ) :
+    with _lock :
+        flight = _flights.get(key)
+        if flight is not None :
+            _counters['shared'] += 1
+            return flight, False
+        flight = Future()
+        _flights[key] = flight
+        _counters['sent'] += 1
+        return flight, True
+
+# End of the flight : the waiting callers get the result, or the error raised again.
+# The next identical request starts a new flight (or is answered by the cache).
+def land( key , flight , result=None , error=None ) :
+    with _lock :
+        if _flights.get(key) is flight :
+            del _flights[key]
+    if error is not None :
+        flight.set_exception(error)
+    else :
+        flight.set_result(result)
+
+def stats() :
+    with _lock :
+        return dict(_counters)
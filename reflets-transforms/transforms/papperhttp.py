@@ -0,0 +1,299 @@
+# HTTP transport for the PAPPERS APIs
+# One pooled session per API host (api.pappers.fr, api.pappers.in) so that consecutive pages
+# and transforms reuse the same keep-alive TCP/TLS connections.
+# Requests are throttled by a token bucket per host, and retried with a jittered exponential
+# backoff (honouring Retry-After) when the API is overloaded : a burst of parallel transforms is
+# slowed down instead of failing halfway through a pagination.
+
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# requests is imported on the first real call to the API : a transform answered from the cache
+# does not pay for its import
+
+# Default connect / read timeouts (in seconds) and connection pool sizes
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+
+# Client side rate limit by host : sustained requests per second and burst size
+DEFAULT_RATE_LIMIT = 5
+DEFAULT_BURST = 10
+# Longest wait for the rate limiter before giving up, in seconds
+DEFAULT_MAX_THROTTLE_WAIT = 60
+
+# Retries of a request : number of retries, first delay and longest delay of the backoff,
+# and total time that may be spent retrying one request (in seconds)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30
+DEFAULT_RETRY_BUDGET = 60
+
+# Answers worth a retry : too many requests and temporary server errors
+RETRY_STATUS = ( 429, 500, 502, 503, 504 )
+
+# Errors of a request which got no answer once the retries are exhausted
+TIMEOUT_ERROR = "Pappers API timeout : try again later"
+CONNECTION_ERROR = "Cannot connect to the Pappers API"
+
+# Size of the chunks of a download written to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+_settings = {}
+_sessions = {}
+_sessions_lock = threading.Lock()
+_buckets = {}
+
+
+## CONFIGURATION
+
+# Apply the 'http' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+def get_timeout() :
+    return ( _settings.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+             _settings.get('read_timeout', DEFAULT_READ_TIMEOUT) )
+
+def get_setting( name , default ) :
+    value = _settings.get(name)
+    if value is None :
+        return default
+    return value
+
+
+## RATE LIMITING
+
+# Token bucket : 'rate' tokens per second, up to 'burst' tokens saved.
+# A 429 answer pauses the whole host, so that every thread waits for the Retry-After delay.
+class TokenBucket :
+    def __init__( self , rate , burst ) :
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Take a token, return the time to wait before sending the request
+    def reserve( self ) :
+        with self.lock :
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(0, self.paused_until - now)
+            if self.tokens < 0 :
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    # Give back a token that was not used
+    def cancel( self ) :
+        with self.lock :
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause( self , delay ) :
+        with self.lock :
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def get_bucket( url ) :
+    host = urlparse(url).netloc
+    bucket = _buckets.get(host)
+    if bucket is None :
+        with _sessions_lock :
+            bucket = _buckets.get(host)
+            if bucket is None :
+                bucket = TokenBucket(get_setting('rate_limit', DEFAULT_RATE_LIMIT), get_setting('burst', DEFAULT_BURST))
+                _buckets[host] = bucket
+    return bucket
+
+# Time to wait for the rate limiter of the host (no limit when rate_limit is 0)
+def reserve( url ) :
+    if not get_setting('rate_limit', DEFAULT_RATE_LIMIT) :
+        return 0
+    bucket = get_bucket(url)
+    wait = bucket.reserve()
+    if wait > get_setting('max_throttle_wait', DEFAULT_MAX_THROTTLE_WAIT) :
+        bucket.cancel()
+        raise Exception("Too many requests to the Pappers API : try again later")
+    return wait
+
+def throttle( url ) :
+    wait = reserve(url)
+    if wait > 0 :
+        time.sleep(wait)
+
+
+## RETRIES
+
+# Delay asked by the server in a Retry-After header (seconds or HTTP date), or None
+def get_retry_after( page ) :
+    value = page.headers.get('Retry-After')
+    if value is None :
+        return None
+    try :
+        return max(0, float(value))
+    except ValueError :
+        pass
+    try :
+        date = email.utils.parsedate_to_datetime(value)
+        return max(0, date.timestamp() - time.time())
+    except (TypeError, ValueError) :
+        return None
+
+# Exponential backoff with full jitter
+def get_backoff( attempt ) :
+    delay = min(get_setting('backoff_max', DEFAULT_BACKOFF_MAX), get_setting('backoff_base', DEFAULT_BACKOFF_BASE) * (2 ** attempt))
+    return random.uniform(0, delay)
+
+# Delay before retrying a request which got no answer, or None when it must fail
+def get_error_delay( attempt , max_retries , deadline ) :
+    delay = get_backoff(attempt)
+    if attempt >= max_retries or time.monotonic() + delay > deadline :
+        return None
+    return delay
+
+# Delay before retrying a request after its answer, or None when the answer is returned as is
+# A 429 answer pauses every request to the host : they all wait for the server to recover
+def get_retry_delay( url , page , attempt , max_retries , deadline ) :
+    if page.status_code not in RETRY_STATUS or attempt >= max_retries :
+        return None
+
+    retry_after = get_retry_after(page)
+    if retry_after is not None :
+        delay = retry_after + random.uniform(0, get_setting('backoff_base', DEFAULT_BACKOFF_BASE))
+    else :
+        delay = get_backoff(attempt)
+    if time.monotonic() + delay > deadline :
+        return None
+
+    if page.status_code == 429 and get_setting('rate_limit', DEFAULT_RATE_LIMIT) :
+        get_bucket(url).pause(delay)
+    return delay
+
+
+## SESSIONS
+
+# Return the shared session of the host of the URL, created on first use
+# The underlying urllib3 pool is thread safe : the session can be used by every thread of the
+# transform server as long as nobody changes its headers or cookies.
+def get_session( url ) :
+    host = urlparse(url).netloc
+    session = _sessions.get(host)
+    if session is not None :
+        return session
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _sessions_lock :
+        session = _sessions.get(host)
+        if session is None :
+            adapter = HTTPAdapter(pool_connections=_settings.get('pool_connections', DEFAULT_POOL_CONNECTIONS),
+                                  pool_maxsize=_settings.get('pool_maxsize', DEFAULT_POOL_MAXSIZE),
+                                  pool_block=False)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+    return session
+
+
+# Close every pooled connection (the sessions are re-created on next use)
+def close_sessions() :
+    with _sessions_lock :
+        for session in _sessions.values() :
+            session.close()
+        _sessions.clear()
+        _buckets.clear()
+
+
+## REQUESTS
+
+# GET with the pooled session, the configured timeouts, the rate limiter and the retries
+# A stalled socket raises an error instead of hanging the transform.
+# The last answer is returned when the retries are exhausted : the caller handles its status code.
+def get( url , params ) :
+    import requests
+
+    max_retries = get_setting('max_retries', DEFAULT_MAX_RETRIES)
+    deadline = time.monotonic() + get_setting('retry_budget', DEFAULT_RETRY_BUDGET)
+    attempt = 0
+
+    while True :
+        throttle(url)
+        try :
+            page = get_session(url).get(url, params=params, timeout=get_timeout())
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e :
+            delay = get_error_delay(attempt, max_retries, deadline)
+            if delay is None :
+                if isinstance(e, requests.exceptions.Timeout) :
+                    raise Exception(TIMEOUT_ERROR)
+                raise Exception(CONNECTION_ERROR)
+            attempt += 1
+            time.sleep(delay)
+            continue
+
+        delay = get_retry_delay(url, page, attempt, max_retries, deadline)
+        if delay is None :
+            return page
+        attempt += 1
+        time.sleep(delay)
+
+
+## DOWNLOADS
+
+# Download a document to 'path', with the rate limiter and the retries of get()
+# A partial file left by an interrupted download is resumed with a Range request : the server
+# answers 206 with the rest of the file, or 200 with the whole file when it ignores the range.
+# A connection lost in the middle of the file is resumed the same way.
+# Returns the status code of the last answer and the number of bytes received : the file is
+# complete when the status is 200 or 206.
+def download( url , params , path ) :
+    import requests
+
+    max_retries = get_setting('max_retries', DEFAULT_MAX_RETRIES)
+    deadline = time.monotonic() + get_setting('retry_budget', DEFAULT_RETRY_BUDGET)
+    attempt = 0
+    received = 0
+
+    while True :
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = { 'Range': f"bytes={offset}-" } if offset > 0 else {}
+        throttle(url)
+        try :
+            with get_session(url).get(url, params=params, headers=headers, stream=True, timeout=get_timeout()) as page :
+                # The short answers of the errors are read : their connection goes back to the pool
+                if page.status_code not in ( 200, 206 ) :
+                    page.content
+                # The partial file does not match the document any more : start again
+                if offset > 0 and ( page.status_code == 416 or ( page.status_code == 206 and not page.headers.get('Content-Range', "").startswith(f"bytes {offset}-") ) ) :
+                    os.remove(path)
+                    continue
+
+                delay = get_retry_delay(url, page, attempt, max_retries, deadline)
+                if delay is None :
+                    if page.status_code not in ( 200, 206 ) :
+                        return page.status_code, received
+                    with open(path, 'ab' if page.status_code == 206 else 'wb') as f :
+                        for chunk in page.iter_content(DOWNLOAD_CHUNK_SIZE) :
+                            f.write(chunk)
+                            received += len(chunk)
+                    return page.status_code, received
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e :
+            delay = get_error_delay(attempt, max_retries, deadline)
+            if delay is None :
+                if isinstance(e, requests.exceptions.Timeout) :
+                    raise Exception(TIMEOUT_ERROR)
+                raise Exception(CONNECTION_ERROR)
+        attempt += 1
+        time.sleep(delay)
@@ -0,0 +1,254 @@
+# Local full-text index of the texts found during an investigation (SQLite FTS5)
+# The answers of the API are indexed as they arrive (see papperparse.read_page), the documents
+# downloaded by download.py and the answers already in the cache are added by index.py :
+#   - bodacc       : BODACC announcements of the French companies (publications_bodacc)
+#   - publication  : publications of the UK, BE and CH companies
+#   - mention      : documents mentioning an address, found by Recherche de siège
+#   - document     : text of a downloaded document (PDF, with pypdf when it is installed)
+# An entry is identified by its content : indexing the same answer again adds nothing, and the
+# index only grows with the new texts. Searches never call the API.
+#
+# Queries use the FTS5 syntax : words (all of them must match), "phrases", OR, NOT, prefix*,
+# NEAR(a b). Accents and case are ignored.
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# The index lives in a single file next to the transforms
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pappers_index.sqlite')
+
+DEFAULT_LIMIT = 20
+
+KINDS = ( 'bodacc', 'publication', 'mention', 'document' )
+
+
+_local = threading.local()
+_settings = {}
+_warned = set()
+
+
+## CONFIGURATION
+
+# Apply the 'index' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+def is_enabled() :
+    return bool(_settings.get('enabled', True))
+
+
+## STORAGE
+
+# One connection per thread : sqlite3 connections cannot be shared between threads
+# entries holds the attributes of the texts, texts their words : an entry and its text share their rowid
+def get_connection() :
+    connection = getattr(_local, 'connection', None)
+    if connection is None :
+        connection = sqlite3.connect(_settings.get('path', INDEX_PATH), timeout=10)
+        # WAL allows the searches while a transform adds its texts
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                id TEXT PRIMARY KEY,
+                                kind TEXT NOT NULL,
+                                company TEXT,
+                                name TEXT,
+                                date TEXT,
+                                added REAL NOT NULL )""")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_company ON entries (company)")
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5 ( title, body, tokenize = 'unicode61 remove_diacritics 2' )")
+        connection.commit()
+        _local.connection = connection
+    return connection
+
+def close() :
+    connection = getattr(_local, 'connection', None)
+    if connection is not None :
+        connection.close()
+        _local.connection = None
+
+
+# Entry of the index : its identifier is the digest of its content
+def make_entry( kind , company , name , date , title , body ) :
+    raw = json.dumps([ kind, company, date, title, body ], ensure_ascii=False)
+    entry_id = kind + ":" + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+    return { 'id': entry_id, 'kind': kind, 'company': company, 'name': name, 'date': date, 'title': title or "", 'body': body or "" }
+
+# Add the new entries in one transaction, return their number
+def add_entries( entries ) :
+    if len(entries) == 0 :
+        return 0
+    connection = get_connection()
+    added = 0
+    now = time.time()
+    with connection :
+        for entry in entries :
+            cursor = connection.execute("INSERT OR IGNORE INTO entries (id, kind, company, name, date, added) VALUES (?, ?, ?, ?, ?, ?)",
+                                        (entry['id'], entry['kind'], entry['company'], entry['name'], entry['date'], now))
+            if cursor.rowcount == 1 :
+                connection.execute("INSERT INTO texts (rowid, title, body) VALUES (?, ?, ?)", (cursor.lastrowid, entry['title'], entry['body']))
+                added += 1
+    return added
+
+def has_entry( entry_id ) :
+    return get_connection().execute("SELECT 1 FROM entries WHERE id = ?", (entry_id,)).fetchone() is not None
+
+
+## ANSWERS OF THE API
+
+# Same identifiers as batch.py and download.py, None when the country is not known
+def get_company( country_code , identifier ) :
+    if not country_code :
+        return None
+    if country_code == 'UK' :
+        country_code = 'GB'
+    return f"{country_code}:{identifier}"
+
+def strip_highlight( text ) :
+    return re.sub(r'(?is)<(?:/)?em>', '', text or "")
+
+def get_bodacc_entries( entreprise ) :
+    company = get_company('FR', entreprise.get('siren'))
+    name = entreprise.get('nom_entreprise')
+    entries = []
+    for publication in entreprise.get('publications_bodacc') or [] :
+        title = f"BODACC {publication.get('type') or ''} {publication.get('numero_parution') or ''}".strip()
+        body = "\n".join(str(publication[key]) for key in ( 'denomination', 'descriptif', 'adresse' ) if publication.get(key))
+        entries.append(make_entry('bodacc', company, name, publication.get('date'), title, body))
+    return entries
+
+# The country of the request comes first : the answers do not always hold it
+def get_publication_entries( company_res , country_code=None ) :
+    company = get_company(country_code or company_res.get('country_code'), company_res.get('company_number'))
+    name = company_res.get('name')
+    entries = []
+    for publication in company_res.get('publications') or [] :
+        # The publications of the search results hold the mentions of the searched address
+        mentions = publication.get('mentions') or []
+        body = "\n".join(str(publication[key]) for key in ( 'description', 'content', 'link' ) if publication.get(key))
+        kind = 'mention' if len(mentions) > 0 else 'publication'
+        if kind == 'mention' :
+            body = "\n".join(strip_highlight(mention) for mention in mentions)
+        entries.append(make_entry(kind, company, name, publication.get('date'), publication.get('type'), body))
+    return entries
+
+def get_mention_entries( entreprise ) :
+    company = get_company('FR', entreprise.get('siren'))
+    name = entreprise.get('nom_entreprise')
+    entries = []
+    for document in entreprise.get('documents') or [] :
+        mentions = document.get('mentions') or []
+        if len(mentions) > 0 :
+            body = "\n".join(strip_highlight(mention) for mention in mentions)
+            entries.append(make_entry('mention', company, name, document.get('date_depot'), document.get('type'), body))
+    return entries
+
+# Entries of an answer of the API : company records and address searches
+# payload : parameters of the request (the country of the UK, BE and CH companies)
+def get_response_entries( url , json_res , payload=None ) :
+    if not isinstance(json_res, dict) :
+        return []
+    country_code = (payload or {}).get('country_code')
+    path = urlparse(url).path
+    if path.endswith('/entreprise') :
+        return get_bodacc_entries(json_res)
+    if path.endswith('/company') :
+        return get_publication_entries(json_res, country_code)
+    if path.endswith('/recherche') :
+        return [ entry for entreprise in json_res.get('resultats') or [] for entry in get_mention_entries(entreprise) ]
+    if path.endswith('/search') :
+        return [ entry for company in json_res.get('results') or [] for entry in get_publication_entries(company, country_code) ]
+    return []
+
+def add_response( url , json_res , payload=None ) :
+    return add_entries(get_response_entries(url, json_res, payload))
+
+
+## DOCUMENTS
+
+# Text of a document, None when it cannot be extracted here (pypdf is not installed)
+def extract_text( path ) :
+    if not path.lower().endswith('.pdf') :
+        return ""
+    try :
+        import pypdf
+    except ImportError :
+        if 'pypdf' not in _warned :
+            _warned.add('pypdf')
+            log.warning("Install pypdf to index the text of the documents (pip3 install pypdf)")
+        return None
+    try :
+        reader = pypdf.PdfReader(path)
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e :
+        # Damaged or encrypted document : indexed by its name only
+        log.debug("Cannot extract the text of %s : %s", path, e)
+        return ""
+
+# Add the documents of a folder of download.py (its manifest.jsonl), return the number added
+def add_store( store_path ) :
+    manifest_path = os.path.join(store_path, 'manifest.jsonl')
+    if not os.path.exists(manifest_path) :
+        raise Exception(f"No manifest.jsonl in {store_path}")
+
+    added = 0
+    with open(manifest_path, encoding='utf-8') as f :
+        for line in f :
+            try :
+                record = json.loads(line)
+            except ValueError :
+                continue
+            if 'sha256' not in record :
+                continue
+            # A document is indexed once by company : its content does not change
+            entry_id = f"document:{record['company']}:{record['sha256']}"
+            if has_entry(entry_id) :
+                continue
+            text = extract_text(os.path.join(store_path, record['path']))
+            if text is None :
+                continue
+            title = " ".join(item for item in ( record.get('section'), record.get('name') ) if item)
+            entry = make_entry('document', record['company'], None, record.get('date'), title, text)
+            entry['id'] = entry_id
+            added += add_entries([ entry ])
+    return added
+
+
+## SEARCH
+
+# Entries matching the query, the best first, with an extract of their text around the words found
+def search( query , limit=DEFAULT_LIMIT , company=None , kind=None ) :
+    sql = """SELECT entries.kind, entries.company, entries.name, entries.date, texts.title,
+                    snippet(texts, 1, '[', ']', '...', 16)
+             FROM texts JOIN entries ON entries.rowid = texts.rowid
+             WHERE texts MATCH ?"""
+    params = [ query ]
+    if company is not None :
+        sql += " AND entries.company = ?"
+        params.append(company)
+    if kind is not None :
+        sql += " AND entries.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+
+    try :
+        rows = get_connection().execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e :
+        raise Exception(f"Bad query : {e}")
+    return [ { 'kind': row[0], 'company': row[1], 'name': row[2], 'date': row[3], 'title': row[4], 'snippet': row[5] } for row in rows ]
+
+# Number of entries by kind
+def stats() :
+    rows = get_connection().execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind").fetchall()
+    return dict(rows)
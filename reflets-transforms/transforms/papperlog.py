@@ -0,0 +1,105 @@
+# Logging of the transforms
+# Every module logs with logging.getLogger(__name__) : they all sit below the 'transforms' logger
+# configured here from the 'logging' section of the configuration file.
+#   - by default, only warnings and errors are written to stderr (the Maltego output window)
+#   - the debug mode (debug: true, or PAPPERS_DEBUG=1) also writes the API calls and the compact,
+#     truncated payloads of the failing results to a rotating file
+# Messages are formatted lazily : log.debug("... %s", compact(payload)) costs nothing when the
+# debug level is off.
+
+import json
+import logging
+import logging.handlers
+import os
+import sys
+
+LOGGER_NAME = 'transforms'
+
+# Rotating file of the debug mode, next to the transforms
+DEBUG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pappers_debug.log')
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+# Longest payload written in the logs, in characters
+DEFAULT_PAYLOAD_LENGTH = 2000
+
+LEVELS = {
+    'off': logging.CRITICAL + 10,
+    'error': logging.ERROR,
+    'warning': logging.WARNING,
+    'info': logging.INFO,
+    'debug': logging.DEBUG,
+}
+DEFAULT_LEVEL = 'warning'
+
+
+_settings = {}
+_handlers = []
+
+
+# Always writes to the current sys.stderr : the persistent worker captures it by thread
+class StderrHandler( logging.StreamHandler ) :
+    def __init__( self ) :
+        logging.Handler.__init__(self)
+
+    @property
+    def stream( self ) :
+        return sys.stderr
+
+
+# Lazy compact JSON of a payload, serialized only when the message is written
+class compact :
+    def __init__( self , payload , max_length=None ) :
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__( self ) :
+        max_length = self.max_length
+        if max_length is None :
+            max_length = _settings.get('payload_length', DEFAULT_PAYLOAD_LENGTH)
+        try :
+            text = json.dumps(self.payload, ensure_ascii=False, separators=(',', ':'), default=str)
+        except (TypeError, ValueError) :
+            text = repr(self.payload)
+        if len(text) > max_length :
+            return f"{text[:max_length]}... ({len(text)} chars)"
+        return text
+
+
+def is_debug() :
+    return os.environ.get('PAPPERS_DEBUG', '0') != '0' or bool(_settings.get('debug', False))
+
+# Apply the 'logging' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in _handlers :
+        logger.removeHandler(handler)
+        handler.close()
+    _handlers.clear()
+
+    # The messages must not reach the root logger : maltego-trx configures it at the DEBUG level
+    logger.propagate = False
+    level = LEVELS.get(str(_settings.get('level', DEFAULT_LEVEL)).lower(), logging.WARNING)
+
+    stderr_handler = StderrHandler()
+    stderr_handler.setLevel(level)
+    stderr_handler.setFormatter(logging.Formatter("%(message)s"))
+    _handlers.append(stderr_handler)
+
+    if is_debug() :
+        file_handler = logging.handlers.RotatingFileHandler(_settings.get('path', DEBUG_PATH),
+                                                            maxBytes=int(_settings.get('max_bytes', DEFAULT_MAX_BYTES)),
+                                                            backupCount=int(_settings.get('backup_count', DEFAULT_BACKUP_COUNT)),
+                                                            encoding='utf-8', delay=True)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s"))
+        _handlers.append(file_handler)
+        level = logging.DEBUG
+
+    for handler in _handlers :
+        logger.addHandler(handler)
+    logger.setLevel(level)
@@ -0,0 +1,80 @@
+# Declarative mapping of the fields of the PAPPERS APIs (FR V2 and IN V1)
+# The parsers of papperparse.py describe which fields of an answer become which Maltego
+# properties in schemas. The schemas are compiled once, at import, into Python functions which
+# hold one 'if' by field : no loop over the schema, no addProperty call by property.
+#
+# A source of a value is ( key , test , expression ) :
+#   key        : field of the answer, ex : 'code_pays' (FR V2) or 'country_code' (IN V1)
+#   test       : PRESENT (the key is in the answer, even with a None value), SET (present and
+#                not None) or NOT_EMPTY (present and not empty)
+#   expression : Python expression of the value, on 'value' (the field) and 'd' (the answer),
+#                ex : "value", "f'{value}'" (text, as str), "normalize_siren(value)"
+# The first source which passes its test gives the value.
+#
+# Property schema, compiled by compile_properties : function( entity , d ) adding the properties
+#   [ ( property name , display name , matching rule , [ source , ... ] ) , ... ]
+# Record schema, compiled by compile_record : function( d ) returning a dict (None when no source)
+#   [ ( name , [ source , ... ] ) , ... ]
+
+import logging
+
+log = logging.getLogger(__name__)
+
+PRESENT = 'present'
+SET = 'set'
+NOT_EMPTY = 'not_empty'
+
+# Default of d.get() : a field absent from the answer (a None value is not)
+MISSING = object()
+
+
+## COMPILER
+
+def get_condition( key , test ) :
+    if test == PRESENT :
+        return f"(value := d.get({key!r}, MISSING)) is not MISSING"
+    if test == SET :
+        return f"(value := d.get({key!r})) is not None"
+    if test == NOT_EMPTY :
+        return f"(value := d.get({key!r}))"
+    raise Exception(f"Unknown test : {test}")
+
+# Lines of code of a chain of sources : 'if' on the first one, 'elif' on the next ones
+def get_source_lines( sources , statement , otherwise=None ) :
+    lines = []
+    for i, ( key, test, expression ) in enumerate(sources) :
+        keyword = "if" if i == 0 else "elif"
+        lines.append(f"    {keyword} {get_condition(key, test)} :")
+        lines.append(f"        {statement(expression)}")
+    if otherwise is not None :
+        lines.append(f"    else :")
+        lines.append(f"        {otherwise}")
+    return lines
+
+def build_function( name , lines , namespace ) :
+    source = "\n".join(lines) + "\n"
+    scope = dict(namespace)
+    scope['MISSING'] = MISSING
+    exec(compile(source, f"<pappermapping {name}>", 'exec'), scope)
+    function = scope[name]
+    # Generated code, kept for debugging
+    function.source = source
+    return function
+
+# Function( entity , d ) adding the properties of the schema found in the answer d, in order
+# 'namespace' holds the functions called by the expressions
+def compile_properties( name , schema , namespace=None ) :
+    lines = [ f"def {name}( entity , d ) :", "    append = entity.additionalFields.append" ]
+    for property_name, display_name, matching_rule, sources in schema :
+        # As MaltegoEntity.addProperty
+        prefix = f"append([ {property_name!r}, {display_name!r}, {matching_rule!r}, "
+        lines += get_source_lines(sources, lambda expression : prefix + expression + " ])")
+    return build_function(name, lines, namespace or {})
+
+# Function( d ) returning the values of the schema found in the answer d, None when absent
+def compile_record( name , schema , namespace=None ) :
+    lines = [ f"def {name}( d ) :" ]
+    for field_name, sources in schema :
+        lines += get_source_lines(sources, lambda expression : f"{field_name} = {expression}", f"{field_name} = None")
+    lines.append("    return { " + ", ".join(f"{field_name!r}: {field_name}" for field_name, sources in schema) + " }")
+    return build_function(name, lines, namespace or {})
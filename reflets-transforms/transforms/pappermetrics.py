@@ -0,0 +1,420 @@
+# Metrics of the PAPPERS API usage
+# Counts, status codes, bytes received, estimated credits and latency histograms of the API calls,
+# by endpoint and by transform, plus the duration of the transforms and of the parsers.
+#   - transform server : served in the Prometheus text format on /metrics (see project.py)
+#   - local transforms : added after each run to a rolling JSON file, one window by hour
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Rolling file of the local transforms, next to the transforms
+METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pappers_metrics.json')
+
+# Number of hourly windows kept in the rolling file
+DEFAULT_ROLLING_HOURS = 24
+
+# Estimated credits spent by a call answered by the API, by endpoint path
+# (answers served by the cache or shared with an identical call, and errors are free)
+DEFAULT_CREDITS = {
+    '/v2/entreprise': 1,
+    '/v2/recherche': 1,
+    '/v2/recherche-dirigeants': 1,
+    '/v2/recherche-beneficiaires': 1,
+    '/v1/company': 1,
+    '/v1/search': 1,
+    '/v1/search-officers': 1,
+}
+FALLBACK_CREDITS = 1
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket has no bound
+LATENCY_BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60 )
+
+QUANTILES = ( 0.5, 0.95, 0.99 )
+QUANTILE_NAMES = tuple( 'p%d' % round(q * 100) for q in QUANTILES )
+
+# Transform name used outside of a transform (batch scripts, ...)
+NO_TRANSFORM = "none"
+
+
+_settings = {}
+_transform = contextvars.ContextVar('transform', default=None)
+_lock = threading.Lock()
+
+# Series by key, see new_series()
+#   requests   : (transform, endpoint)
+#   transforms : (transform,)
+#   parsers    : (transform, function)
+_series = { 'requests': {}, 'transforms': {}, 'parsers': {} }
+
+
+## CONFIGURATION
+
+# Apply the 'metrics' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+def is_enabled() :
+    return _settings.get('enabled', True)
+
+def get_credits( endpoint ) :
+    credits = _settings.get('credits') or {}
+    if endpoint in credits :
+        return credits[endpoint]
+    return DEFAULT_CREDITS.get(endpoint, FALLBACK_CREDITS)
+
+
+## CURRENT TRANSFORM
+# The transform name is kept by thread (and by asyncio task) : the calls made by a transform are counted for it
+
+def get_transform() :
+    return _transform.get() or NO_TRANSFORM
+
+def set_transform( name ) :
+    _transform.set(name)
+
+# Run a function in another thread (pages fetched concurrently) on behalf of a transform
+def run_as( transform , function , *args ) :
+    token = _transform.set(transform)
+    try :
+        return function(*args)
+    finally :
+        _transform.reset(token)
+
+
+## HISTOGRAMS
+
+def new_histogram() :
+    return { 'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0 }
+
+def observe( histogram , seconds ) :
+    index = len(LATENCY_BUCKETS)
+    for i, bound in enumerate(LATENCY_BUCKETS) :
+        if seconds <= bound :
+            index = i
+            break
+    histogram['buckets'][index] += 1
+    histogram['sum'] += seconds
+    histogram['count'] += 1
+
+def merge_histogram( histogram , other ) :
+    for i, value in enumerate(other['buckets']) :
+        histogram['buckets'][i] += value
+    histogram['sum'] += other['sum']
+    histogram['count'] += other['count']
+
+# Estimate of a quantile, by linear interpolation inside its bucket
+def quantile( histogram , q ) :
+    if histogram['count'] == 0 :
+        return None
+    rank = q * histogram['count']
+    seen = 0
+    lower = 0.0
+    for i, value in enumerate(histogram['buckets']) :
+        if i == len(LATENCY_BUCKETS) :
+            # No upper bound : the last finite bound is the best estimate
+            return lower
+        upper = LATENCY_BUCKETS[i]
+        if value > 0 and seen + value >= rank :
+            return lower + (upper - lower) * (rank - seen) / value
+        seen += value
+        lower = upper
+    return lower
+
+
+## RECORDING
+
+def new_series( kind ) :
+    if kind == 'requests' :
+        return { 'calls': 0, 'cached': 0, 'errors': 0, 'status': {}, 'bytes': 0, 'credits': 0, 'latency': new_histogram() }
+    if kind == 'transforms' :
+        return { 'runs': 0, 'errors': 0, 'entities': 0, 'latency': new_histogram() }
+    return { 'calls': 0, 'latency': new_histogram() }
+
+def get_series( kind , key ) :
+    series = _series[kind].get(key)
+    if series is None :
+        series = new_series(kind)
+        _series[kind][key] = series
+    return series
+
+
+# One call of make_request
+#   status  : HTTP status code, "cache" for an answer of the cache, "shared" for the answer of an
+#             identical request running at the same time, "error" when no answer came
+def record_request( url , status , seconds , size=0 ) :
+    if not is_enabled() :
+        return
+    endpoint = urlparse(url).path
+    status = str(status)
+    with _lock :
+        series = get_series('requests', (get_transform(), endpoint))
+        series['calls'] += 1
+        series['status'][status] = series['status'].get(status, 0) + 1
+        series['bytes'] += size
+        if status == "cache" or status == "shared" :
+            series['cached'] += 1
+        elif status == "200" :
+            series['credits'] += get_credits(endpoint)
+        else :
+            series['errors'] += 1
+        observe(series['latency'], seconds)
+
+# Total of a counter of the API calls since the start of the process (or the last flush),
+# ex : get_total('credits')
+def get_total( name ) :
+    with _lock :
+        return sum(series[name] for series in _series['requests'].values())
+
+def record_transform( name , seconds , entities , error ) :
+    if not is_enabled() :
+        return
+    with _lock :
+        series = get_series('transforms', (name,))
+        series['runs'] += 1
+        series['entities'] += entities
+        if error :
+            series['errors'] += 1
+        observe(series['latency'], seconds)
+
+def record_parse( function , seconds ) :
+    if not is_enabled() :
+        return
+    with _lock :
+        series = get_series('parsers', (get_transform(), function))
+        series['calls'] += 1
+        observe(series['latency'], seconds)
+
+
+# Decorator of the create_entities methods (below @classmethod) : the calls made during the
+# transform are counted for it, and its duration, entities and errors are recorded
+def measure_transform( create_entities ) :
+    @functools.wraps(create_entities)
+    def wrapper( cls , request , response ) :
+        set_transform(cls.__name__)
+        start = time.perf_counter()
+        nbr_entities = len(response.entities)
+        error = True
+        try :
+            create_entities(cls, request, response)
+            # Transforms report their errors as UI messages
+            error = any(message[1].startswith("Error") for message in response.UIMessages)
+        finally :
+            record_transform(cls.__name__, time.perf_counter() - start, len(response.entities) - nbr_entities, error)
+            set_transform(None)
+    return wrapper
+
+# Decorator of the parse functions
+def measure_parse( parse ) :
+    @functools.wraps(parse)
+    def wrapper( *args , **kwargs ) :
+        start = time.perf_counter()
+        try :
+            return parse(*args, **kwargs)
+        finally :
+            record_parse(parse.__name__, time.perf_counter() - start)
+    return wrapper
+
+
+## EXPORT
+
+# Copy of the series as JSON-ready lists, with the quantiles of the latencies
+# reset=True empties the series (the copy is added to the rolling file)
+def snapshot( reset=False ) :
+    with _lock :
+        result = {}
+        for kind, series in _series.items() :
+            result[kind] = []
+            for key, values in series.items() :
+                item = json.loads(json.dumps(values))
+                if kind == 'requests' :
+                    item['transform'], item['endpoint'] = key
+                elif kind == 'transforms' :
+                    item['transform'] = key[0]
+                else :
+                    item['transform'], item['function'] = key
+                result[kind].append(item)
+            if reset :
+                series.clear()
+    for items in result.values() :
+        add_quantiles(items)
+    return result
+
+def add_quantiles( items ) :
+    for item in items :
+        for q, name in zip(QUANTILES, QUANTILE_NAMES) :
+            value = quantile(item['latency'], q)
+            item[name] = None if value is None else round(value, 4)
+
+def get_key( kind , item ) :
+    if kind == 'requests' :
+        return ( item['transform'], item['endpoint'] )
+    if kind == 'transforms' :
+        return ( item['transform'], )
+    return ( item['transform'], item['function'] )
+
+# Add the values of a series to another one
+def merge_series( item , other ) :
+    for name, value in other.items() :
+        if name == 'latency' :
+            merge_histogram(item['latency'], value)
+        elif name == 'status' :
+            for status, count in value.items() :
+                item['status'][status] = item['status'].get(status, 0) + count
+        elif isinstance(value, (int, float)) and name not in QUANTILE_NAMES :
+            item[name] = item.get(name, 0) + value
+
+
+def escape_label( value ) :
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels( labels ) :
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+def format_histogram( lines , name , labels , histogram ) :
+    cumulated = 0
+    for i, value in enumerate(histogram['buckets']) :
+        cumulated += value
+        bound = "+Inf" if i == len(LATENCY_BUCKETS) else repr(float(LATENCY_BUCKETS[i]))
+        lines.append(f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulated}")
+    lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+
+def format_quantiles( lines , name , labels , item ) :
+    for q, quantile_name in zip(QUANTILES, QUANTILE_NAMES) :
+        value = item[quantile_name]
+        if value is not None :
+            lines.append(f"{name}{format_labels(labels + [('quantile', q)])} {value}")
+
+# Prometheus text exposition format (version 0.0.4)
+def to_prometheus() :
+    from transforms import pappercache
+    from transforms import papperflight
+
+    data = snapshot()
+    lines = []
+
+    def header( name , kind , text ) :
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    requests = [ (item, [('transform', item['transform']), ('endpoint', item['endpoint'])]) for item in data['requests'] ]
+    transforms = [ (item, [('transform', item['transform'])]) for item in data['transforms'] ]
+    parsers = [ (item, [('transform', item['transform']), ('function', item['function'])]) for item in data['parsers'] ]
+
+    header("pappers_requests_total", "counter", "Calls to the Pappers API, by answer status (cache : answered by the local cache, shared : answer of an identical call)")
+    for item, labels in requests :
+        for status, count in sorted(item['status'].items()) :
+            lines.append(f"pappers_requests_total{format_labels(labels + [('status', status)])} {count}")
+    header("pappers_response_bytes_total", "counter", "Bytes received from the Pappers API")
+    for item, labels in requests :
+        lines.append(f"pappers_response_bytes_total{format_labels(labels)} {item['bytes']}")
+    header("pappers_credits_total", "counter", "Estimated Pappers credits spent")
+    for item, labels in requests :
+        lines.append(f"pappers_credits_total{format_labels(labels)} {item['credits']}")
+    header("pappers_request_duration_seconds", "histogram", "Duration of the calls to the Pappers API")
+    for item, labels in requests :
+        format_histogram(lines, "pappers_request_duration_seconds", labels, item['latency'])
+    header("pappers_request_duration_quantile_seconds", "gauge", "Estimated quantiles of the duration of the calls")
+    for item, labels in requests :
+        format_quantiles(lines, "pappers_request_duration_quantile_seconds", labels, item)
+
+    header("pappers_transform_runs_total", "counter", "Runs of the transforms")
+    for item, labels in transforms :
+        lines.append(f"pappers_transform_runs_total{format_labels(labels)} {item['runs']}")
+    header("pappers_transform_errors_total", "counter", "Runs of the transforms ended with an error")
+    for item, labels in transforms :
+        lines.append(f"pappers_transform_errors_total{format_labels(labels)} {item['errors']}")
+    header("pappers_transform_entities_total", "counter", "Entities returned by the transforms")
+    for item, labels in transforms :
+        lines.append(f"pappers_transform_entities_total{format_labels(labels)} {item['entities']}")
+    header("pappers_transform_duration_seconds", "histogram", "Duration of the transforms")
+    for item, labels in transforms :
+        format_histogram(lines, "pappers_transform_duration_seconds", labels, item['latency'])
+    header("pappers_transform_duration_quantile_seconds", "gauge", "Estimated quantiles of the duration of the transforms")
+    for item, labels in transforms :
+        format_quantiles(lines, "pappers_transform_duration_quantile_seconds", labels, item)
+
+    header("pappers_parse_duration_seconds", "histogram", "Duration of the parsing of the API answers")
+    for item, labels in parsers :
+        format_histogram(lines, "pappers_parse_duration_seconds", labels, item['latency'])
+
+    header("pappers_cache_lookups_total", "counter", "Lookups of the response cache")
+    cache = pappercache.stats()
+    for counter in ( 'memory_hits', 'disk_hits', 'misses' ) :
+        lines.append(f"pappers_cache_lookups_total{format_labels([('result', counter)])} {cache[counter]}")
+
+    header("pappers_flights_total", "counter", "Calls sent to the Pappers API, or sharing the answer of an identical call")
+    flights = papperflight.stats()
+    for counter in ( 'sent', 'shared' ) :
+        lines.append(f"pappers_flights_total{format_labels([('result', counter)])} {flights[counter]}")
+
+    return "\n".join(lines) + "\n"
+
+
+## ROLLING FILE (local transforms)
+
+def get_rolling_hours() :
+    return int(_settings.get('rolling_hours', DEFAULT_ROLLING_HOURS))
+
+def read_file( path ) :
+    try :
+        with open(path, encoding='utf-8') as f :
+            return json.load(f)
+    except (OSError, ValueError) :
+        return { 'windows': [] }
+
+# Add the series recorded since the last flush to the window of the current hour,
+# and drop the windows older than 'rolling_hours'
+def flush( path=None ) :
+    if not is_enabled() :
+        return
+    data = snapshot(reset=True)
+    if all(len(items) == 0 for items in data.values()) :
+        return
+    if path is None :
+        path = _settings.get('path', METRICS_PATH)
+
+    lock_file = None
+    try :
+        # Local transforms may run in several processes at the same time
+        try :
+            import fcntl
+            lock_file = open(path + ".lock", 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except ImportError :
+            pass
+
+        content = read_file(path)
+        now = int(time.time())
+        hour = now - now % 3600
+        windows = [ window for window in content.get('windows', []) if window['start'] > hour - get_rolling_hours() * 3600 ]
+        window = next((window for window in windows if window['start'] == hour), None)
+        if window is None :
+            window = { 'start': hour, 'requests': [], 'transforms': [], 'parsers': [] }
+            windows.append(window)
+
+        for kind, items in data.items() :
+            existing = { get_key(kind, item): item for item in window[kind] }
+            for item in items :
+                key = get_key(kind, item)
+                if key in existing :
+                    merge_series(existing[key], item)
+                else :
+                    window[kind].append(item)
+            add_quantiles(window[kind])
+
+        windows.sort(key=lambda window: window['start'])
+        content = { 'updated': now, 'windows': windows }
+        with open(path + ".tmp", 'w', encoding='utf-8') as f :
+            json.dump(content, f, indent=1)
+        os.replace(path + ".tmp", path)
+    finally :
+        if lock_file is not None :
+            lock_file.close()
@@ -0,0 +1,345 @@
+# Versioned local mirror of the company records (/v2/entreprise and /v1/company)
+# Every record fetched from the API is kept : the last version in full, and the differences with
+# the previous one for each new version (representants, beneficiaires, etablissements, filings...
+# compared item by item). mirror.py shows what changed since a date.
+#
+# The mirror also decides when a record must be fetched again (see is_stale) : a record fresh
+# enough is served locally, without calling the API nor reading the cache, and a stale one is
+# fetched again from the API even when the cache still holds it.
+#   - younger than min_age : fresh
+#   - older than max_age : stale
+#   - new annual accounts expected since the last fetch (a year after the last ones) : stale
+#   - ceased company : fresh until max_age
+#   - otherwise, a record is checked again after half the time it has stayed unchanged : a
+#     company which just changed is checked again after min_age, a stable one less and less often.
+#     A company seen in one version only is not known to change : max_age
+#   - invalidated with the cache (pappercache.invalidate) : stale until fetched again
+# Only the last max_versions versions of a company are kept (0 : all of them).
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+# The mirror lives in a single file next to the transforms
+MIRROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pappers_mirror.sqlite')
+
+DEFAULT_MIN_AGE = 24 * 3600
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+DEFAULT_MAX_VERSIONS = 100
+
+# Annual accounts are expected a year after the previous ones
+ACCOUNTS_INTERVAL = 365 * 24 * 3600
+
+# Mirrored endpoints : API and identifier in the payload
+ENDPOINTS = { '/v2/entreprise': ( 'fr', 'siren' ), '/v1/company': ( 'in', 'company_number' ) }
+
+# Lists of the records compared item by item, with the fields identifying their items
+# (an item without any of these fields is identified by its content)
+COLLECTIONS = {
+    'fr': {
+        'representants': ( 'qualite', 'siren', 'nom', 'prenom', 'date_de_naissance_rgpd' ),
+        'beneficiaires_effectifs': ( 'nom', 'prenom', 'date_de_naissance_rgpd' ),
+        'etablissements': ( 'siret', ),
+        'depots_actes': ( 'token', 'date_depot', 'nom_fichier_pdf' ),
+        'comptes': ( 'token', 'date_depot', 'nom_fichier_pdf' ),
+        'publications_bodacc': ( 'numero_parution', 'numero_annonce', 'type' ),
+    },
+    'in': {
+        'officers': ( 'role', 'company_number', 'first_name', 'last_name', 'date_of_birth' ),
+        'ubos': ( 'company_number', 'first_name', 'last_name', 'date_of_birth' ),
+        'establishments': (),
+        'documents': ( 'file_token', ),
+        'financials': ( 'date', ),
+        'publications': ( 'date', 'type', 'link' ),
+    },
+}
+
+
+_local = threading.local()
+_settings = {}
+
+
+## CONFIGURATION
+
+# Apply the 'mirror' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+
+def is_enabled() :
+    return bool(_settings.get('enabled', True))
+
+def get_setting( name , default ) :
+    value = _settings.get(name)
+    if value is None :
+        return default
+    return value
+
+def is_mirrored( url ) :
+    return urlparse(url).path in ENDPOINTS
+
+
+## STORAGE
+
+# One connection per thread : sqlite3 connections cannot be shared between threads
+def get_connection() :
+    connection = getattr(_local, 'connection', None)
+    if connection is None :
+        connection = sqlite3.connect(_settings.get('path', MIRROR_PATH), timeout=10)
+        # WAL allows several Maltego local transforms to read while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS companies (
+                                key TEXT PRIMARY KEY,
+                                api TEXT NOT NULL,
+                                version INTEGER NOT NULL,
+                                digest TEXT NOT NULL,
+                                body TEXT NOT NULL,
+                                fetched REAL NOT NULL,
+                                changed REAL NOT NULL,
+                                invalidated INTEGER NOT NULL DEFAULT 0,
+                                params TEXT )""")
+        # Files created before the records could be invalidated, or held their parameters
+        columns = [ row[1] for row in connection.execute("PRAGMA table_info(companies)") ]
+        if 'invalidated' not in columns :
+            connection.execute("ALTER TABLE companies ADD COLUMN invalidated INTEGER NOT NULL DEFAULT 0")
+        if 'params' not in columns :
+            connection.execute("ALTER TABLE companies ADD COLUMN params TEXT")
+        connection.execute("""CREATE TABLE IF NOT EXISTS versions (
+                                key TEXT NOT NULL,
+                                version INTEGER NOT NULL,
+                                fetched REAL NOT NULL,
+                                digest TEXT NOT NULL,
+                                diff TEXT,
+                                PRIMARY KEY (key, version) )""")
+        connection.execute("CREATE INDEX IF NOT EXISTS versions_fetched ON versions (fetched)")
+        connection.commit()
+        _local.connection = connection
+    return connection
+
+def close() :
+    connection = getattr(_local, 'connection', None)
+    if connection is not None :
+        connection.close()
+        _local.connection = None
+
+
+# Key of the company of a request : "FR:123456789", "GB:01234567" (as batch.py)
+def make_key( url , payload ) :
+    api, field = ENDPOINTS[urlparse(url).path]
+    payload = payload or {}
+    if api == 'fr' :
+        return f"FR:{payload.get(field)}"
+    country_code = payload.get('country_code') or ""
+    if country_code == 'UK' :
+        country_code = 'GB'
+    return f"{country_code}:{payload.get(field)}"
+
+# Other parameters of a request (ex : the 'fields' of the IN V1 API) : a record is only served to a
+# request with the same ones
+def get_params( url , payload ) :
+    api, field = ENDPOINTS[urlparse(url).path]
+    ignored = ( 'api_token', field, 'country_code' ) if api == 'in' else ( 'api_token', field )
+    params = sorted( (k, str(v)) for k, v in (payload or {}).items() if k not in ignored )
+    return json.dumps(params, ensure_ascii=False)
+
+def get_digest( json_res ) :
+    return hashlib.sha256(json.dumps(json_res, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+## STALENESS
+
+# "2020-06-30" or "30/06/2020"
+def parse_date( text ) :
+    for date_format in ( "%Y-%m-%d", "%d/%m/%Y" ) :
+        try :
+            return datetime.strptime(str(text)[:10], date_format).timestamp()
+        except ValueError :
+            pass
+    return None
+
+def is_ceased( json_res ) :
+    return bool(json_res.get('date_cessation') or json_res.get('date_of_cessation'))
+
+# Date of the last annual accounts of the record, or None
+def get_last_accounts( api , json_res ) :
+    if api == 'fr' :
+        dates = [ parse_date(compte.get('date_depot') or compte.get('date_depot_formate')) for compte in json_res.get('comptes') or [] ]
+    else :
+        dates = [ parse_date(financial.get('date')) for financial in json_res.get('financials') or [] ]
+    dates = [ date for date in dates if date is not None ]
+    return max(dates) if len(dates) > 0 else None
+
+# Reason to fetch the record again, or None while it is fresh
+def is_stale( api , json_res , version , fetched , changed , now=None , invalidated=False ) :
+    if invalidated :
+        return "invalidated"
+    if now is None :
+        now = time.time()
+    age = now - fetched
+    min_age = get_setting('min_age', DEFAULT_MIN_AGE)
+    max_age = get_setting('max_age', DEFAULT_MAX_AGE)
+
+    if age < min_age :
+        return None
+    if age >= max_age :
+        return "older than max_age"
+    if is_ceased(json_res) :
+        return None
+    last_accounts = get_last_accounts(api, json_res)
+    if last_accounts is not None and fetched < last_accounts + ACCOUNTS_INTERVAL <= now :
+        return "new accounts expected"
+    if version > 1 and age >= (fetched - changed) / 2 :
+        return "unchanged for a short time"
+    return None
+
+# Time the record becomes stale (as is_stale), for the in-memory tier of pappercache
+def get_expires( api , json_res , version , fetched , changed , invalidated=False ) :
+    if invalidated :
+        return fetched
+    min_age = get_setting('min_age', DEFAULT_MIN_AGE)
+    expires = fetched + get_setting('max_age', DEFAULT_MAX_AGE)
+    if is_ceased(json_res) :
+        return expires
+    last_accounts = get_last_accounts(api, json_res)
+    if last_accounts is not None and fetched < last_accounts + ACCOUNTS_INTERVAL :
+        expires = min(expires, max(fetched + min_age, last_accounts + ACCOUNTS_INTERVAL))
+    if version > 1 :
+        expires = min(expires, fetched + max(min_age, (fetched - changed) / 2))
+    return expires
+
+
+## RECORDS
+
+# Last version of the record of a request : { 'answer', 'stale' : reason to fetch it again (None while
+# fresh), 'expires' : time it becomes stale, 'size' }
+# None when the company is not in the mirror, or was fetched with other parameters
+def get( url , payload , now=None ) :
+    key = make_key(url, payload)
+    row = get_connection().execute("SELECT api, body, version, fetched, changed, invalidated, params FROM companies WHERE key = ?", (key,)).fetchone()
+    if row is None or row[6] != get_params(url, payload) :
+        return None
+    api, body, version, fetched, changed, invalidated, params = row
+    json_res = json.loads(body)
+    return { 'answer': json_res, 'stale': is_stale(api, json_res, version, fetched, changed, now, invalidated),
+             'expires': get_expires(api, json_res, version, fetched, changed, invalidated), 'size': len(body) }
+
+# Store a record fetched from the API : a new version when it differs from the last one
+# (the record follows the parameters of the last request)
+# Return the differences with the last version (None for the first version of a company)
+def put( url , payload , json_res , now=None ) :
+    if now is None :
+        now = time.time()
+    key = make_key(url, payload)
+    params = get_params(url, payload)
+    api = ENDPOINTS[urlparse(url).path][0]
+    digest = get_digest(json_res)
+    body = json.dumps(json_res, ensure_ascii=False)
+
+    connection = get_connection()
+    with connection :
+        row = connection.execute("SELECT version, digest, body FROM companies WHERE key = ?", (key,)).fetchone()
+        if row is None :
+            connection.execute("INSERT INTO companies (key, api, version, digest, body, fetched, changed, params) VALUES (?, ?, 1, ?, ?, ?, ?, ?)",
+                               (key, api, digest, body, now, now, params))
+            connection.execute("INSERT INTO versions (key, version, fetched, digest, diff) VALUES (?, 1, ?, ?, NULL)", (key, now, digest))
+            return None
+
+        version, last_digest, last_body = row
+        if digest == last_digest :
+            connection.execute("UPDATE companies SET fetched = ?, invalidated = 0, params = ? WHERE key = ?", (now, params, key))
+            return {}
+
+        diff = get_diff(api, json.loads(last_body), json_res)
+        connection.execute("UPDATE companies SET version = ?, digest = ?, body = ?, fetched = ?, changed = ?, invalidated = 0, params = ? WHERE key = ?",
+                           (version + 1, digest, body, now, now, params, key))
+        connection.execute("INSERT INTO versions (key, version, fetched, digest, diff) VALUES (?, ?, ?, ?, ?)",
+                           (key, version + 1, now, digest, json.dumps(diff, ensure_ascii=False)))
+        # The oldest versions are dropped : the history of a company does not grow without bound
+        max_versions = int(get_setting('max_versions', DEFAULT_MAX_VERSIONS))
+        if max_versions > 0 :
+            connection.execute("DELETE FROM versions WHERE key = ? AND version <= ?", (key, version + 1 - max_versions))
+    return diff
+
+# Mark the records stale (see pappercache.invalidate) : every record (url None), every record of
+# an endpoint (payload None), or the record of a request. They are fetched again on next use.
+def invalidate( url=None , payload=None ) :
+    connection = get_connection()
+    with connection :
+        if url is None :
+            connection.execute("UPDATE companies SET invalidated = 1")
+        elif not is_mirrored(url) :
+            return
+        elif payload is None :
+            connection.execute("UPDATE companies SET invalidated = 1 WHERE api = ?", (ENDPOINTS[urlparse(url).path][0],))
+        else :
+            connection.execute("UPDATE companies SET invalidated = 1 WHERE key = ?", (make_key(url, payload),))
+
+
+## DIFFERENCES
+
+def get_item_key( item , fields ) :
+    if isinstance(item, dict) :
+        values = [ item.get(field) for field in fields ]
+        if any(value is not None for value in values) :
+            return json.dumps(values, ensure_ascii=False)
+    return get_digest(item)
+
+# Items added, removed and changed between two versions of a list
+def get_list_diff( old_items , new_items , fields ) :
+    old = { get_item_key(item, fields): item for item in old_items or [] }
+    new = { get_item_key(item, fields): item for item in new_items or [] }
+    diff = {}
+    added = [ item for key, item in new.items() if key not in old ]
+    removed = [ item for key, item in old.items() if key not in new ]
+    changed = [ [ old[key], item ] for key, item in new.items() if key in old and old[key] != item ]
+    if len(added) > 0 :
+        diff['added'] = added
+    if len(removed) > 0 :
+        diff['removed'] = removed
+    if len(changed) > 0 :
+        diff['changed'] = changed
+    return diff
+
+# Differences between two versions of a record : the other fields as [ old , new ], the lists item by item
+#   { 'fields': { 'date_cessation': [ None, '2023-01-01' ] }, 'representants': { 'added': [ ... ] } }
+def get_diff( api , old , new ) :
+    collections = COLLECTIONS[api]
+    diff = {}
+    fields = {}
+    for name in sorted(set(old) | set(new)) :
+        if name in collections :
+            list_diff = get_list_diff(old.get(name), new.get(name), collections[name])
+            if len(list_diff) > 0 :
+                diff[name] = list_diff
+        elif old.get(name) != new.get(name) :
+            fields[name] = [ old.get(name), new.get(name) ]
+    if len(fields) > 0 :
+        diff['fields'] = fields
+    return diff
+
+
+## HISTORY
+
+# Versions of a company, the oldest first : [ { 'version', 'fetched', 'diff' } ]
+def get_history( key ) :
+    rows = get_connection().execute("SELECT version, fetched, diff FROM versions WHERE key = ? ORDER BY version", (key,)).fetchall()
+    return [ { 'version': version, 'fetched': fetched, 'diff': json.loads(diff) if diff is not None else None } for version, fetched, diff in rows ]
+
+# Companies with a new version since a time : [ ( key , version , fetched , diff ) ], the latest first
+def get_changes( since ) :
+    rows = get_connection().execute("SELECT key, version, fetched, diff FROM versions WHERE fetched >= ? AND diff IS NOT NULL ORDER BY fetched DESC",
+                                    (since,)).fetchall()
+    return [ ( key, version, fetched, json.loads(diff) ) for key, version, fetched, diff in rows ]
+
+# Companies of the mirror with the reason to fetch them again (None when fresh)
+def get_companies( now=None ) :
+    rows = get_connection().execute("SELECT key, api, body, fetched, changed, version, invalidated FROM companies ORDER BY key").fetchall()
+    return [ { 'key': key, 'version': version, 'fetched': fetched, 'changed': changed,
+               'stale': is_stale(api, json.loads(body), version, fetched, changed, now, invalidated) }
+             for key, api, body, fetched, changed, version, invalidated in rows ]
@@ -0,0 +1,113 @@
+# Notes of the entities (documents, filings, publications, mentions)
+# A note is built from sections : the parts are collected in lists and joined once, and the items
+# are formatted only while the note has room for them. A company with decades of filings gives a
+# note of a bounded size instead of megabytes of text that make Maltego sluggish.
+#   - max_size          : longest note, in characters (0 for no limit)
+#   - section_max_size  : longest section, in characters (0 for no limit)
+#   - skip              : names of the sections left out of the notes
+# A section cut by a limit ends with a "N more omitted" line, a section which does not fit at all
+# is listed at the end of the note.
+#
+#   note = pappernote.Note()
+#   note.add_section('comptes', "\nDépots comptes : \n", json_res['comptes'], format_compte)
+#   entity.setNote(note.build())
+
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 64 * 1024
+DEFAULT_SECTION_MAX_SIZE = 16 * 1024
+
+# Sections of the notes
+SECTIONS = [
+    'links',                # links to the documents of a company (FR V2)
+    'depots_actes',         # FR V2
+    'comptes',              # FR V2
+    'publications_bodacc',  # FR V2
+    'documents',            # IN V1
+    'financials',           # IN V1
+    'publications',         # IN V1
+    'mentions',             # documents mentioning an address (Recherche de siège)
+]
+
+
+_settings = {}
+
+
+# Apply the 'notes' section of the configuration file
+def configure( config ) :
+    _settings.clear()
+    if config is not None :
+        _settings.update(config)
+    for name in get_skipped() :
+        if name not in SECTIONS :
+            log.warning("Unknown note section to skip : %s", name)
+
+def get_limit( name , default ) :
+    value = _settings.get(name)
+    if value is None :
+        return default
+    return int(value) or None
+
+def get_skipped() :
+    return set(_settings.get('skip') or [])
+
+
+class Note :
+    def __init__( self , max_size=None , section_max_size=None , skip=None ) :
+        # None for no limit
+        self.max_size = get_limit('max_size', DEFAULT_MAX_SIZE) if max_size is None else max_size or None
+        self.section_max_size = get_limit('section_max_size', DEFAULT_SECTION_MAX_SIZE) if section_max_size is None else section_max_size or None
+        self.skip = set(skip) if skip is not None else get_skipped()
+        self.parts = []
+        self.size = 0
+        # Sections which did not fit in the note
+        self.omitted = []
+
+    def get_room( self ) :
+        rooms = [ room for room in ( self.section_max_size, self.max_size and self.max_size - self.size ) if room is not None ]
+        return min(rooms) if len(rooms) > 0 else None
+
+    # Text added as is, outside of any section
+    def add_text( self , text ) :
+        self.parts.append(text)
+        self.size += len(text)
+
+    # Add a section : its title, then format_item( item ) of the items while they fit
+    # Nothing is added for a skipped section or when items is None : an empty list adds the title alone
+    def add_section( self , name , title , items , format_item ) :
+        if name in self.skip or items is None :
+            return
+        room = self.get_room()
+        if room is not None and len(title) >= room :
+            self.omitted.append(name)
+            return
+
+        parts = [ title ]
+        size = len(title)
+        for i, item in enumerate(items) :
+            text = format_item(item)
+            if room is not None and size + len(text) > room :
+                # The "more omitted" line is part of the section : the last items make room for it
+                marker = f"  ... {len(items) - i} more omitted\n\n"
+                while size + len(marker) > room and len(parts) > 1 :
+                    size -= len(parts.pop())
+                    i -= 1
+                    marker = f"  ... {len(items) - i} more omitted\n\n"
+                if size + len(marker) > room :
+                    self.omitted.append(name)
+                    return
+                parts.append(marker)
+                size += len(marker)
+                break
+            parts.append(text)
+            size += len(text)
+
+        self.parts += parts
+        self.size += size
+
+    def build( self ) :
+        if len(self.omitted) > 0 :
+            return "".join(self.parts) + f"\n... sections omitted : {', '.join(self.omitted)}\n"
+        return "".join(self.parts)
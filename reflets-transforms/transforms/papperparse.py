@@ -1,52 +1,436 @@
 # The PAPPERS APIs parsing library
 
+import logging
+import os
 import string
-import sys
-import yaml
 import re
-import requests
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from transforms import pappercache
+from transforms import pappercountry
+from transforms import papperindex
+from transforms import pappermapping
+from transforms.pappermapping import NOT_EMPTY, PRESENT, SET
+from transforms import papperflight
+from transforms import papperhttp
+from transforms import papperlog
+from transforms import pappermirror
+from transforms import pappermetrics
+from transforms import pappernote
+from transforms import papperresponse
+
+log = logging.getLogger(__name__)
 
 # PAPPERS API QUERYING
 
 # Handling of API error code
-def make_request ( url , payload ) : 
+# Responses are served from the local cache when possible (see pappercache.py)
+#   use_cache=False : bypass the cache for this call
+#   refresh=True    : ignore the cached response and store the new one
+# Company records are served from the local mirror while they are fresh, and fetched again from
+# the API once they are stale (see pappermirror.py)
+# Every call is counted in the metrics of the current transform (see pappermetrics.py)
+# Identical calls running at the same time only send one request (see papperflight.py)
+def make_request ( url , payload , use_cache=True , refresh=False ) : 
+
+    apply_config()
+    start = time.perf_counter()
+
+    json_res, use_cache, key, flight, leader = lookup(url, payload, use_cache, refresh, start)
+    if json_res is not None :
+        return json_res
+    if not leader :
+        try :
+            json_res = flight.result()
+        except Exception :
+            pappermetrics.record_request(url, "error", time.perf_counter() - start)
+            raise
+        record_shared(url, payload, start)
+        return json_res
+
+    try :
+        json_res = fetch_response(url, payload, use_cache, start)
+    except BaseException as e :
+        papperflight.land(key, flight, error=e)
+        raise
+    papperflight.land(key, flight, result=json_res)
+    return json_res
+
+# Mirror, then cache, then the identical request in flight : shared by the synchronous and the
+# asyncio make_request. Return ( json_res , use_cache , key , flight , leader ) :
+# json_res is the answer of the mirror or of the cache, None when the request has to be sent
+# by this caller (leader) or awaited in the flight of another one
+def lookup( url , payload , use_cache , refresh , start ) :
+    if use_cache and not refresh and pappermirror.is_enabled() and pappermirror.is_mirrored(url) :
+        json_res, stale = get_mirrored(url, payload, start)
+        if json_res is not None and stale is None :
+            return json_res, use_cache, None, None, False
+        # A stale record is not served by the cache either
+        refresh = stale is not None
+
+    use_cache = use_cache and pappercache.is_enabled()
+    json_res = get_cached(url, payload, use_cache, refresh, start)
+    if json_res is not None :
+        return json_res, use_cache, None, None, False
+
+    # Identical requests running at the same time share one call (see papperflight.py)
+    key = get_flight_key(url, payload)
+    flight, leader = papperflight.join(key)
+    return None, use_cache, key, flight, leader
+
+# Answer of the cache, or None
+def get_cached( url , payload , use_cache , refresh , start ) :
+    if not use_cache or refresh :
+        return None
+    try :
+        json_res = pappercache.get(url, payload)
+        if json_res is not None :
+            pappermetrics.record_request(url, "cache", time.perf_counter() - start)
+            if log.isEnabledFor(logging.DEBUG) :
+                log.debug("GET %s %s : cached", url, papperlog.compact(get_public_payload(payload)))
+        return json_res
+    except Exception as e :
+        log.warning("Cache error: %s", e)
+        return None
+
+# Record of the mirror and the reason to fetch it again : ( answer , reason ), ( None , None ) when absent
+# The fresh records are kept decoded in the in-memory tier of the cache until they become stale
+def get_mirrored( url , payload , start ) :
+    key = get_mirror_memory_key(url, payload)
+    json_res = pappercache.memory_get(key, time.time())
+    if json_res is not None :
+        pappercache.count('memory_hits')
+        stale = None
+    else :
+        try :
+            record = pappermirror.get(url, payload)
+        except Exception as e :
+            log.warning("Mirror error: %s", e)
+            return None, None
+        if record is None :
+            return None, None
+        json_res, stale = record['answer'], record['stale']
+        if stale is None :
+            pappercache.memory_put(key, record['expires'], record['size'], json_res)
+
+    if stale is None :
+        pappermetrics.record_request(url, "cache", time.perf_counter() - start)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug("GET %s %s : mirror, %s", url, papperlog.compact(get_public_payload(payload)), stale or "fresh")
+    return json_res, stale
+
+def get_mirror_memory_key( url , payload ) :
+    return "mirror:" + pappercache.make_key(url, payload)
+
+# The API token is part of the key : a "Bad API key" error is not shared with other users
+def get_flight_key( url , payload ) :
+    return ( pappercache.make_key(url, payload), (payload or {}).get('api_token') )
+
+def record_shared( url , payload , start ) :
+    pappermetrics.record_request(url, "shared", time.perf_counter() - start)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug("GET %s %s : shared", url, papperlog.compact(get_public_payload(payload)))
+
+# Call of the API, answer decoded and stored in the cache
+def fetch_response( url , payload , use_cache , start ) :
+    try :
+        page = papperhttp.get( url , payload )
+    except Exception :
+        pappermetrics.record_request(url, "error", time.perf_counter() - start)
+        raise
+    return read_page(url, payload, page, use_cache, start)
+
+# Answer of the API (from papperhttp, or papperasync) : error codes raised, JSON decoded and cached
+def read_page( url , payload , page , use_cache , start ) :
+    pappermetrics.record_request(url, page.status_code, time.perf_counter() - start, len(page.content))
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug("GET %s %s : %s, %d bytes in %.3fs", url, papperlog.compact(get_public_payload(payload)), page.status_code, len(page.content), time.perf_counter() - start)
 
-    page = requests.get( url , params=payload)
     if page.status_code == 401:
         raise Exception("Bad API key")
     elif page.status_code == 404:
         raise Exception("No results !")
     elif page.status_code == 503:
         raise Exception("Service unavailable : try again later")
+    elif page.status_code == 429:
+        raise Exception("Too many requests : try again later")
     elif page.status_code == 200:
         json_res = page.json()
+        if use_cache :
+            try :
+                pappercache.put(url, payload, page.text, json_res)
+            except Exception as e :
+                log.warning("Cache error: %s", e)
+        # New version of a company record (see pappermirror.py)
+        if pappermirror.is_enabled() and pappermirror.is_mirrored(url) :
+            try :
+                pappermirror.put(url, payload, json_res)
+                pappercache.memory_remove(get_mirror_memory_key(url, payload))
+            except Exception as e :
+                log.warning("Mirror error: %s", e)
+        # Texts of the answer in the local full-text index (see papperindex.py)
+        if papperindex.is_enabled() :
+            try :
+                papperindex.add_response(url, json_res, payload)
+            except Exception as e :
+                log.warning("Index error: %s", e)
         return json_res
     else:
         raise Exception("Unknown error code !")
 
+# The payload without the API token, for the logs
+def get_public_payload( payload ) :
+    return { k: v for k, v in (payload or {}).items() if k not in pappercache.IGNORED_PARAMETERS }
+
+
+# Configuration file, next to this library (PAPPERS_CONFIG environment variable to use another one)
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_keys.yml')
+
+_config = None
+_config_mtime = None
+_config_lock = threading.Lock()
+_configured = None
+
 
+# The configuration is loaded once by process, and reloaded only when the file is modified
+# PyYAML is only imported when the file has to be parsed
 def load_api_key_config () :
-    with open('./transforms/api_keys.yml', 'r') as file :
-        config = yaml.safe_load(file)
-    return config
+    global _config, _config_mtime
+    path = os.environ.get('PAPPERS_CONFIG', CONFIG_PATH)
+    try :
+        mtime = os.stat(path).st_mtime
+    except OSError :
+        mtime = None
+
+    if _config is not None and mtime == _config_mtime :
+        return _config
+
+    with _config_lock :
+        if _config is None or mtime != _config_mtime :
+            config = {}
+            if mtime is not None :
+                import yaml
+                with open(path, 'r') as file :
+                    config = yaml.safe_load(file) or {}
+            _config = config
+            _config_mtime = mtime
+    return _config
+
+
+# Push the configuration sections to the cache and HTTP layers when it has changed
+def apply_config () :
+    global _configured
+    config = load_api_key_config()
+    if config is not _configured :
+        pappercache.configure(config.get('cache'))
+        papperhttp.configure(config.get('http'))
+        pappermetrics.configure(config.get('metrics'))
+        papperlog.configure(config.get('logging'))
+        pappernote.configure(config.get('notes'))
+        papperindex.configure(config.get('index'))
+        pappermirror.configure(config.get('mirror'))
+        _configured = config
+
+
+# The API key, by order of priority :
+#  - the 'api_key' transform setting sent by Maltego (server mode, see settings.api_key_setting)
+#  - the PAPPERS_API_KEY environment variable
+#  - the configuration file
+def get_api_key ( request=None ) :
+    if request is not None :
+        api_key = request.getTransformSetting('api_key')
+        if api_key :
+            return api_key
+
+    api_key = os.environ.get('PAPPERS_API_KEY')
+    if api_key :
+        return api_key
 
+    config = load_api_key_config()
+    try :
+        return config['pappers']['api_key']
+    except (KeyError, TypeError) :
+        raise Exception("No Pappers API key configured")
 
-## ENTREPRISE SEARCH TERMS (Pappers FR V2 API)
-def create_payload_entreprise( request ) :
+
+# Base URLs of the APIs, by order of priority :
+#  - the PAPPERS_FR_URL / PAPPERS_IN_URL environment variables
+#  - 'fr_url' / 'in_url' in the 'pappers' section of the configuration file
+#  - the real APIs
+# Another base URL points the transforms to a stand-in of the APIs (see benchmarks/fakeserver.py)
+DEFAULT_API_URLS = { 'fr': "https://api.pappers.fr/v2", 'in': "https://api.pappers.in/v1" }
+
+def get_api_url( api , endpoint ) :
+    base_url = os.environ.get(f"PAPPERS_{api.upper()}_URL")
+    if not base_url :
+        config = load_api_key_config()
+        base_url = (config.get('pappers') or {}).get(api + '_url') or DEFAULT_API_URLS[api]
+    return base_url.rstrip('/') + '/' + endpoint
+
+
+# Number of search pages fetched at the same time, by threads or by asyncio (see papperasync.py)
+DEFAULT_PAGE_WORKERS = 4
+DEFAULT_PAGE_ENGINE = 'threads'
+
+def get_page_workers() :
     config = load_api_key_config()
+    return (config.get('pagination') or {}).get('workers', DEFAULT_PAGE_WORKERS)
 
+def get_page_engine() :
+    config = load_api_key_config()
+    return (config.get('pagination') or {}).get('engine') or DEFAULT_PAGE_ENGINE
+
+def copy_payload_page( payload_tpl , page ) :
+    payload = dict(payload_tpl)
+    payload['page'] = page
+    return payload
+
+# Results of a search page (FR V2 API : 'resultats', IN V1 API : 'results')
+def get_results( json_res ) :
+    if 'resultats' in json_res :
+        return json_res['resultats'] or []
+    return json_res.get('results') or []
+
+def count_results( json_res ) :
+    return len(get_results(json_res))
+
+# Number of pages the first page of a search proves to hold results : its 'total' of results,
+# 'par_page' by page (1 when the page does not tell)
+def count_known_pages( json_res , payload_tpl , nbr_page ) :
+    try :
+        total = int(json_res.get('total'))
+        par_page = int(payload_tpl['par_page'])
+    except (KeyError, TypeError, ValueError) :
+        return 1
+    return max(1, min(nbr_page, -(-total // par_page)))
+
+# Browse the pages 1..limit_page of a search and yield the JSON of each page, in order.
+# Pappers API is strange when returning the number of page / result :
+# normally there is a "total" who defines the number of returning results. But it seems wrong (5 for Nicolas Sarkozy but more results)
+# So we stop at the first empty page, and at limit_page. At None, browse "total" pages.
+# The first page is fetched alone : if it is not full, there is nothing more to fetch.
+# Every page is paid, even when it comes back empty : only the pages the first one announces with
+# its "total" are fetched concurrently, by a bounded pool of workers. The next ones are fetched one
+# at a time, once the previous page came back with results. Unless "total" announces more results
+# than there are, no page is requested that browsing the pages one after another would not request.
+# With the 'asyncio' engine, the same is done by coroutines of the shared event loop.
+def fetch_pages( url , payload_tpl , limit_page , workers=None ) :
+    if workers is None :
+        workers = get_page_workers()
+
+    if get_page_engine() == 'asyncio' :
+        from transforms import papperasync
+        yield from papperasync.iter_sync(papperasync.fetch_pages(url, payload_tpl, limit_page, workers))
+        return
+
+    json_res = make_request(url, copy_payload_page(payload_tpl, 1))
+    nbr_result = count_results(json_res)
+    if nbr_result == 0 :
+        return
+    yield json_res
+
+    # Get the number of pages to browse
+    if limit_page is None :
+        nbr_page = json_res['total']
+    else :
+        nbr_page = limit_page
+
+    if 'par_page' in payload_tpl and nbr_result < int(payload_tpl['par_page']) :
+        return
+
+    if workers <= 1 :
+        for page in range(2, nbr_page + 1) :
+            json_res = make_request(url, copy_payload_page(payload_tpl, page))
+            if count_results(json_res) == 0 :
+                return
+            yield json_res
+        return
+
+    # Sliding window of 'workers' pages in flight, consumed in page order
+    # The pages fetched by the pool are counted for the calling transform
+    known_pages = count_known_pages(json_res, payload_tpl, nbr_page)
+    transform = pappermetrics.get_transform()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    next_page = 2
+
+    def fill() :
+        nonlocal next_page
+        while next_page <= nbr_page and len(pending) < workers and ( next_page <= known_pages or len(pending) == 0 ) :
+            pending.append(executor.submit(pappermetrics.run_as, transform, make_request, url, copy_payload_page(payload_tpl, next_page)))
+            next_page += 1
+
+    try :
+        fill()
+        while len(pending) > 0 :
+            json_res = pending.popleft().result()
+            if count_results(json_res) == 0 :
+                return
+            fill()
+            yield json_res
+    finally :
+        # Only the requests not sent yet can be cancelled (the caller stopped early)
+        for future in pending :
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+# Maximum number of entities a search transform should output (None : no limit)
+# Maltego Community only displays 12 entities : results beyond are only spending tokens
+def get_entity_budget() :
+    config = load_api_key_config()
+    return (config.get('pagination') or {}).get('entity_budget')
+
+# Browse the results of a search transform, one page at a time.
+# Results rejected by 'filter' (do_filter_dirigeant_entity, do_filter_dirigeant_mention_in) are skipped.
+# With an entity budget, pages are fetched one after another and no more page is fetched once the
+# transform has added 'budget' entities to the response (rejected results never add entities).
+# The entities are counted as the Maltego client receives them : the copies of an entity, merged
+# before the response is written (see papperresponse.merge_duplicates), count once.
+def iter_results( url , payload_tpl , limit_page , response , request=None , filter=None , budget=None ) :
+    if budget is None :
+        budget = get_entity_budget()
+
+    workers = None
+    if budget is not None :
+        workers = 1
+
+    keys = set(papperresponse.get_entity_key(entity) for entity in response.entities)
+    nbr_keys = len(keys)
+    nbr_entities = len(response.entities)
+    pages = fetch_pages(url, payload_tpl, limit_page, workers)
+    try :
+        for json_res in pages :
+            log.debug("Page of %d results from %s", count_results(json_res), url)
+            for result in get_results(json_res) :
+                if filter is not None and filter(request, result) :
+                    continue
+                yield result
+
+            if budget is not None :
+                keys.update(papperresponse.get_entity_key(entity) for entity in response.entities[nbr_entities:])
+                nbr_entities = len(response.entities)
+                if len(keys) - nbr_keys >= budget :
+                    return
+    finally :
+        pages.close()
+
+
+## ENTREPRISE SEARCH TERMS (Pappers FR V2 API)
+def create_payload_entreprise( request ) :
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = get_api_key(request)
     payload_tpl['siren'] = request.getProperty("id_tax_number")
 
     return payload_tpl
 
 ## COMAPNY SEARCH TERMS (Pappers IN V1 API) 
 def create_payload_company( request ) :
-    config = load_api_key_config()
-
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = get_api_key(request)
     payload_tpl['q'] = request.getProperty("nom_usuel")
 
     return payload_tpl
@@ -54,10 +438,8 @@ def create_payload_company( request ) :
 ## BENEFICIAIRE SEARCH TERMS (Pappers FR V2 API)
 ## Using most precise key info to get the good guy
 def create_payload_beneficiaries( request ) :
-    config = load_api_key_config()
-
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = get_api_key(request)
 
     # If we know several "prenoms", we search with them
     if request.getProperty('prenoms') is not None :        
@@ -83,10 +465,8 @@ def create_payload_beneficiaries( request ) :
 ## DIRIGEANT SEARCH TERMS (Pappers FR V2 API)
 ## Using most precise key info to get the good guy
 def create_payload_dirigeants( request ) :
-    config = load_api_key_config()
-
     payload_tpl = {}
-    payload_tpl['api_token'] = config['pappers']['api_key']
+    payload_tpl['api_token'] = get_api_key(request)
 
     # If we know several "prenoms", we search with them
     if request.getProperty('prenoms') is not None :        
@@ -140,162 +520,150 @@ def calculate_key ( identity ) :
         identity['key'] += " " + identity['birthdate_month'] 
 
 
+# "15/03/1962" -> "1962-03-15", "03/1962" -> "1962-03"
+def reverse_date ( date ) :
+    return "-".join(reversed(date.split('/')))
+
+
+## FIELD MAPPING : fields of the FR V2 and IN V1 answers, compiled into extractors (see pappermapping.py)
+## The quirks of the previous parsers are kept : some fields are added even when None ("None"),
+## the activity of an IN company with local activities is its name.
+
+MAPPING_FUNCTIONS = { 'normalize_siren': normalize_siren, 'normalize_name': normalize_name,
+                      'normalize_date_month': normalize_date_month, 'reverse_date': reverse_date }
+
+# XXX Handling differents parameter names in the Pappers API
+IDENTITY_SCHEMA = [
+    ( 'birthdate_month', [ ( 'date_de_naissance_formatee', SET, "normalize_date_month(reverse_date(value))" ),
+                           ( 'date_de_naissance_rgpd', SET, "normalize_date_month(value)" ),
+                           ( 'date_of_birth', SET, "normalize_date_month(value)" ),
+                           ( 'date_de_naissance_complete_formatee', SET, "normalize_date_month(reverse_date(value.split('/', 1)[1]))" ) ] ),
+    ( 'birthdate', [ ( 'date_de_naissance_complete_formatee', SET, "reverse_date(value)" ),
+                     ( 'date_de_naissance', SET, "value" ) ] ),
+    ( 'firstnames', [ ( 'prenom', SET, "normalize_name(value)" ) ] ),
+    # V1 IN API return several firstname in "firstname"
+    ( 'firstname', [ ( 'prenom_usuel', SET, "normalize_name(value)" ),
+                     ( 'first_name', SET, "normalize_name(value.split(' ')[0])" ) ] ),
+    ( 'lastname', [ ( 'nom', SET, "normalize_name(value)" ),
+                    ( 'last_name', SET, "normalize_name(value)" ) ] ),
+    ( 'age', [ ( 'age', SET, "value" ) ] ),
+]
+
+LOCATION_SCHEMA = [
+    ( 'country_code', [ ( 'code_pays', SET, "value" ), ( 'country_code', SET, "value" ) ] ),
+    ( 'country', [ ( 'pays', SET, "value" ), ( 'country', SET, "value" ) ] ),
+    ( 'address', [ ( 'adresse_ligne_1', SET, "value" ), ( 'address_line_1', SET, "value" ) ] ),
+    ( 'address_2', [ ( 'adresse_ligne_2', SET, "value" ), ( 'address_line_2', SET, "value" ) ] ),
+    ( 'city', [ ( 'ville', SET, "value" ), ( 'city', SET, "value" ) ] ),
+    ( 'code_postal', [ ( 'code_postal', SET, "value" ), ( 'postal_code', SET, "value" ) ] ),
+]
+
+# Properties of the Dirigeant entities, from an identity (parse_identity)
+DIRIGEANT_SCHEMA = [
+    ( "date_naissance", "Naissance", "strict", [ ( 'birthdate', SET, "value" ) ] ),
+    ( "date_naissance_rgpd", "Naissance RGPD", "strict", [ ( 'birthdate_month', SET, "value" ) ] ),
+    ( "person.lastname", "Lastname", "loose", [ ( 'lastname', SET, "value" ) ] ),
+    ( "person.firstnames", "Firstname", "loose", [ ( 'firstname', SET, "value" ) ] ),
+    ( "prenoms", "Prenoms", "loose", [ ( 'firstnames', SET, "value" ) ] ),
+    ( "age", "Age", "loose", [ ( 'age', SET, "value" ) ] ),
+    ( "dirigeant", "Dirigeant", "loose", [ ( 'key', SET, "value" ) ] ),
+]
+
+# Properties of the head office of a company, from a location (parse_location)
+HEADQUARTERS_SCHEMA = [
+    ( "headquarters_address", "Siege", "loose", [ ( 'address', SET, "f'{value}'" ) ] ),
+    ( "headquarters_city", "Siege", "loose", [ ( 'city', SET, "f'{value}'" ) ] ),
+    ( "country", "Country code", "loose", [ ( 'country', SET, "f'{value}'" ) ] ),
+    ( "postalcode", "Postal code", "loose", [ ( 'code_postal', SET, "f'{value}'" ) ] ),
+    ( "countrycode", "Country Code", "loose", [ ( 'country_code', SET, "value" ) ] ),
+]
+
+# Properties of the HeadquartersLocation entities, from a location (parse_location)
+LOCATION_PROPERTIES_SCHEMA = [
+    ( "streetaddress", "Street Address", "strict", [ ( 'address', SET, "f'{value}'" ) ] ),
+    ( "city", "City", "loose", [ ( 'city', SET, "f'{value}'" ) ] ),
+    ( "country", "Country", "loose", [ ( 'country', SET, "f'{value}'" ) ] ),
+    ( "postalcode", "Postal code", "loose", [ ( 'code_postal', SET, "f'{value}'" ) ] ),
+    ( "countrycode", "Country code", "loose", [ ( 'country_code', SET, "f'{value}'" ) ] ),
+]
+
+# Name and dates of a company, FR V2 and IN V1
+ENTREPRISE_SCHEMA = [
+    ( "id_tax_number", "siren_vat", "strict", [ ( 'siren', PRESENT, "normalize_siren(value)" ) ] ),
+    ( "activity", "Activity", "loose", [ ( 'libelle_code_naf', PRESENT, "f'{value}'" ) ] ),
+    ( "greffe", "Greffe", "loose", [ ( 'greffe', PRESENT, "f'{value}'" ) ] ),
+    ( "rcs", "R.C.S", "loose", [ ( 'numero_rcs', PRESENT, "f'{value}'" ) ] ),
+    ( "tva", "Num T.V.A", "loose", [ ( 'numero_tva_intracommunautaire', PRESENT, "f'{value}'" ) ] ),
+    ( "forme_juridique", "Forme juridique", "loose", [ ( 'forme_juridique', PRESENT, "f'{value}'" ) ] ),
+    # Difference for 'name' between long description (company details) and short one (representanst from company)
+    ( "nom_usuel", "Nom", "loose", [ ( 'nom_entreprise', PRESENT, "value" ), ( 'nom_complet', PRESENT, "value" ) ] ),
+    ( "date_creation", "Creation date", "loose", [ ( 'date_creation', PRESENT, "f'{value}'" ) ] ),
+    ( "date_cessation", "Date cessation", "loose", [ ( 'date_cessation', SET, "f'{value}'" ) ] ),
+    # Will add the color overlay in RED
+    ( "is_activ", "Currently Activ", "loose", [ ( 'date_cessation', SET, "'#FF0000'" ) ] ),
+]
+
+ENTREPRISE_IN_SCHEMA = [
+    ( "id_tax_number", "siren_vat", "strict", [ ( 'company_number', PRESENT, "normalize_siren(value)" ) ] ),
+    ( "activity", "Activity", "loose", [ ( 'local_activities', NOT_EMPTY, "str(d['name'])" ), ( 'purpose', PRESENT, "f'{value}'" ) ] ),
+    ( "forme_juridique", "Forme juridique", "loose", [ ( 'local_legal_form_name', PRESENT, "f'{value}'" ) ] ),
+    ( "nom_usuel", "Nom", "loose", [ ( 'name', PRESENT, "value" ) ] ),
+    ( "date_creation", "Creation date", "loose", [ ( 'date_of_creation', PRESENT, "f'{value}'" ) ] ),
+    ( "date_cessation", "Date cessation", "loose", [ ( 'date_of_cessation', SET, "f'{value}'" ) ] ),
+    ( "is_activ", "Currently Activ", "loose", [ ( 'date_of_cessation', SET, "'#FF0000'" ) ] ),
+]
+
+# Company officer or shareholder (IN V1)
+OFFICER_COMPANY_SCHEMA = [
+    ( "id_tax_number", "siren_vat", "strict", [ ( 'company_number', PRESENT, "normalize_siren(value)" ) ] ),
+    ( "nom_usuel", "Nom", "loose", [ ( 'company_name', PRESENT, "value" ) ] ),
+]
+
+UBO_COMPANY_SCHEMA = [
+    ( "nom_usuel", "Nom", "loose", [ ( 'last_name', PRESENT, "value" ) ] ),
+]
+
+extract_identity = pappermapping.compile_record('extract_identity', IDENTITY_SCHEMA, MAPPING_FUNCTIONS)
+extract_location = pappermapping.compile_record('extract_location', LOCATION_SCHEMA, MAPPING_FUNCTIONS)
+add_dirigeant_properties = pappermapping.compile_properties('add_dirigeant_properties', DIRIGEANT_SCHEMA, MAPPING_FUNCTIONS)
+add_headquarters_properties = pappermapping.compile_properties('add_headquarters_properties', HEADQUARTERS_SCHEMA, MAPPING_FUNCTIONS)
+add_location_properties = pappermapping.compile_properties('add_location_properties', LOCATION_PROPERTIES_SCHEMA, MAPPING_FUNCTIONS)
+add_entreprise_properties = pappermapping.compile_properties('add_entreprise_properties', ENTREPRISE_SCHEMA, MAPPING_FUNCTIONS)
+add_entreprise_in_properties = pappermapping.compile_properties('add_entreprise_in_properties', ENTREPRISE_IN_SCHEMA, MAPPING_FUNCTIONS)
+add_officer_company_properties = pappermapping.compile_properties('add_officer_company_properties', OFFICER_COMPANY_SCHEMA, MAPPING_FUNCTIONS)
+add_ubo_company_properties = pappermapping.compile_properties('add_ubo_company_properties', UBO_COMPANY_SCHEMA, MAPPING_FUNCTIONS)
+
+
 # Will put the little flag : 
 # - compatibility between pappers and maltego
 # - Mapping fuzziness of Pappers API
 def parse_identity ( dirigeant ) :
-    identity = {}
-    identity['firstname'] = None
-    identity['firstnames'] = None    
-    identity['lastname'] = None
-    identity['birthdate'] = None
-    identity['birthdate_month'] = None
-    identity['age'] = None    
-
-    # XXX Handling differents parameter names in the Pappers API
-    if 'date_de_naissance_formatee' in dirigeant and dirigeant['date_de_naissance_formatee'] is not None : 
-        date_split = dirigeant['date_de_naissance_formatee'].split('/') 
-        identity['birthdate_month'] = normalize_date_month(date_split[1] + "-" + date_split[0])
-    elif 'date_de_naissance_rgpd' in dirigeant and dirigeant['date_de_naissance_rgpd'] is not None :  
-        identity['birthdate_month'] = normalize_date_month(dirigeant['date_de_naissance_rgpd'])
-    elif 'date_of_birth' in dirigeant and dirigeant['date_of_birth'] is not None : 
-        identity['birthdate_month'] = normalize_date_month(dirigeant['date_of_birth'])
-
-    if 'date_de_naissance_complete_formatee' in dirigeant and dirigeant['date_de_naissance_complete_formatee'] is not None : 
-        date_split = dirigeant['date_de_naissance_complete_formatee'].split('/') 
-        identity['birthdate'] = date_split[2] + "-" + date_split[1] + "-" + date_split[0] 
-        if identity['birthdate_month'] is None : 
-            identity['birthdate_month'] = normalize_date_month(date_split[2] + "-" + date_split[1])                
-    elif 'date_de_naissance' in dirigeant and dirigeant['date_de_naissance'] is not None :  
-        identity['birthdate'] = dirigeant['date_de_naissance'] 
-
-    if 'prenom' in dirigeant and dirigeant['prenom'] is not None : 
-        identity['firstnames'] = normalize_name(dirigeant['prenom'])
-
-    if 'prenom_usuel' in dirigeant and dirigeant['prenom_usuel'] is not None : 
-        identity['firstname'] = normalize_name(dirigeant['prenom_usuel'])
-    elif 'first_name' in dirigeant and dirigeant['first_name'] is not None :
-
-        # V1 IN API return several firstname in "firstname"
-        name_split = dirigeant['first_name'].split(" ")
-        identity['firstname'] = normalize_name(name_split[0]) 
-        if identity['firstname'] is None :
-            identity['firstnames'] = normalize_name(dirigeant['first_name'])           
-
-    if 'nom' in dirigeant and dirigeant['nom'] is not None : 
-        identity['lastname'] = normalize_name(dirigeant['nom'])
-    elif 'last_name' in dirigeant and dirigeant['last_name'] is not None : 
-        identity['lastname'] = normalize_name(dirigeant['last_name'])         
-
-    if 'age' in dirigeant and dirigeant['age'] is not None : 
-        identity['age'] = dirigeant['age']
-
+    identity = extract_identity(dirigeant)
     calculate_key(identity)
-
     return identity
 
 
-
-
 # Will put the little flag : 
 # - compatibility between pappers and maltego
 # - Mapping fuzziness of Pappers API
 def parse_location ( entity, siege ) :
-    location = {}
-    location['country_code'] = None
-    location['country'] = None
-    location['address'] = None
-    location['city'] = None
-    location['code_postal'] = None    
-    ccode_found = False
-
-    # COUNTRY_CODE : API Pappers FR V2
-    if 'code_pays' in siege and siege['code_pays'] is not None : 
-        location['country_code'] = siege['code_pays']
-    # API Pappers IN V1
-    elif 'country_code' in siege and siege['country_code'] is not None :
-        location['country_code'] = siege['country_code']
-
-
-    # COUNTRY : API Pappers FR V2
-    if 'pays' in siege and siege['pays'] is not None :
-        location['country'] = siege['pays']
-    # API Pappers IN V1        
-    elif 'country' in siege and siege['country'] is not None :
-        location['country'] = siege['country']
-
-
-    # ADDRESS : API Pappers FR V2
-    if 'adresse_ligne_1' in siege and siege['adresse_ligne_1'] is not None :
-        location['address'] = siege['adresse_ligne_1']
-    # API Pappers IN V1        
-    elif 'address_line_1' in siege and siege['address_line_1'] is not None :
-        location['address'] = siege['address_line_1']
-    # ADDRESS : API Pappers FR V2
-    if 'adresse_ligne_2' in siege and siege['adresse_ligne_2'] is not None :
-        location['address'] += ", " + siege['adresse_ligne_2']
-    # API Pappers IN V1        
-    elif 'address_line_2' in siege and siege['address_line_2'] is not None :
-        location['address'] += ", " + siege['address_line_2']
-
-
-    # CITY : API Pappers FR V2
-    if 'ville' in siege and siege['ville'] is not None :
-        location['city'] = siege['ville']
-    # API Pappers IN V1        
-    elif 'city' in siege and siege['city'] is not None :
-        location['city'] = siege['city']
-
-    # POSTAL CODE : API Pappers FR V2
-    if 'code_postal' in siege and siege['code_postal'] is not None :
-        #sys.stderr.write(f"Postal code {siege['code_postal']} \n")
-        location['code_postal'] = siege['code_postal']
-    # API Pappers IN V1        
-    elif 'postal_code' in siege and siege['postal_code'] is not None :
-        location['code_postal'] = siege['postal_code']        
-
-
-    if location['country_code'] is not None : 
- 
-        # XXX compatibility with maltego flags
-        if location['country_code'] == 'UK' :
-            location['country_code'] = 'GB'
- 
-        ccode_found = True 
-
-    elif location['country']  is not None : 
-        if ccode_found is not True :
-            ccode_found = True
-            if location['country'] == 'France' :
-                location['country_code'] = 'FR'  
-            elif location['country'] == 'ETATS-UNIS' :
-                location['country_code'] = 'US'
-            elif location['country'] == 'United States' :
-                location['country_code'] = 'US'
-            elif location['country'] == 'England' :
-                location['country_code'] = 'GB' 
-            elif location['country'] == 'Switzerland' :
-                location['country_code'] = 'CH'  
-            elif location['country'] == 'Belgique' :
-                location['country_code'] = 'BE'                                                                  
-            elif location['country'] == 'LU' :
-                location['country_code'] = 'LU'
-            if location['country'] == 'Netherlands' :
-                location['country_code'] = 'NL'
-            if location['country'] == 'Luxembourg' :
-                location['country_code'] = 'LU'                                                 
-            else :
-                ccode_found = False
-                sys.stderr.write(f"Cannot find country code. Maybe add {location['country']} to the mapping\n")
-
-    elif location['city']  is not None : 
-        if ccode_found is not True :
-            ccode_found = True
-            if location['city'] == 'Zürich' :
-                location['country_code'] = 'CH'                
-            else :
-                ccode_found = False
-                sys.stderr.write(f"Cannot find country code. Maybe add {location['city']} to the mapping\n")
+    location = extract_location(siege)
+
+    address_2 = location.pop('address_2')
+    if address_2 is not None :
+        if location['address'] is None :
+            location['address'] = address_2
+        else :
+            location['address'] += ", " + address_2
+
+    # COUNTRY CODE : the code given by the API, or else the code of the country name, or of the
+    # city (see pappercountry.py). UK is turned into GB for compatibility with maltego flags
+    if location['country_code'] is not None :
+        location['country_code'] = pappercountry.get_country_code(location['country_code']) or location['country_code']
+    elif location['country'] is not None :
+        location['country_code'] = pappercountry.get_country_code(location['country'])
+    elif location['city'] is not None :
+        location['country_code'] = pappercountry.get_city_country_code(location['city'])
 
     return location
  
@@ -309,35 +677,35 @@ def do_filter_dirigeant_entity( request , dirigeant ) :
 
     try :
         if ( ( identity['firstname'] != request.getProperty('firstname') )or ( identity['lastname'] != request.getProperty('lastname') ) ) :
-            sys.stderr.write(f"Dirigeant filtered : Names does'nt match : {identity['firstname']} != {request.getProperty('firstname')} or {identity['lastname']} != {request.getProperty('lastname')}\n")
+            log.debug("Dirigeant filtered : Names does'nt match : %s != %s or %s != %s", identity['firstname'], request.getProperty('firstname'), identity['lastname'], request.getProperty('lastname'))
             return 1
 
         # If we have birth_month in the calling entity and the results, we first check that      
         if (request.getProperty('date_naissance_rgpd') is not None ) and identity['birthdate_month'] is not None : 
             if ( request.getProperty('date_naissance_rgpd') != identity['birthdate_month'] ) :
-                sys.stderr.write(f"Dirigeant filtered : Month Naissance does'nt match : {request.getProperty('date_naissance_rgpd')} != {identity['birthdate_month']} \n")
+                log.debug("Dirigeant filtered : Month Naissance does'nt match : %s != %s", request.getProperty('date_naissance_rgpd'), identity['birthdate_month'])
                 return 1
             elif (request.getProperty('date_naissance') is not None ) and identity['birthdate'] is not None : 
                 if ( request.getProperty('date_naissance') != identity['birthdate'] ) :
-                    sys.stderr.write(f"Strange !! Dirigeant birth month match but not year (not filtered, LAZY) {request.getProperty('date_naissance')} != {identity['birthdate']} \n")
+                    log.debug("Strange !! Dirigeant birth month match but not year (not filtered, LAZY) %s != %s", request.getProperty('date_naissance'), identity['birthdate'])
 
         # If we have matched month, we keep the entity
         # If not, we try to match on pirth date  
         elif (request.getProperty('date_naissance') is not None ) and identity['birthdate'] is not None : 
                 if ( request.getProperty('date_naissance') != identity['birthdate'] ) :
-                    sys.stderr.write(f"Dirigeant filtered : Date naissance doesn't match {request.getProperty('date_naissance')} != {identity['birthdate']} | {request.getProperty('date_naissance_rgpd')} != {identity['birthdate_month']}\n")
+                    log.debug("Dirigeant filtered : Date naissance doesn't match %s != %s | %s != %s", request.getProperty('date_naissance'), identity['birthdate'], request.getProperty('date_naissance_rgpd'), identity['birthdate_month'])
                     return 1
 
         elif request.getProperty('age') is not None and identity['age'] is not None :
             if int(request.getProperty('age')) != identity['age'] :
-                sys.stderr.write(f"Dirigeant filtered : Age does not match : {request.getProperty('age')} != {identity['age']}\n")
+                log.debug("Dirigeant filtered : Age does not match : %s != %s", request.getProperty('age'), identity['age'])
                 return 1 
         else :
             #Default behaviour for date / month / age filtering : LAZY and let pass
             return 0
         
     except Exception as e : 
-            sys.stderr.write(f"Error while applying filters {e}\n") 
+            log.warning("Error while applying filters %s", e)
     return 0 
 
 
@@ -355,15 +723,10 @@ def parse_etablissement( response , etablissement ) :
 
     ### Location entity calculation
     location = parse_location(entity, etablissement )
-    if location['address'] is not None : entity.addProperty("streetaddress","Street Address","strict",f"{location['address']}")
-    if location['city'] is not None : entity.addProperty("city","City","loose",f"{location['city']}")
-    if location['country'] is not None : entity.addProperty("country","Country","loose",f"{location['country']}")
-    if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")          
     if location['country_code'] is None :
-        sys.stderr.write(f"Cannot find country code.\n")
-        entity.addProperty("countrycode","Contry code","loose",'FR')
-    else :   
-        entity.addProperty("countrycode","Contry code","loose",location['country_code'])          
+        log.debug("Cannot find country code.")
+        location['country_code'] = 'FR'
+    add_location_properties(entity, location)
 
     entity.addProperty("activity","Activity","loose",etablissement['libelle_code_naf'])
     return entity
@@ -385,12 +748,13 @@ def generate_etablissement_link_config( entity , etablissement ) :
 
 
 ### Parse Representant from Pappers JSON and map it to Dirigeant Custom Maltego Entity
+@pappermetrics.measure_parse
 def auto_parse_dirigeant( request, response , beneficiaire ) :
 
     # Location calculation
     identity = parse_identity(beneficiaire )
 
-    sys.stderr.write(f"Tricks : " + str(request.getProperty("date_naissance")) + " " + str(request.getProperty("date_naissance_rgpd")) )
+    log.debug("Tricks : %s %s", request.getProperty("date_naissance"), request.getProperty("date_naissance_rgpd"))
     # If we have no birthdate detected, but our calling entity as one.
     # And if birthdate_month are identical
     # Entity seems identical so we get the calling entity birthdate to allow merging
@@ -398,37 +762,25 @@ def auto_parse_dirigeant( request, response , beneficiaire ) :
 
         if identity['birthdate_month'] is not None and identity['birthdate_month'] == request.getProperty("date_naissance_rgpd") :
             identity['birthdate'] = request.getProperty("date_naissance")
-            sys.stderr.write(f"Tricks : adding calling entity birthdate sinc monthes matches !!")
+            log.debug("Tricks : adding calling entity birthdate sinc monthes matches !!")
 
     calculate_key(identity)
 
     entity = response.addEntity("reflets.Dirigeant", f"{identity['key']}")
-    if identity['birthdate'] is not None : entity.addProperty( "date_naissance", "Naissance", "strict", identity['birthdate'] )
-    if identity['birthdate_month'] is not None : entity.addProperty( "date_naissance_rgpd", "Naissance RGPD", "strict", identity['birthdate_month'] )
-    if identity['lastname'] is not None : entity.addProperty( "person.lastname", "Lastname", "loose", identity['lastname'] )
-    if identity['firstname'] is not None : entity.addProperty( "person.firstnames", "Firstname", "loose", identity['firstname'] ) 
-    if identity['firstnames'] is not None : entity.addProperty( "prenoms", "Prenoms", "loose", identity['firstnames'] )   
-    if identity['age'] is not None : entity.addProperty( "age", "Age", "loose", identity['age'] )
-    if identity['key'] is not None : entity.addProperty( "dirigeant", "Dirigeant", "loose", identity['key'] )           
+    add_dirigeant_properties(entity, identity)
 
     return entity
 
 
 ### Parse Representant from Pappers JSON and map it to Dirigeant Custom Maltego Entity
+@pappermetrics.measure_parse
 def parse_dirigeant( response , beneficiaire ) :
 
     # Location calculation
     identity = parse_identity(beneficiaire )
 
     entity = response.addEntity("reflets.Dirigeant", f"{identity['key']}")
-    
-    if identity['birthdate'] is not None : entity.addProperty( "date_naissance", "Naissance", "strict", identity['birthdate'] )
-    if identity['birthdate_month'] is not None : entity.addProperty( "date_naissance_rgpd", "Naissance RGPD", "strict", identity['birthdate_month'] )
-    if identity['lastname'] is not None : entity.addProperty( "person.lastname", "Lastname", "loose", identity['lastname'] )
-    if identity['firstname'] is not None : entity.addProperty( "person.firstnames", "Firstname", "loose", identity['firstname'] ) 
-    if identity['firstnames'] is not None : entity.addProperty( "prenoms", "Prenoms", "loose", identity['firstnames'] )   
-    if identity['age'] is not None : entity.addProperty( "age", "Age", "loose", identity['age'] )
-    if identity['key'] is not None : entity.addProperty( "dirigeant", "Dirigeant", "loose", identity['key'] )           
+    add_dirigeant_properties(entity, identity)
 
     return entity
 
@@ -480,124 +832,92 @@ def create_dirigeant_link_config ( entity , entreprise ) :
 
 
 ### Parse societe from Pappers JSON and map it to DetailedCompany Custom Maltego Entity
+@pappermetrics.measure_parse
 def parse_entreprise( response , entreprise ):
         
         siren = normalize_siren( entreprise['siren'] )
         #sys.stderr.write(f"Entering entreprise parsing ")
         entity = response.addEntity("reflets.DetailedCompany", siren )
 
-        entity.addProperty("id_tax_number","siren_vat","strict",siren)
-
-        if 'libelle_code_naf' in entreprise :
-            entity.addProperty("activity","Activity","loose",f"{entreprise['libelle_code_naf']}")
-
-        if 'greffe' in entreprise :
-            entity.addProperty("greffe","Greffe","loose",f"{entreprise['greffe']}")
-
-        if 'numero_rcs' in entreprise :
-            entity.addProperty("rcs","R.C.S","loose",f"{entreprise['numero_rcs']}")
-
-        if 'numero_tva_intracommunautaire' in entreprise :
-            entity.addProperty("tva","Num T.V.A","loose",f"{entreprise['numero_tva_intracommunautaire']}")
-
-        if 'forme_juridique' in entreprise : 
-            entity.addProperty("forme_juridique","Forme juridique","loose",f"{entreprise['forme_juridique']}")
-
-        ### Difference for 'name' between long description (company details) and short one (representanst from company)
-        if 'nom_entreprise' in entreprise : 
-            entity.addProperty( "nom_usuel", "Nom", "loose", entreprise['nom_entreprise'] )
-        elif 'nom_complet' in entreprise : 
-            entity.addProperty( "nom_usuel", "Nom", "loose", entreprise['nom_complet'] )
-
-        if 'date_creation' in entreprise :
-            entity.addProperty("date_creation","Creation date","loose",f"{entreprise['date_creation']}")
-
-        if 'date_cessation' in entreprise and entreprise['date_cessation'] is not None :
-            entity.addProperty("date_cessation","Date cessation","loose",f"{entreprise['date_cessation']}")
-
-            # Will add the color overlay in RED
-            entity.addProperty("is_activ","Currently Activ","loose","#FF0000")  
+        add_entreprise_properties(entity, entreprise)
 
         ### Location entity calculation
         if 'siege' in entreprise :
             location = parse_location(entity, entreprise['siege'])
         else :
             location = parse_location(entity, entreprise)
-
-        if location['address'] is not None : entity.addProperty("headquarters_address","Siege","loose",f"{location['address']}")
-        if location['city'] is not None : entity.addProperty("headquarters_city","Siege","loose",f"{location['city']}")
-        if location['country'] is not None : entity.addProperty("country","Country code","loose",f"{location['country']}")
-        if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")        
-        if location['country_code'] is None :
-            sys.stderr.write(f"Cannot find country code.\n")
-        else :   
-            entity.addProperty("countrycode","Country Code","loose",location['country_code'])                
+        add_headquarters_properties(entity, location)
 
         return entity      
 
 
 ### Parse 'Depots Actes' NOTES
-def parse_note( entity, json_res ) :
-    note = ""
-    config = load_api_key_config()
+@pappermetrics.measure_parse
+def parse_note( entity, json_res, api_key=None ) :
+    if api_key is None :
+        api_key = get_api_key()
 
     siren = normalize_siren(json_res['siren'])
-
-    note += "Extraits Pappers : " + f"https://api.pappers.fr/v2/document/extrait_pappers?siren={siren}&api_token={config['pappers']['api_key']}" + "\n"
-    note += "Extraits INPI : " + f"https://api.pappers.fr/v2/document/extrait_inpi?siren={siren}&api_token={config['pappers']['api_key']}" + "\n"
-    note += "Avis situation INSEE : " + f"https://api.pappers.fr/v2/document/avis_situation_insee?siren={siren}&api_token={config['pappers']['api_key']}" + "\n"
-    note += "Beneficiaires effectifs : " + f"https://api.pappers.fr/v2/document/declaration_beneficiaires_effectifs?siren={siren}&api_token={config['pappers']['api_key']}" + "\n"
-    note += "Dernier status : " + f"https://api.pappers.fr/v2/document/statuts?siren={siren}&api_token={config['pappers']['api_key']}" + "\n" 
-    note += "Rapport Solvabilité : " + f"https://api.pappers.fr/v2/document/rapport_solvabilite?siren={siren}&api_token={config['pappers']['api_key']}" + "\n" 
-    note += "\n\n"             
-
-    if 'depots_actes' in json_res :
-        note += "\nDépots actes : " + "\n"
-        for acte in json_res['depots_actes']:
-
-            if 'nom_fichier_pdf' in acte and acte['nom_fichier_pdf'] is not None :                        
-                note += "  Name: " + acte['nom_fichier_pdf'] + "\n"
-                note += "  URL : " + f"https://www.pappers.fr/document/telecharger?token={acte['token']}" + "\n"
-            
-            note += "  Date de dépot: " + acte['date_depot_formate'] + "\n"    
-
-            if 'actes' in acte : 
-                for decision in acte['actes']:
-                    str = f"  {decision['type']} : {decision['decision']}"
-                    note += str + "\n"
-
-            note += "\n"
-    
-    if 'comptes' in json_res :
-        note += "\nDépots comptes : " + "\n"        
-        for acte in json_res['comptes']:
-
-            if 'nom_fichier_pdf' in acte and acte['nom_fichier_pdf'] is not None :             
-                note += "   Name: " + acte['nom_fichier_pdf'] + "\n"
-                note += "   URL : " + f"https://www.pappers.fr/document/telecharger?token={acte['token']}" + "\n"
-            if 'nom_fichier_xlsx' in acte and acte['nom_fichier_xlsx'] is not None : 
-                note += "   Excel: " + acte['nom_fichier_xlsx'] + "\n" 
-                note += "   URL : " + f"https://www.pappers.fr/document/telecharger?token={acte['token_xlsx']}" + "\n"              
-            note += "   Date de dépot: " + acte['date_depot_formate'] + "\n"    
-
-            note += "\n"
-
-    if 'publications_bodacc' in json_res :
-        note += "\nPublication bodacc : " + "\n" 
-        for acte in json_res['publications_bodacc']:
-
-            note += "   Numero: " + acte['numero_parution'] + "\n"                        
-            note += "   Date: " + acte['date'] + "\n"
-            note += "   Type: " + acte['type'] + "\n"
-            note += "   Denomination: " + acte['denomination'] + "\n"            
-            if 'descriptif' in acte and acte['descriptif'] is not None : 
-                note += "   Descriptif: " + acte['descriptif'] + "\n" 
-            if 'adresse' in acte and acte['adresse'] is not None : 
-                note += "   Adresse: " + acte['adresse'] + "\n"                              
-
-            note += "\n"
-
-    entity.setNote(note)
+    document_url = get_api_url('fr', 'document')
+
+    note = pappernote.Note()
+    links = [
+        ( "Extraits Pappers", "extrait_pappers" ),
+        ( "Extraits INPI", "extrait_inpi" ),
+        ( "Avis situation INSEE", "avis_situation_insee" ),
+        ( "Beneficiaires effectifs", "declaration_beneficiaires_effectifs" ),
+        ( "Dernier status", "statuts" ),
+        ( "Rapport Solvabilité", "rapport_solvabilite" ),
+    ]
+    note.add_section('links', "", links, lambda link : f"{link[0]} : {document_url}/{link[1]}?siren={siren}&api_token={api_key}\n")
+    note.add_text("\n\n")
+
+    note.add_section('depots_actes', "\nDépots actes : \n", json_res.get('depots_actes'), format_depot_acte)
+    note.add_section('comptes', "\nDépots comptes : \n", json_res.get('comptes'), format_compte)
+    note.add_section('publications_bodacc', "\nPublication bodacc : \n", json_res.get('publications_bodacc'), format_publication_bodacc)
+
+    entity.setNote(note.build())
+
+def format_depot_acte( acte ) :
+    text = ""
+    if 'nom_fichier_pdf' in acte and acte['nom_fichier_pdf'] is not None :
+        text += f"  Name: {acte['nom_fichier_pdf']}\n"
+        text += f"  URL : https://www.pappers.fr/document/telecharger?token={acte['token']}\n"
+
+    text += f"  Date de dépot: {acte['date_depot_formate']}\n"
+
+    if 'actes' in acte :
+        for decision in acte['actes'] :
+            text += f"  {decision['type']} : {decision['decision']}\n"
+
+    text += "\n"
+    return text
+
+def format_compte( acte ) :
+    text = ""
+    if 'nom_fichier_pdf' in acte and acte['nom_fichier_pdf'] is not None :
+        text += f"   Name: {acte['nom_fichier_pdf']}\n"
+        text += f"   URL : https://www.pappers.fr/document/telecharger?token={acte['token']}\n"
+    if 'nom_fichier_xlsx' in acte and acte['nom_fichier_xlsx'] is not None :
+        text += f"   Excel: {acte['nom_fichier_xlsx']}\n"
+        text += f"   URL : https://www.pappers.fr/document/telecharger?token={acte['token_xlsx']}\n"
+    text += f"   Date de dépot: {acte['date_depot_formate']}\n"
+
+    text += "\n"
+    return text
+
+def format_publication_bodacc( acte ) :
+    text = (f"   Numero: {acte['numero_parution']}\n"
+            f"   Date: {acte['date']}\n"
+            f"   Type: {acte['type']}\n"
+            f"   Denomination: {acte['denomination']}\n")
+    if 'descriptif' in acte and acte['descriptif'] is not None :
+        text += f"   Descriptif: {acte['descriptif']}\n"
+    if 'adresse' in acte and acte['adresse'] is not None :
+        text += f"   Adresse: {acte['adresse']}\n"
+
+    text += "\n"
+    return text
 
 
 
@@ -612,29 +932,30 @@ def do_filter_dirigeant_mention_in( request , dirigeant ) :
 
     try :
         if ( ( identity['firstname'] != request.getProperty('firstname') )or ( identity['lastname'] != request.getProperty('lastname') ) ) :
-            sys.stderr.write(f"Dirigeant filtered : Names does'nt match : {dirigeant['first_name']} != {request.getProperty('firstname')} or {dirigeant['last_name']} != {request.getProperty('lastname')}\n")
+            log.debug("Dirigeant filtered : Names does'nt match : %s != %s or %s != %s", dirigeant['first_name'], request.getProperty('firstname'), dirigeant['last_name'], request.getProperty('lastname'))
             return 1
 
         # If we have birth_month in the calling entity and the results, we first check that      
         if (request.getProperty('date_naissance_rgpd') is not None ) and identity['birthdate_month'] is not None : 
             if ( request.getProperty('date_naissance_rgpd') != identity['birthdate_month'] ) :
-                sys.stderr.write(f"Dirigeant filtered : Month Naissance does'nt match : {request.getProperty('date_naissance_rgpd')} != {identity['birthdate_month']} \n")
+                log.debug("Dirigeant filtered : Month Naissance does'nt match : %s != %s", request.getProperty('date_naissance_rgpd'), identity['birthdate_month'])
                 return 1
             elif (request.getProperty('date_naissance') is not None ) and identity['birthdate'] is not None : 
                 if ( request.getProperty('date_naissance') != identity['birthdate'] ) :
-                    sys.stderr.write(f"Strange !! Dirigeant birth month match but not year (not filtered, LAZY) {request.getProperty('date_naissance')} != {identity['birthdate']} \n")
+                    log.debug("Strange !! Dirigeant birth month match but not year (not filtered, LAZY) %s != %s", request.getProperty('date_naissance'), identity['birthdate'])
 
         else :
             #Default behaviour for date / month / age filtering : LAZY and let pass
             return 0
         
     except Exception as e : 
-            sys.stderr.write(f"Error while applying filters {e}\n") 
+            log.warning("Error while applying filters %s", e)
     return 0 
 
 
 
 ### Parse societe from Pappers JSON and map it to DetailedCompany Custom Maltego Entity
+@pappermetrics.measure_parse
 def parse_company( response , entreprise, country_code ):
         #sys.stderr.write(f"Entering entreprise parsing ")
         siren = normalize_siren(entreprise['company_number'])        
@@ -671,24 +992,17 @@ def create_officer_link_config ( entity , officer ) :
 
 
 ### Parse Representant from Pappers JSON and map it to Dirigeant Custom Maltego Entity
+@pappermetrics.measure_parse
 def parse_officers( response , beneficiaire ) :
     if 'company_name' in beneficiaire and beneficiaire['company_name'] is not None :
 
         siren = normalize_siren(beneficiaire['company_number'])
         entity = response.addEntity("reflets.DetailedCompany", siren )
-        entity.addProperty("id_tax_number","siren_vat","strict",siren)
-        entity.addProperty( "nom_usuel", "Nom", "loose", beneficiaire['company_name'] )
+        add_officer_company_properties(entity, beneficiaire)
 
         # Location calculation
         location = parse_location(entity, beneficiaire )
-        if location['address'] is not None : entity.addProperty("headquarters_address","Siege","loose",f"{location['address']}")
-        if location['city'] is not None : entity.addProperty("headquarters_city","Siege","loose",f"{location['city']}")
-        if location['country'] is not None : entity.addProperty("country","Country code","loose",f"{location['country']}")
-        if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")         
-        if location['country_code'] is None :
-            sys.stderr.write(f"Cannot find country code.\n")
-        else :   
-            entity.addProperty("countrycode","Country Code","loose",location['country_code'])                
+        add_headquarters_properties(entity, location)
 
 
     else :
@@ -697,13 +1011,7 @@ def parse_officers( response , beneficiaire ) :
 
         entity = response.addEntity("reflets.Dirigeant", f"{identity['key']}")
         
-        if identity['birthdate'] is not None : entity.addProperty( "date_naissance", "Naissance", "strict", identity['birthdate'] )
-        if identity['birthdate_month'] is not None : entity.addProperty( "date_naissance_rgpd", "Naissance RGPD", "strict", identity['birthdate_month'] )
-        if identity['lastname'] is not None : entity.addProperty( "person.lastname", "Lastname", "loose", identity['lastname'] )
-        if identity['firstname'] is not None : entity.addProperty( "person.firstnames", "Firstname", "loose", identity['firstname'] ) 
-        if identity['firstnames'] is not None : entity.addProperty( "prenoms", "Prenoms", "loose", identity['firstnames'] )   
-        if identity['age'] is not None : entity.addProperty( "age", "Age", "loose", identity['age'] )
-        if identity['key'] is not None : entity.addProperty( "dirigeant", "Dirigeant", "loose", identity['key'] )                
+        add_dirigeant_properties(entity, identity)
 
         entity.addProperty( "nationality", "Nationality", "loose", beneficiaire['nationality'] )
 
@@ -732,15 +1040,10 @@ def parse_etablissement_in( response , etablissement, default_country_code ) :
 
     ### Location entity calculation
     location = parse_location(entity, etablissement )
-    if location['address'] is not None : entity.addProperty("streetaddress","Street Address","strict",f"{location['address']}")
-    if location['city'] is not None : entity.addProperty("city","City","loose",f"{location['city']}")
-    if location['country'] is not None : entity.addProperty("country","Country","loose",f"{location['country']}")
-    if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")     
     if location['country_code'] is None :
-        sys.stderr.write(f"Cannot find country code in parse_etablissement_in\n")
-        entity.addProperty("countrycode","Country code","loose",f"{default_country_code}")        
-    else :   
-        entity.addProperty("countrycode","Country code","loose",location['country_code'])                
+        log.debug("Cannot find country code in parse_etablissement_in")
+        location['country_code'] = default_country_code
+    add_location_properties(entity, location)
 
     return entity
 
@@ -752,6 +1055,7 @@ def generate_siege_link_config_in( entity , etablissement ) :
 
 
 
+@pappermetrics.measure_parse
 def parse_ubos ( response, ubos ) :
 
     # XXX Tricks to make the difference between individuals and companies, since pappers.in API does not support the info
@@ -762,13 +1066,7 @@ def parse_ubos ( response, ubos ) :
 
         entity = response.addEntity("reflets.Dirigeant", f"{identity['key']}")
         
-        if identity['birthdate'] is not None : entity.addProperty( "date_naissance", "Naissance", "strict", identity['birthdate'] )
-        if identity['birthdate_month'] is not None : entity.addProperty( "date_naissance_rgpd", "Naissance RGPD", "strict", identity['birthdate_month'] )
-        if identity['lastname'] is not None : entity.addProperty( "person.lastname", "Lastname", "loose", identity['lastname'] )
-        if identity['firstname'] is not None : entity.addProperty( "person.firstnames", "Firstname", "loose", identity['firstname'] ) 
-        if identity['firstnames'] is not None : entity.addProperty( "prenoms", "Prenoms", "loose", identity['firstnames'] )   
-        if identity['age'] is not None : entity.addProperty( "age", "Age", "loose", identity['age'] )
-        if identity['key'] is not None : entity.addProperty( "dirigeant", "Dirigeant", "loose", identity['key'] )                
+        add_dirigeant_properties(entity, identity)
 
         # XXX Calculate age ?????
 
@@ -776,18 +1074,11 @@ def parse_ubos ( response, ubos ) :
         #sys.stderr.write(f"Entering entreprise parsing ")
         entity = response.addEntity("reflets.DetailedCompany", ubos['last_name'] )
 
-        entity.addProperty( "nom_usuel", "Nom", "loose", ubos['last_name'] )
+        add_ubo_company_properties(entity, ubos)
 
         # Location calculation
         location = parse_location(entity, ubos )
-        if location['address'] is not None : entity.addProperty("headquarters_address","Siege","loose",f"{location['address']}")
-        if location['city'] is not None : entity.addProperty("headquarters_city","Siege","loose",f"{location['city']}")
-        if location['country'] is not None : entity.addProperty("country","Country code","loose",f"{location['country']}")
-        if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")          
-        if location['country_code'] is None :
-            sys.stderr.write(f"Cannot find country code.\n")
-        else :   
-            entity.addProperty("countrycode","Country Code","loose",location['country_code'])
+        add_headquarters_properties(entity, location)
 
 
 
@@ -804,111 +1095,71 @@ def parse_ubos ( response, ubos ) :
 
 
 ### Parse societe from Pappers JSON and map it to DetailedCompany Custom Maltego Entity
+@pappermetrics.measure_parse
 def parse_entreprise_in( response , entreprise ):
         #sys.stderr.write(f"Entering entreprise parsing ")
         siren = normalize_siren(entreprise['company_number'])
         entity = response.addEntity("reflets.DetailedCompany", siren )
 
-        entity.addProperty("id_tax_number","siren_vat","strict",siren)
-
-        if 'local_activities' in entreprise and len(entreprise['local_activities']) > 0 : 
-            for act in entreprise['local_activities'] :
-                entity.addProperty("activity","Activity","loose",f"{entreprise['name']}")
-                break; 
-        elif 'purpose' in entreprise :
-            entity.addProperty("activity","Activity","loose",f"{entreprise['purpose']}")
-
-        if 'local_legal_form_name' in entreprise : 
-            entity.addProperty("forme_juridique","Forme juridique","loose",f"{entreprise['local_legal_form_name']}")
-
-
-        ### Difference for 'name' between long description (company details) and short one (representanst from company)
-        if 'name' in entreprise : 
-            entity.addProperty( "nom_usuel", "Nom", "loose", entreprise['name'] )
-
-        if 'date_of_creation' in entreprise :
-            entity.addProperty("date_creation","Creation date","loose",f"{entreprise['date_of_creation']}")
-
-        if 'date_of_cessation' in entreprise and entreprise['date_of_cessation'] is not None :
-            entity.addProperty("date_cessation","Date cessation","loose",f"{entreprise['date_of_cessation']}")
-
-            # Will add the color overlay in RED
-            entity.addProperty("is_activ","Currently Activ","loose","#FF0000")  
-
+        add_entreprise_in_properties(entity, entreprise)
 
         if 'head_office' in entreprise :
 
             # Location calculation
             location = parse_location(entity, entreprise['head_office'] )
-            if location['address'] is not None : entity.addProperty("headquarters_address","Siege","loose",f"{location['address']}")
-            if location['city'] is not None : entity.addProperty("headquarters_city","Siege","loose",f"{location['city']}")
-            if location['country'] is not None : entity.addProperty("country","Country code","loose",f"{location['country']}")
-            if location['code_postal'] is not None : entity.addProperty("postalcode","Postal code","loose",f"{location['code_postal']}")              
-            if location['country_code'] is None :
-                sys.stderr.write(f"Cannot find country code.\n")
-            else :   
-                entity.addProperty("countrycode","Country Code","loose",location['country_code'])
+            add_headquarters_properties(entity, location)
 
         return entity
 
 
 
 ### Parse 'Depots Actes' NOTES
-def parse_note_in( entity, json_res ) :
-    note = ""
-    config = load_api_key_config()
- 
-    if 'documents' in json_res and len(json_res['documents']) > 0 :
-        note += "\nDocuments : " + "\n"
-        for acte in json_res['documents']:
-
-            if 'type' in acte and acte['type'] is not None :                        
-                note += "  Document type : " + acte['type'] + "\n"
-            if 'description' in acte and acte['description'] is not None :                        
-                note += "  Description : " + acte['description'] + "\n" 
-            if 'date' in acte and acte['date'] is not None :                        
-                note += "  Date : " + acte['date'] + "\n"
-
-            if 'file_available' in acte and acte['file_available'] is True :                        
-                note += "  URL : " + f"https://api.pappers.in/v1/download-file?api_token={config['pappers']['api_key']}&token={acte['file_token']}" + "\n"
-            
-            note += "\n"
-
-    if 'financials' in json_res and len(json_res['financials']) > 0:
-        note += "\nFinancials : " + "\n"
-        for acte in json_res['financials']:
-
-            if 'related_documents' in acte : 
-                for doc in acte['related_documents'] :
-                    if 'type' in doc and doc['type'] is not None :                        
-                        note += "  Document type : " + doc['type'] + "\n"
-                    if 'description' in doc and doc['description'] is not None :                        
-                        note += "  Description : " + doc['description'] + "\n" 
-                    if 'date' in acte and acte['date'] is not None :                        
-                        note += "  Date : " + doc['date'] + "\n"
-
-                    if 'file_available' in doc and doc['file_available'] is True :   
-                        note += "  URL : " + f"https://api.pappers.in/v1/download-file?api_token={config['pappers']['api_key']}&token={doc['file_token']}" + "\n"
-                    
-                    note += "\n"                   
-
-    if 'publications' in json_res and len(json_res['publications']) > 0 :
-        note += "\nPublications : " + "\n"
-        for acte in json_res['publications']:
-
-            if 'type' in acte and acte['type'] is not None :                        
-                note += "  Document type : " + acte['type'] + "\n"
-            if 'description' in acte and acte['description'] is not None :                        
-                note += "  Description : " + acte['description'] + "\n"
-            elif 'content' in acte and acte['content'] is not None : 
-                note += "  Description : " + acte['content'] + "\n"
-
-            if 'date' in acte and acte['date'] is not None :                        
-                note += "  Date : " + acte['date'] + "\n"
-
-            if 'link' in acte and acte['link'] is not None :                        
-                note += "  URL : " + acte['link'] + "\n"
-            
-            note += "\n"
-
-    entity.setNote(note)
+@pappermetrics.measure_parse
+def parse_note_in( entity, json_res, api_key=None ) :
+    if api_key is None :
+        api_key = get_api_key()
+    download_url = get_api_url('in', 'download-file')
+
+    def format_document( acte ) :
+        text = ""
+        if 'type' in acte and acte['type'] is not None :
+            text += f"  Document type : {acte['type']}\n"
+        if 'description' in acte and acte['description'] is not None :
+            text += f"  Description : {acte['description']}\n"
+        if 'date' in acte and acte['date'] is not None :
+            text += f"  Date : {acte['date']}\n"
+
+        if 'file_available' in acte and acte['file_available'] is True :
+            text += f"  URL : {download_url}?api_token={api_key}&token={acte['file_token']}\n"
+
+        text += "\n"
+        return text
+
+    def format_publication( acte ) :
+        text = ""
+        if 'type' in acte and acte['type'] is not None :
+            text += f"  Document type : {acte['type']}\n"
+        if 'description' in acte and acte['description'] is not None :
+            text += f"  Description : {acte['description']}\n"
+        elif 'content' in acte and acte['content'] is not None :
+            text += f"  Description : {acte['content']}\n"
+
+        if 'date' in acte and acte['date'] is not None :
+            text += f"  Date : {acte['date']}\n"
+
+        if 'link' in acte and acte['link'] is not None :
+            text += f"  URL : {acte['link']}\n"
+
+        text += "\n"
+        return text
+
+    # The documents of the financials are listed one after another
+    related_documents = [ doc for acte in json_res.get('financials') or [] for doc in acte.get('related_documents') or [] ]
+
+    # Unlike the FR sections, the IN sections are only written when their list is not empty
+    note = pappernote.Note()
+    note.add_section('documents', "\nDocuments : \n", json_res.get('documents') or None, format_document)
+    note.add_section('financials', "\nFinancials : \n", related_documents if json_res.get('financials') else None, format_document)
+    note.add_section('publications', "\nPublications : \n", json_res.get('publications') or None, format_publication)
+
+    entity.setNote(note.build())
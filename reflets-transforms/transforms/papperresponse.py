@@ -0,0 +1,157 @@
+# Transform responses
+# The same company or dirigeant is often added several times by one transform run (on several
+# pages of a search, or as representant and beneficiary of a company). The copies are merged
+# before the response is written : the Maltego client receives one entity with every property,
+# the link labels and the notes of all the copies.
+# The response is then written entity after entity (see iter_output) instead of being built as
+# one XML document in memory. Only the serialization is streamed : every entity is created and
+# merged before the first chunk, the XML document is never held in memory as a whole.
+
+from maltego_trx.maltego import MaltegoTransform
+from maltego_trx.transform import DiscoverableTransform
+
+LINK_LABEL = 'link#maltego.link.label'
+LINK_THICKNESS = 'link#maltego.link.thickness'
+LINK_DIRECTION = 'link#maltego.link.direction'
+NOTES = 'notes#'
+
+# Separators of the merged link labels and notes
+LABEL_SEPARATOR = " / "
+NOTE_SEPARATOR = "\n\n"
+
+
+## DEDUPLICATION
+
+# Same entity for the Maltego client : same type, value and strict properties.
+# The link direction is part of the key : a reversed link is never merged with a normal one.
+def get_entity_key( entity ) :
+    strict = []
+    direction = None
+    for name, display, matching, value in entity.additionalFields :
+        if name == LINK_DIRECTION :
+            direction = value
+        elif matching is not None and matching.lower().strip() == 'strict' :
+            strict.append(( name, value ))
+    return ( entity.entityType, entity.value, tuple(sorted(strict)), direction )
+
+# Merge the properties of 'duplicate' into 'entity'
+#   - properties : the first value is kept, missing or empty ones are filled
+#   - link labels and notes : every distinct one is kept
+#   - link thickness and weight : the biggest one
+def merge_entity( entity , duplicate , fields ) :
+    for field in duplicate.additionalFields :
+        name, value = field[0], field[3]
+        if value is None or value == "" :
+            continue
+
+        current = fields.get(name)
+        if current is None :
+            field = list(field)
+            entity.additionalFields.append(field)
+            fields[name] = field
+        elif current[3] is None or current[3] == "" :
+            current[3] = value
+        elif name == LINK_LABEL :
+            if value not in current[3].split(LABEL_SEPARATOR) :
+                current[3] += LABEL_SEPARATOR + value
+        elif name == NOTES :
+            if value not in current[3] :
+                current[3] += NOTE_SEPARATOR + value
+        elif name == LINK_THICKNESS :
+            try :
+                current[3] = str(max(int(current[3]), int(value)))
+            except ValueError :
+                pass
+
+    entity.weight = max(entity.weight, duplicate.weight)
+    if not entity.iconURL :
+        entity.iconURL = duplicate.iconURL
+    for information in duplicate.displayInformation :
+        if information not in entity.displayInformation :
+            entity.displayInformation.append(information)
+    for overlay in duplicate.overlays :
+        if overlay not in entity.overlays :
+            entity.overlays.append(overlay)
+
+# Merge the duplicated entities of a response, in the order of their first appearance
+def merge_duplicates( response ) :
+    merged = {}
+    entities = []
+    for entity in response.entities :
+        key = get_entity_key(entity)
+        item = merged.get(key)
+        if item is None :
+            # Index of the properties by name, for the next copies
+            merged[key] = ( entity, { field[0]: field for field in entity.additionalFields } )
+            entities.append(entity)
+        else :
+            merge_entity(item[0], entity, item[1])
+    response.entities = entities
+    return response
+
+
+## OUTPUT
+
+# Same XML as MaltegoTransform.returnOutput() : maltego-trx indents the document with 2 spaces then
+# canonicalizes it (C14N : sorted attributes, no empty element tags, and the escapes below).
+# The text of the elements is parsed again by the canonicalization : "\r" become "\n".
+INDENT = "  "
+ENTITY_LEVEL = 3
+ENTITIES_TAG = "<Entities></Entities>"
+
+def escape_text( text ) :
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def escape_attribute( value ) :
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+    return value.replace("\t", "&#x9;").replace("\n", "&#xA;").replace("\r", "&#xD;")
+
+# Canonical XML of an element (from MaltegoEntity.build_xml) at its indentation level
+def write_element( element , level , parts ) :
+    attributes = "".join(f' {name}="{escape_attribute(value)}"' for name, value in sorted(element.attrib.items()))
+    parts.append(f"<{element.tag}{attributes}>")
+    if len(element) == 0 :
+        parts.append(escape_text(element.text or ""))
+    else :
+        for child in element :
+            parts.append("\n" + INDENT * (level + 1))
+            write_element(child, level + 1, parts)
+        parts.append("\n" + INDENT * level)
+    parts.append(f"</{element.tag}>")
+    return parts
+
+# XML of the response, in chunks : the envelope and the UI messages, then one chunk by entity
+def iter_output( response ) :
+    # Envelope serialized by maltego-trx without the entities
+    envelope = MaltegoTransform()
+    envelope.UIMessages = response.UIMessages
+    output = envelope.returnOutput()
+    if len(response.entities) == 0 :
+        yield output
+        return
+
+    head, tail = output.split(ENTITIES_TAG, 1)
+    yield head + "<Entities>"
+    for entity in response.entities :
+        yield "".join(write_element(entity.build_xml(), ENTITY_LEVEL, [ "\n" + INDENT * ENTITY_LEVEL ]))
+    yield "\n" + INDENT * (ENTITY_LEVEL - 1) + "</Entities>" + tail
+
+
+## TRANSFORMS
+
+# Base class of the Pappers transforms : the duplicates are merged before the output is built
+class PappersTransform( DiscoverableTransform ) :
+
+    # The entities are all created (and merged) before the first chunk : an exception of the
+    # transform is raised here, before anything is written
+    @classmethod
+    def run_transform_stream( cls , request ) :
+        response = MaltegoTransform()
+        cls.create_entities(request, response)
+        merge_duplicates(response)
+        return iter_output(response)
+
+    @classmethod
+    def run_transform( cls , request ) :
+        return "".join(cls.run_transform_stream(request))
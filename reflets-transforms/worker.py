@@ -0,0 +1,323 @@
+# Persistent worker for the local transforms
+#
+# Even with a fast start, Maltego spawns one Python interpreter by transform run : running
+# FicheEntreprise on 50 nodes pays 50 startups, and loses the HTTP sessions and the in-memory cache
+# each time. "project.py local ..." is now a small client : it forwards the Maltego arguments over a
+# Unix socket to a long-lived worker process, and writes the output of the transform as it comes.
+#
+# The worker is started on the first call, and stops by itself after MALTEGO_WORKER_IDLE seconds
+# without request (default 600), or when a transform source file changes.
+# Set MALTEGO_WORKER=0 to run every transform in its own process.
+#
+#   python worker.py          : run the worker in the foreground
+#   python worker.py stop     : stop the running worker
+
+import hashlib
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_IDLE_TIMEOUT = 600
+# Maximum wait of the client for a starting worker, in seconds
+STARTUP_TIMEOUT = 10
+
+
+## CLIENT
+
+def is_enabled() :
+    return os.environ.get('MALTEGO_WORKER', '1') != '0' and hasattr(socket, 'AF_UNIX')
+
+# Set MALTEGO_FAST_START=0 to use the complete maltego-trx startup
+def is_local_run( argv ) :
+    if os.environ.get('MALTEGO_FAST_START', '1') == '0' :
+        return False
+    return len(argv) > 3 and argv[1].lower() == 'local'
+
+# The PAPPERS_* variables (API key, configuration file, URLs, debug) are read from the environment
+# of the worker, which is the environment of the client that started it
+def get_environment() :
+    return sorted((name, value) for name, value in os.environ.items() if name.startswith('PAPPERS_'))
+
+# Directory of the sockets, only open to the user : $XDG_RUNTIME_DIR, or a directory of the
+# temporary directory created with mode 0700. The other users cannot create, replace or link the
+# socket and the lock in it.
+def get_runtime_dir() :
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir) :
+        return runtime_dir
+
+    path = os.path.join(tempfile.gettempdir(), f"reflets-transforms-{os.getuid()}")
+    try :
+        os.mkdir(path, 0o700)
+    except FileExistsError :
+        pass
+    # Created before by someone else, or made readable : not used
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700 :
+        raise Exception(f"The worker directory {path} is not a private directory of the user")
+    return path
+
+# One worker by user, by project directory and by Pappers environment : a call with another API
+# key or another configuration never runs in the worker of a previous one
+def get_socket_path() :
+    if 'MALTEGO_WORKER_SOCKET' in os.environ :
+        return os.environ['MALTEGO_WORKER_SOCKET']
+    project = hashlib.sha1(PROJECT_DIR.encode('utf-8')).hexdigest()[:10]
+    environment = hashlib.sha1(json.dumps(get_environment()).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(get_runtime_dir(), f"reflets-transforms-{project}-{environment}.sock")
+
+
+def connect( socket_path ) :
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try :
+        client.connect(socket_path)
+    except OSError :
+        client.close()
+        return None
+    return client
+
+def start_worker() :
+    subprocess.Popen([ sys.executable, os.path.join(PROJECT_DIR, 'worker.py') ], cwd=PROJECT_DIR,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+# Connect to the running worker, start it if needed
+def connect_or_start( socket_path ) :
+    client = connect(socket_path)
+    if client is not None :
+        return client
+
+    start_worker()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline :
+        time.sleep(0.05)
+        client = connect(socket_path)
+        if client is not None :
+            return client
+    return None
+
+# Send a request and write the answer of the worker as it arrives : one JSON object by line, with
+# the 'stdout' and 'stderr' written by the transform, then 'done'
+# Return the last answer, or None if the worker cannot answer (nothing has been written then)
+def call_worker( socket_path , message ) :
+    client = connect_or_start(socket_path)
+    if client is None :
+        return None
+    answer = None
+    written = False
+    try :
+        client.sendall(json.dumps(message).encode('utf-8') + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('rb') as answers :
+            for line in answers :
+                answer = json.loads(line.decode('utf-8'))
+                if 'stderr' in answer :
+                    sys.stderr.write(answer['stderr'])
+                if 'stdout' in answer :
+                    # Written through : Maltego reads the first entities while the next ones are written
+                    sys.stdout.write(answer['stdout'])
+                    sys.stdout.flush()
+                    written = True
+                if answer.get('done') or answer.get('restart') :
+                    return answer
+    except (OSError, ValueError) :
+        pass
+    finally :
+        client.close()
+
+    # The output already written cannot be taken back : the transform is not run again
+    if written :
+        sys.stderr.write("The worker stopped before the end of the transform output\n")
+        return { 'done': True }
+    return None
+
+
+# Run a local transform in the worker, or in this process when the worker is not available
+def run_local( transform_name , local_args ) :
+    socket_path = None
+    if is_enabled() :
+        try :
+            socket_path = get_socket_path()
+        except Exception as e :
+            # The transform still runs, in this process
+            sys.stderr.write(f"Worker not available: {e}\n")
+
+    if socket_path is not None :
+        message = { 'transform': transform_name, 'args': local_args }
+        answer = call_worker(socket_path, message)
+        # The worker answers 'restart' when the transforms have changed since its start
+        if answer is not None and answer.get('restart') :
+            answer = call_worker(socket_path, message)
+
+        if answer is not None and answer.get('done') :
+            return
+
+    import launcher
+    launcher.run_local(transform_name, local_args)
+
+
+## WORKER
+
+# Per-thread capture of stdout / stderr : the transforms running at the same time in the worker
+# each send their own output to their client, as if they were alone in their process
+class ThreadOutput :
+    def __init__( self , default ) :
+        self.default = default
+        self.local = threading.local()
+
+    # The writes of this thread are given to 'sink' instead of the default stream
+    def capture( self , sink ) :
+        self.local.sink = sink
+
+    def release( self ) :
+        self.local.sink = None
+
+    def write( self , data ) :
+        sink = getattr(self.local, 'sink', None)
+        if sink is None :
+            return self.default.write(data)
+        sink(data)
+        return len(data)
+
+    def flush( self ) :
+        if getattr(self.local, 'sink', None) is None :
+            self.default.flush()
+
+    def __getattr__( self , name ) :
+        return getattr(self.default, name)
+
+
+def get_sources_mtime() :
+    import glob
+    import launcher
+    sources = launcher.CONFIG_SOURCES + glob.glob(os.path.join(launcher.TRANSFORMS_DIR, '*.py'))
+    sources.append(os.path.join(PROJECT_DIR, 'launcher.py'))
+    sources.append(os.path.join(PROJECT_DIR, 'worker.py'))
+    return max(os.path.getmtime(path) for path in sources)
+
+
+def serve( socket_path ) :
+    import fcntl
+    import socketserver
+    import launcher
+
+    # Only one worker may bind the socket : the others exit
+    # The lock is never opened through a symbolic link
+    lock_file = os.fdopen(os.open(socket_path + ".lock", os.O_CREAT | os.O_WRONLY | os.O_NOFOLLOW, 0o600), 'w')
+    try :
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError :
+        return
+    existing = connect(socket_path)
+    if existing is not None :
+        existing.close()
+        return
+    if os.path.exists(socket_path) :
+        os.unlink(socket_path)
+
+    # Warm up : every transform is imported once for all
+    launcher.import_transforms()
+    sources_mtime = get_sources_mtime()
+
+    stdout = ThreadOutput(sys.stdout)
+    stderr = ThreadOutput(sys.stderr)
+    sys.stdout = stdout
+    sys.stderr = stderr
+
+    state = { 'active': 0, 'last': time.monotonic(), 'stopping': False }
+    state_lock = threading.Lock()
+
+    # Free the socket path and the lock right now for the next worker
+    def release() :
+        with state_lock :
+            if not lock_file.closed :
+                if os.path.exists(socket_path) :
+                    os.unlink(socket_path)
+                lock_file.close()
+
+    idle_timeout = float(os.environ.get('MALTEGO_WORKER_IDLE', DEFAULT_IDLE_TIMEOUT))
+
+    class Handler(socketserver.StreamRequestHandler) :
+        # One JSON object by line. A client gone away only loses the rest of its output.
+        def send( self , answer ) :
+            if self.closed :
+                return
+            try :
+                self.wfile.write(json.dumps(answer).encode('utf-8') + b"\n")
+            except OSError :
+                self.closed = True
+
+        def handle( self ) :
+            self.closed = False
+            with state_lock :
+                state['active'] += 1
+            try :
+                message = json.loads(self.rfile.readline().decode('utf-8'))
+
+                if message.get('stop') :
+                    answer = { 'stopped': True }
+                    state['stopping'] = True
+                elif state['stopping'] or get_sources_mtime() != sources_mtime :
+                    # The code has changed : a new worker will load it
+                    answer = { 'restart': True }
+                    state['stopping'] = True
+                else :
+                    # The output is sent to the client as the transform writes it
+                    stdout.capture(lambda data : self.send({ 'stdout': data }))
+                    stderr.capture(lambda data : self.send({ 'stderr': data }))
+                    try :
+                        launcher.run_local(message['transform'], message['args'])
+                    finally :
+                        stdout.release()
+                        stderr.release()
+                    answer = { 'done': True }
+
+                if state['stopping'] :
+                    release()
+                self.send(answer)
+            finally :
+                with state_lock :
+                    state['active'] -= 1
+                    state['last'] = time.monotonic()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer) :
+        daemon_threads = True
+
+    server = Server(socket_path, Handler)
+
+    # Stop when idle, or when asked to
+    def watchdog() :
+        while True :
+            time.sleep(1)
+            with state_lock :
+                idle = state['active'] == 0 and time.monotonic() - state['last'] > idle_timeout
+                if idle or (state['stopping'] and state['active'] == 0) :
+                    break
+        server.shutdown()
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    try :
+        server.serve_forever()
+    finally :
+        server.server_close()
+        release()
+
+
+if __name__ == '__main__' :
+    if len(sys.argv) > 1 and sys.argv[1] == 'stop' :
+        client = connect(get_socket_path())
+        if client is not None :
+            client.sendall(json.dumps({ 'stop': True }).encode('utf-8') + b"\n")
+            client.shutdown(socket.SHUT_WR)
+            client.recv(1024)
+            client.close()
+    else :
+        serve(get_socket_path())